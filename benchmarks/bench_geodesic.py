@@ -0,0 +1,80 @@
+import argparse
+import os.path
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools import geodesic
+
+
+#
+# Geodesic benchmark - vectorized inverse problem against per-point calls
+#
+# Random line pairs a few hundred meters long around a project area are solved
+# once as whole arrays with tools.geodesic and once a pair at a time, with
+# arcpy PointGeometry.angleAndDistanceTo where arcpy is installed and per-pair
+# geodesic.inverse calls otherwise.
+#
+#   python benchmarks/bench_geodesic.py --count 1000000 --loop 20000
+#
+
+def random_pairs(count, seed=0):
+    rng = np.random.default_rng(seed)
+    lon1 = rng.uniform(-120.5, -120.0, count)
+    lat1 = rng.uniform(34.5, 35.0, count)
+    lon2 = lon1 + rng.uniform(-0.005, 0.005, count)
+    lat2 = lat1 + rng.uniform(-0.005, 0.005, count)
+    return lon1, lat1, lon2, lat2
+
+
+def per_point_arcpy(lon1, lat1, lon2, lat2):
+    import arcpy
+    sr = arcpy.SpatialReference(4326)
+    distances = []
+    for pair in zip(lon1, lat1, lon2, lat2):
+        p1 = arcpy.PointGeometry(arcpy.Point(pair[0], pair[1]), sr)
+        p2 = arcpy.PointGeometry(arcpy.Point(pair[2], pair[3]), sr)
+        distances.append(p1.angleAndDistanceTo(p2, 'GEODESIC')[1])
+    return np.array(distances)
+
+
+def per_point_numpy(lon1, lat1, lon2, lat2):
+    return np.array([float(geodesic.distance(*pair)) for pair in zip(lon1, lat1, lon2, lat2)])
+
+
+def timed(label, count, func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - started
+    print('%-28s %9d pairs %8.3f s %12.0f pairs/s' % (label, count, elapsed, count / elapsed if elapsed else 0.0))
+    return result, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Geodesic inverse problem throughput.')
+    parser.add_argument('--count', type=int, default=1000000, help='pairs solved as arrays (default: 1000000)')
+    parser.add_argument('--loop', type=int, default=20000, help='pairs solved one at a time (default: 20000)')
+    args = parser.parse_args(argv)
+
+    pairs = random_pairs(args.count)
+    _, vector_secs = timed('geodesic.inverse (arrays)', args.count, geodesic.inverse, *pairs)
+
+    loop = [v[:args.loop] for v in pairs]
+    try:
+        import arcpy  # noqa: F401
+        label, func = 'arcpy angleAndDistanceTo', per_point_arcpy
+    except ImportError:
+        label, func = 'geodesic.inverse (per pair)', per_point_numpy
+    expected = geodesic.distance(*loop)
+    distances, loop_secs = timed(label, args.loop, func, *loop)
+
+    print('Max difference: %.6f m' % np.abs(distances - expected).max())
+    if vector_secs and loop_secs:
+        print('Speedup: %.0fx' % ((args.count / vector_secs) / (args.loop / loop_secs)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,400 @@
+import argparse
+import contextlib
+import datetime
+import fnmatch
+import io
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as etree
+
+os.environ.setdefault('TRANSFORM_TOOLS_BACKEND', 'memory')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+
+import synthetic
+from tools.backend import BACKEND, arcpy
+import tools.columnar as columnar
+import tools.defaults as defaults
+import tools.import_gpx as import_gpx
+import tools.link_discovery as link_discovery
+import tools.timing as timing
+import tools.transform as transform
+from tools.export_gpx import export_gpx
+from tools.export_pnezd import export_pnezd
+from tools.import_pnezd import import_pnezd
+
+
+#
+# Benchmark suite - hot path throughput on synthetic survey data
+#
+# Each case is timed at every size (points, waypoints, track points or links) on
+# files written by benchmarks/synthetic.py. The tool cases run the import and
+# export tools on the in-memory backend and keep the stage times reported by
+# tools.timing. Results are written as JSON, and --compare reports the cases that
+# got slower than a previous results file, so the hot paths can be tracked from
+# release to release on a plain Linux box.
+#
+#   python benchmarks/bench_suite.py --sizes 1e3 1e4 1e5 --output results.json
+#   python benchmarks/bench_suite.py --cases 'calculate_transform.*' --sizes 1e6 1e7
+#   python benchmarks/bench_suite.py --output new.json --compare results.json
+#
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+# Largest size for cases that loop over points one at a time in Python
+PER_POINT_LIMIT = 100000
+
+# Largest size for the tool and file parsing cases, which hold whole files in memory
+TOOL_LIMIT = 1000000
+
+# Slowdown reported as a regression by --compare
+REGRESSION_THRESHOLD = 1.25
+
+# Projected coordinate system of the tool cases (US feet) and the fixed project point
+# of its equirectangular projection from WGS 1984
+PROJECT_SR_CODE = 2229
+PROJECT_FEET = 0.3048006096012192
+PROJECT_FALSE_ORIGIN = (5800000.0, 2060000.0)
+
+EARTH_RADIUS = 6378137.0
+
+
+def project_spatial_reference():
+    # Spatial reference of the tool cases, with its projection from WGS 1984 on the memory backend
+    sr = arcpy.SpatialReference(PROJECT_SR_CODE, metersPerUnit=PROJECT_FEET)
+    lon0, lat0 = synthetic.GEOGRAPHIC_CENTER
+    x0, y0 = PROJECT_FALSE_ORIGIN
+    k = EARTH_RADIUS / PROJECT_FEET
+
+    def forward(lon, lat):
+        return x0 + np.radians(lon - lon0) * k * math.cos(math.radians(lat0)), y0 + np.radians(lat - lat0) * k
+
+    def inverse(x, y):
+        return lon0 + np.degrees((x - x0) / k / math.cos(math.radians(lat0))), lat0 + np.degrees((y - y0) / k)
+
+    arcpy.register_projection(arcpy.SpatialReference(4326), sr, forward, inverse)
+    return sr
+
+
+def link_transform():
+    # The similarity transform the synthetic links were made with
+    angle = math.radians(synthetic.LINK_ROTATION)
+    R = synthetic.LINK_SCALE * np.array([[math.cos(angle), -math.sin(angle)], [math.sin(angle), math.cos(angle)]])
+    return transform.Transform(R, np.array(synthetic.LINK_TRANSLATION))
+
+
+class Data(object):
+    """ Synthetic input files in a folder, written once per kind and size. """
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def path(self, kind, size, write):
+        path = os.path.join(self.folder, '%s-%d.%s' % (kind, size, {'pnezd': 'txt', 'links': 'xml'}.get(kind, kind)))
+        if not os.path.isfile(path):
+            write(path)
+        return path
+
+    def pnezd(self, size):
+        return self.path('pnezd', size, lambda path: synthetic.write_pnezd(path, size))
+
+    def waypoints(self, size):
+        return self.path('gpx', size, lambda path: synthetic.write_gpx(path, size))
+
+    def tracks(self, size):
+        return self.path('track', size, lambda path: synthetic.write_gpx(path, 0, size, tracks=10))
+
+    def links(self, size):
+        return self.path('links', size, lambda path: synthetic.write_links(path, size))
+
+    def arrow(self, size):
+        # Arrow IPC file with the N, E and Z columns of Export PNEZD
+        def write(path):
+            north, east, elevation = synthetic.local_points(0, size)
+            columnar.write_columns(path, [('N', north), ('E', east), ('Z', elevation)])
+        return self.path('arrow', size, write)
+
+    def params(self):
+        path = os.path.join(self.folder, 'params.txt')
+        if not os.path.isfile(path):
+            link_transform().save(path)
+        return path
+
+
+#
+# Cases - each prepares its inputs for a size and returns the function to time
+#
+
+def forward_points(size, data):
+    xfm, pts = link_transform(), synthetic.survey_links(size)
+    src = np.array([link[1] for link in pts])
+    return lambda: xfm.forward_points(src)
+
+
+def columnar_forward_points(size, data):
+    # Memory mapped Arrow columns straight into the vectorized transform
+    xfm, path = link_transform(), data.arrow(size)
+
+    def run():
+        columns = columnar.read_columns(path, ['E', 'N'])
+        return xfm.forward_points(np.column_stack((columns['E'], columns['N'])))
+
+    return run
+
+
+def inverse_points(size, data):
+    xfm, pts = link_transform(), synthetic.survey_links(size)
+    dst = np.array([link[2] for link in pts])
+    return lambda: xfm.inverse_points(dst)
+
+
+def forward(size, data):
+    xfm = link_transform()
+    src = [link[1] for link in synthetic.survey_links(size)]
+    return lambda: [xfm.forward(pt) for pt in src]
+
+
+def inverse(size, data):
+    xfm = link_transform()
+    dst = [link[2] for link in synthetic.survey_links(size)]
+    return lambda: [xfm.inverse(pt) for pt in dst]
+
+
+def fit(rotate, scale):
+    # calculate_transform with the rotation and scale fixed or fitted
+    def case(size, data):
+        links = synthetic.survey_links(size)
+        return lambda: transform.calculate_transform(links, rotate=rotate, scale=scale)
+    return case
+
+
+def calculate_errors(size, data):
+    links = synthetic.survey_links(size)
+    xfm = transform.calculate_transform(links)
+    return lambda: list(transform.calculate_errors(xfm, links)[0])
+
+
+def discover_links(size, data):
+    # Shuffled targets matched from the link transform rotated by 0.001 degrees and shifted by 1
+    links = synthetic.survey_links(size)
+    order = np.random.default_rng(4).permutation(size)
+    names = [link[0] for link in links]
+    src = np.array([link[1] for link in links])
+    dst = np.array([link[2] for link in links])[order]
+    angle = math.radians(synthetic.LINK_ROTATION + 0.001)
+    R = synthetic.LINK_SCALE * np.array([[math.cos(angle), -math.sin(angle)], [math.sin(angle), math.cos(angle)]])
+    xfm = transform.Transform(R, np.array(synthetic.LINK_TRANSLATION) + 1.0)
+    return lambda: link_discovery.discover_links(names, src, [names[i] for i in order], dst, xfm, 10.0)
+
+
+def parse_links(size, data):
+    path = data.links(size)
+    return lambda: defaults.parse_defaults(path)
+
+
+def read_tracks(size, data):
+    # Track parsing and segmentation, projection left out
+    gpx = etree.parse(data.tracks(size)).getroot()
+
+    def project(lon, lat):
+        return list(zip(lon.tolist(), lat.tolist()))
+
+    return lambda: import_gpx.read_tracks(gpx, project, [])
+
+
+class ToolRun(object):
+    # Tool run into a new in-memory feature class each time
+    def __init__(self, func):
+        self.func = func
+        self.runs = 0
+
+    def __call__(self):
+        self.runs += 1
+        return self.func('memory/bench/run%d' % self.runs)
+
+
+def pnezd_import(size, data):
+    pnezd_file, params = data.pnezd(size), data.params()
+    return ToolRun(lambda fc: import_pnezd(pnezd_file, params, fc))
+
+
+def pnezd_export(size, data):
+    pnezd_file, params = data.pnezd(size), data.params()
+    import_pnezd(pnezd_file, params, 'memory/bench/points')
+    out_file = os.path.join(data.folder, 'export.txt')
+    return lambda: export_pnezd('memory/bench/points', params, out_file)
+
+
+def gpx_import(size, data):
+    gpx_file = data.waypoints(size)
+    return ToolRun(lambda fc: import_gpx.import_gpx(gpx_file, fc, None, workers=1))
+
+
+def gpx_export(size, data):
+    import_gpx.import_gpx(data.waypoints(size), 'memory/bench/waypoints', None, workers=1)
+    out_file = os.path.join(data.folder, 'export.gpx')
+    return lambda: export_gpx('memory/bench/waypoints', out_file, False, False)
+
+
+# (name, case, size limit, runs a tool on the memory backend)
+CASES = [
+    ('transform.forward_points', forward_points, None, False),
+    ('transform.inverse_points', inverse_points, None, False),
+    ('transform.forward', forward, PER_POINT_LIMIT, False),
+    ('transform.inverse', inverse, PER_POINT_LIMIT, False),
+    ('columnar.forward_points', columnar_forward_points, None, False),
+    ('calculate_transform.rotate_scale', fit(synthetic.LINK_ROTATION, synthetic.LINK_SCALE), None, False),
+    ('calculate_transform.rotate', fit(synthetic.LINK_ROTATION, None), None, False),
+    ('calculate_transform.scale', fit(None, synthetic.LINK_SCALE), None, False),
+    ('calculate_transform.conformal', fit(None, None), None, False),
+    ('calculate_errors', calculate_errors, None, False),
+    ('link_discovery.discover_links', discover_links, TOOL_LIMIT, False),
+    ('defaults.parse_links', parse_links, TOOL_LIMIT, False),
+    ('import_gpx.read_tracks', read_tracks, TOOL_LIMIT, False),
+    ('import_pnezd', pnezd_import, TOOL_LIMIT, True),
+    ('export_pnezd', pnezd_export, TOOL_LIMIT, True),
+    ('import_gpx', gpx_import, TOOL_LIMIT, True),
+    ('export_gpx', gpx_export, TOOL_LIMIT, True),
+]
+
+
+def tool_stages(trace_file):
+    # Stage seconds of the last run in a timing trace, stages run more than once summed
+    with open(trace_file) as f:
+        run = json.loads(f.readlines()[-1])
+    stages = {}
+    for span in run['spans']:
+        if span['depth'] > 0:
+            stages[span['stage']] = stages.get(span['stage'], 0.0) + span['elapsed']
+    return stages
+
+
+def measure(name, case, size, data, repeat, tool):
+    # Median and best seconds of repeat runs, with the stage times of the median tool run
+    trace_file = os.path.join(data.folder, 'trace.jsonl')
+    with contextlib.redirect_stdout(io.StringIO()):
+        func = case(size, data)
+        times, stages = [], []
+        for _ in range(repeat):
+            if tool:
+                os.environ[timing.TRACE_VARIABLE] = trace_file
+            try:
+                started = time.perf_counter()
+                func()
+                times.append(time.perf_counter() - started)
+            finally:
+                os.environ.pop(timing.TRACE_VARIABLE, None)
+            if tool:
+                stages.append(tool_stages(trace_file))
+        if BACKEND == 'memory':
+            arcpy.clear()
+
+    median = statistics.median(times)
+    result = {'case': name, 'size': size, 'seconds': median, 'best': min(times), 'runs': times,
+              'rows_per_sec': size / median if median > 0.0 else None}
+    if stages:
+        result['stages'] = stages[sorted(range(len(times)), key=times.__getitem__)[len(times) // 2]]
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_file, threshold):
+    # Print the change against a previous results file, returns the number of regressions
+    with open(baseline_file) as f:
+        baseline = dict(((r['case'], r['size']), r) for r in json.load(f)['results'])
+    regressions = 0
+    print('Compared with %s' % baseline_file)
+    for result in results:
+        old = baseline.get((result['case'], result['size']))
+        if old is None or not old['seconds']:
+            continue
+        ratio = result['seconds'] / old['seconds']
+        flag = ''
+        if ratio > threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print('%-34s %9d %10.4f s -> %10.4f s %7.2fx%s' % (result['case'], result['size'], old['seconds'],
+                                                          result['seconds'], ratio, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Hot path benchmarks on synthetic survey data.')
+    parser.add_argument('--sizes', type=float, nargs='+', default=DEFAULT_SIZES,
+                        help='points or links per case (default: 1e3 1e4 1e5)')
+    parser.add_argument('--cases', default='*', help='case name pattern (default: all)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case and size (default: 3)')
+    parser.add_argument('--data', help='folder keeping the generated files between runs (default: a temporary folder)')
+    parser.add_argument('--no-limits', action='store_true', help='run every case at every size')
+    parser.add_argument('--output', help='results JSON file')
+    parser.add_argument('--compare', help='previous results JSON file')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help='slowdown reported as a regression (default: %.2f)' % REGRESSION_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    cases = [c for c in CASES if fnmatch.fnmatch(c[0], args.cases)]
+    if BACKEND != 'memory':
+        print('Tool cases need TRANSFORM_TOOLS_BACKEND=memory, skipped.')
+        cases = [c for c in cases if not c[3]]
+    if columnar.pa is None:
+        print('Columnar cases need the pyarrow package, skipped.')
+        cases = [c for c in cases if not c[0].startswith('columnar.')]
+    if BACKEND == 'memory':
+        arcpy.env.outputCoordinateSystem = project_spatial_reference()
+
+    with contextlib.ExitStack() as stack:
+        folder = args.data or stack.enter_context(tempfile.TemporaryDirectory(prefix='bench-'))
+        os.makedirs(folder, exist_ok=True)
+        data = Data(folder)
+
+        results = []
+        for size in sorted(int(s) for s in args.sizes):
+            for name, case, limit, tool in cases:
+                if limit and size > limit and not args.no_limits:
+                    continue
+                result = measure(name, case, size, data, args.repeat, tool)
+                results.append(result)
+                line = '%-34s %9d %10.4f s %14.0f rows/s' % (name, size, result['seconds'], result['rows_per_sec'] or 0)
+                if 'stages' in result:
+                    line += '  ' + ' '.join('%s=%.3f' % s for s in result['stages'].items())
+                print(line)
+
+    report = {
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+        'backend': BACKEND,
+        'repeat': args.repeat,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import argparse
+import importlib
+import os.path
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+#
+# Toolbox benchmark - time to open and refresh Transform_Tools.pyt
+#
+# Each run starts a fresh interpreter and loads the toolbox the way ArcGIS Pro
+# does: execute the .pyt, create the Toolbox and every tool for its label. A
+# refresh repeats that in the same process. The eager mode imports and reloads
+# every tool module and creates the real tool classes, as the toolbox did before
+# the lazy registry. Set TRANSFORM_TOOLS_BACKEND=memory to run without arcpy.
+#
+#   python benchmarks/bench_toolbox.py --runs 10
+#
+
+PYT = os.path.join(ROOT, 'Transform_Tools.pyt')
+
+
+def load_lazy():
+    namespace = {'__name__': 'Transform_Tools'}
+    with open(PYT) as f:
+        exec(compile(f.read(), PYT, 'exec'), namespace)
+    toolbox = namespace['Toolbox']()
+    return [tool().label for tool in toolbox.tools]
+
+
+def load_eager():
+    from tools.registry import TOOLS
+    labels = []
+    for name, module, _, _ in TOOLS:
+        module = importlib.reload(importlib.import_module(module))
+        labels.append(getattr(module, name)().label)
+    return labels
+
+
+def child(mode):
+    # Open and refresh times (ms) and the number of modules loaded, printed for the parent
+    load = load_lazy if mode == 'lazy' else load_eager
+    before = len(sys.modules)
+    started = time.perf_counter()
+    load()
+    opened = time.perf_counter() - started
+    started = time.perf_counter()
+    load()
+    refreshed = time.perf_counter() - started
+    print('%.3f %.3f %d' % (opened * 1000.0, refreshed * 1000.0, len(sys.modules) - before))
+
+
+def measure(mode, runs):
+    results = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', mode], check=True,
+                             capture_output=True, text=True).stdout.split()
+        results.append((float(out[0]), float(out[1]), int(out[2])))
+    opened = statistics.median(r[0] for r in results)
+    refreshed = statistics.median(r[1] for r in results)
+    print('%-6s open %9.1f ms  refresh %9.1f ms  modules %5d' % (mode, opened, refreshed, results[0][2]))
+    return opened, refreshed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Toolbox open and refresh latency.')
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per mode (default: 5)')
+    parser.add_argument('--child', choices=('lazy', 'eager'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child(args.child)
+        return
+
+    eager = measure('eager', args.runs)
+    lazy = measure('lazy', args.runs)
+    print('Speedup: open %.0fx  refresh %.0fx' % (eager[0] / lazy[0], eager[1] / lazy[1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+import argparse
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+
+#
+# Synthetic survey data - PNEZD, GPX, DXF and link table generators for the benchmarks
+#
+# Points are scattered over a project area around the sample data in cad/ and gpx/,
+# local coordinates near N 10000, E 20000 and waypoints near 34.67N 120.42W. Every
+# generator takes a seed so the same files are written on every run, and writes in
+# chunks so files of 10^7 points are written without holding them in memory.
+#
+#   python benchmarks/synthetic.py pnezd points.txt --count 1000000
+#   python benchmarks/synthetic.py gpx field.gpx --count 100000 --track-points 1000000
+#   python benchmarks/synthetic.py dxf linework.dxf --count 100000
+#   python benchmarks/synthetic.py links Transform.xml --count 10000
+#
+
+# Local project origin (northing, easting) and extent (feature class units)
+LOCAL_ORIGIN = (10000.0, 20000.0)
+LOCAL_EXTENT = 5000.0
+
+# Waypoint area center (longitude, latitude) and extent (degrees)
+GEOGRAPHIC_CENTER = (-120.42, 34.67)
+GEOGRAPHIC_EXTENT = 0.05
+
+# Similarity transform from local to grid coordinates used for the links
+LINK_ROTATION = 1.25
+LINK_SCALE = 0.99996
+LINK_TRANSLATION = (5800000.0, 2060000.0)
+
+# Rows formatted per write
+CHUNK_SIZE = 100000
+
+# Point descriptions, cycled through
+DESCRIPTIONS = ('3-1/2"BC-CONC_DOWN_0.5', 'HW-MON_UP_0.7', 'IP-1"_TAGGED', 'CP-NAIL', 'TOP-BANK', 'EP')
+
+# Seconds between track points, and the pause that starts a new track segment
+TRACK_INTERVAL = 1
+TRACK_PAUSE = 900
+
+GPX_HEADER = ('<?xml version="1.0" encoding="utf-8"?>\n'
+              '<gpx creator="ArcGIS Coordinate Transform" version="1.1" '
+              'xmlns="http://www.topografix.com/GPX/1/1" '
+              'xmlns:wptx1="http://www.garmin.com/xmlschemas/WaypointExtension/v1">\n')
+
+TRACK_START = datetime(2018, 11, 28, 16, 0, 0, tzinfo=timezone.utc)
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def _chunks(count):
+    for start in range(0, count, CHUNK_SIZE):
+        yield start, min(count, start + CHUNK_SIZE)
+
+
+def local_points(start, stop, seed=0):
+    # Northings, eastings and elevations of points start..stop, seeded by the seed and start
+    rng = np.random.default_rng([seed, start])
+    n = stop - start
+    north = LOCAL_ORIGIN[0] + rng.uniform(-LOCAL_EXTENT, LOCAL_EXTENT, n)
+    east = LOCAL_ORIGIN[1] + rng.uniform(-LOCAL_EXTENT, LOCAL_EXTENT, n)
+    elevation = 100.0 + 0.01 * (north - LOCAL_ORIGIN[0]) + rng.normal(0.0, 0.5, n)
+    return north, east, elevation
+
+
+def write_pnezd(path, count, seed=0):
+    # PNEZD file of count points numbered from 1
+    with open(path, 'w') as f:
+        for start, stop in _chunks(count):
+            north, east, elevation = local_points(start, stop, seed)
+            f.write(''.join('%d,%.4f,%.4f,%.4f,%s\n' % (start + i + 1, n, e, z, DESCRIPTIONS[(start + i) % 6])
+                            for i, (n, e, z) in enumerate(zip(north.tolist(), east.tolist(), elevation.tolist()))))
+    return count
+
+
+def _track_points(start, stop, seed):
+    # Longitudes and latitudes of track points start..stop, a slow loop over the project area
+    # with a few meters of jitter
+    i = np.arange(start, stop, dtype=np.float64)
+    jitter = np.random.default_rng([seed, start, 1]).normal(0.0, 2e-5, (2, stop - start))
+    lon = GEOGRAPHIC_CENTER[0] + GEOGRAPHIC_EXTENT * np.sin(i * 1e-4) + jitter[0]
+    lat = GEOGRAPHIC_CENTER[1] + GEOGRAPHIC_EXTENT * np.sin(i * 1.3e-4) + jitter[1]
+    return lon, lat
+
+
+def write_gpx(path, count, track_points=0, tracks=1, segment_points=3600, seed=0):
+    """ GPX file with count waypoints and track_points track points split over tracks.
+        Each track pauses for TRACK_PAUSE seconds every segment_points points, so Import GPX
+        splits it into segments.
+
+    """
+    rng = np.random.default_rng(seed)
+    timestamp = TRACK_START.strftime(TIME_FORMAT)
+    with open(path, 'w') as f:
+        f.write(GPX_HEADER)
+        for start, stop in _chunks(count):
+            lon = GEOGRAPHIC_CENTER[0] + rng.uniform(-GEOGRAPHIC_EXTENT, GEOGRAPHIC_EXTENT, stop - start)
+            lat = GEOGRAPHIC_CENTER[1] + rng.uniform(-GEOGRAPHIC_EXTENT, GEOGRAPHIC_EXTENT, stop - start)
+            ele = rng.uniform(50.0, 150.0, stop - start)
+            f.write(''.join(
+                '  <wpt lat="%.8f" lon="%.8f">\n    <ele>%.4f</ele>\n    <time>%s</time>\n'
+                '    <name>%04d</name>\n    <desc>%s</desc>\n    <sym>Flag, Red</sym>\n    <type>CAD</type>\n'
+                '  </wpt>\n' % (y, x, z, timestamp, start + i + 1, DESCRIPTIONS[(start + i) % 6].replace('"', '&quot;'))
+                for i, (x, y, z) in enumerate(zip(lon.tolist(), lat.tolist(), ele.tolist()))))
+
+        per_track = -(-track_points // tracks) if tracks else 0
+        for track in range(tracks if track_points else 0):
+            first, last = track * per_track, min(track_points, (track + 1) * per_track)
+            if first >= last:
+                break
+            f.write('  <trk>\n    <name>Track %d</name>\n    <trkseg>\n' % (track + 1))
+            for start, stop in _chunks(last - first):
+                lon, lat = _track_points(first + start, first + stop, seed)
+                i = np.arange(start, stop)
+                seconds = (i * TRACK_INTERVAL + (i // segment_points) * TRACK_PAUSE).tolist()
+                f.write(''.join(
+                    '      <trkpt lat="%.8f" lon="%.8f"><ele>%.2f</ele><time>%s</time></trkpt>\n'
+                    % (y, x, 100.0 + (s % 50) * 0.1, (TRACK_START + timedelta(seconds=s)).strftime(TIME_FORMAT))
+                    for x, y, s in zip(lon.tolist(), lat.tolist(), seconds)))
+            f.write('    </trkseg>\n  </trk>\n')
+        f.write('</gpx>\n')
+    return count, track_points
+
+
+def write_dxf(path, count, seed=0):
+    # ASCII DXF with count LINE entities, 10 to 200 unit lines from the local points
+    with open(path, 'w') as f:
+        f.write('0\nSECTION\n2\nENTITIES\n')
+        for start, stop in _chunks(count):
+            north, east, _ = local_points(start, stop, seed)
+            rng = np.random.default_rng([seed, start, 2])
+            length = rng.uniform(10.0, 200.0, stop - start)
+            angle = rng.uniform(0.0, 2.0 * np.pi, stop - start)
+            north2, east2 = north + length * np.cos(angle), east + length * np.sin(angle)
+            f.write(''.join(
+                '0\nLINE\n8\nBOUNDARY\n10\n%.4f\n20\n%.4f\n30\n0.0\n11\n%.4f\n21\n%.4f\n31\n0.0\n' % (e1, n1, e2, n2)
+                for n1, e1, n2, e2 in zip(north.tolist(), east.tolist(), north2.tolist(), east2.tolist())))
+        f.write('0\nENDSEC\n0\nEOF\n')
+    return count
+
+
+def survey_links(count, noise=0.02, seed=0):
+    """ Links from local points to grid points through the LINK_* similarity transform.
+        :return: list of ('name', (x0, y0), (x1, y1)) with normal noise (sigma: noise) on the grid points
+
+    """
+    north, east, _ = local_points(0, count, seed)
+    src = np.column_stack((east, north))
+    angle = np.radians(LINK_ROTATION)
+    R = LINK_SCALE * np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    dst = src.dot(R.T) + LINK_TRANSLATION
+    dst += np.random.default_rng([seed, 3]).normal(0.0, noise, dst.shape)
+    return [(str(i + 1), s, d) for i, (s, d) in enumerate(zip(map(tuple, src.tolist()), map(tuple, dst.tolist())))]
+
+
+def write_links(path, count, sets=0):
+    # Transform.xml with a count link table, and sets further named link sets of the same size
+    with open(path, 'w') as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n<transform>\n'
+                '    <source>Local</source>\n    <target>Grid</target>\n    <output>params.txt</output>\n')
+        for name in [None] + ['set-%d' % (s + 1) for s in range(sets)]:
+            indent = '    '
+            if name:
+                f.write('    <links name="%s">\n' % name)
+                indent = '        '
+            for start, stop in _chunks(count):
+                f.write(''.join(
+                    '%s<link>\n%s    <name>%d</name>\n%s    <source>%d</source>\n%s    <target>%d</target>\n'
+                    '%s    <weight>1.0</weight>\n%s</link>\n' % (indent, indent, i, indent, i, indent, i + 1000000,
+                                                              indent, indent)
+                    for i in range(start + 1, stop + 1)))
+            if name:
+                f.write('    </links>\n')
+        f.write('</transform>\n')
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write synthetic survey data files.')
+    parser.add_argument('kind', choices=('pnezd', 'gpx', 'dxf', 'links'))
+    parser.add_argument('path', help='output file')
+    parser.add_argument('--count', type=float, default=1000, help='points, waypoints, lines or links (default: 1000)')
+    parser.add_argument('--track-points', type=float, default=0, help='GPX track points (default: 0)')
+    parser.add_argument('--tracks', type=int, default=1, help='GPX tracks (default: 1)')
+    parser.add_argument('--sets', type=int, default=0, help='named link sets besides the root links (default: 0)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    args = parser.parse_args(argv)
+
+    count = int(args.count)
+    if args.kind == 'pnezd':
+        write_pnezd(args.path, count, args.seed)
+    elif args.kind == 'gpx':
+        write_gpx(args.path, count, int(args.track_points), args.tracks, seed=args.seed)
+    elif args.kind == 'dxf':
+        write_dxf(args.path, count, args.seed)
+    else:
+        write_links(args.path, count, args.sets)
+
+
+if __name__ == '__main__':
+    main()
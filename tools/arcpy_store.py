@@ -0,0 +1,147 @@
+from tools.backend import arcpy, mgmt
+
+import os.path
+import numpy as np
+
+from tools.feature_store import FeatureStore, NAME_CHUNK_SIZE, POINT_FIELDS, POINT_FIELD_NAMES, TRACK_FIELDS, TRACK_FIELD_NAMES
+
+
+#
+# ArcpyStore - feature store backed by an arcpy workspace (file geodatabase, shapefile, ...)
+#
+
+class ArcpyStore(FeatureStore):
+
+    def exists(self):
+        return arcpy.Exists(self.path)
+
+    def spatial_reference(self):
+        return arcpy.Describe(self.path).spatialReference
+
+    def field_names(self):
+        return [f.name.upper() for f in arcpy.ListFields(self.path)]
+
+    def has_z(self):
+        return arcpy.Describe(self.path).hasZ
+
+    def _create(self, name, geometry_type, fields, sr):
+        # Build a feature class in the scratch workspace
+        arcpy.env.addOutputsToMap = False
+
+        scratch_fc = os.path.join(arcpy.env.scratchWorkspace, name)
+
+        mgmt.CreateFeatureclass(*os.path.split(scratch_fc), geometry_type, spatial_reference=sr)
+        for field, field_type, length in fields:
+            if length:
+                mgmt.AddField(scratch_fc, field, field_type, field_length=length)
+            else:
+                mgmt.AddField(scratch_fc, field, field_type)
+
+        return scratch_fc
+
+    def create_points(self, sr):
+        scratch_fc = self._create(os.path.basename(self.path), 'POINT', POINT_FIELDS, sr)
+
+        if self.path != scratch_fc:
+            mgmt.Copy(scratch_fc, self.path)
+            mgmt.Delete(scratch_fc)
+
+        return self.path
+
+    def insert_points(self, rows):
+        fields = ('SHAPE@XY',) + POINT_FIELD_NAMES
+        with arcpy.da.InsertCursor(self.path, fields) as cur:
+            oids = [cur.insertRow(row) for row in rows]
+
+        return oids
+
+    def _oid_clauses(self, oids):
+        # OID IN (...) clauses for a list of object ids
+        oid_field = arcpy.AddFieldDelimiters(self.path, arcpy.Describe(self.path).OIDFieldName)
+        oids = sorted(oids)
+        for i in range(0, len(oids), NAME_CHUNK_SIZE):
+            yield '%s IN (%s)' % (oid_field, ', '.join(str(oid) for oid in oids[i:i + NAME_CHUNK_SIZE]))
+
+    def update_points(self, rows):
+        updates = dict(rows)
+        count = 0
+        fields = ('OID@', 'SHAPE@XY') + POINT_FIELD_NAMES
+        for where in self._oid_clauses(updates):
+            with arcpy.da.UpdateCursor(self.path, fields, where_clause=where) as cur:
+                for row in cur:
+                    cur.updateRow((row[0],) + tuple(updates[row[0]]))
+                    count += 1
+
+        return count
+
+    def delete_points(self, oids):
+        count = 0
+        for where in self._oid_clauses(oids):
+            with arcpy.da.UpdateCursor(self.path, ('OID@',), where_clause=where) as cur:
+                for _ in cur:
+                    cur.deleteRow()
+                    count += 1
+
+        return count
+
+    def read_points(self, fields, spatial_reference=None, order_by=None, where=None):
+        sql_clause = (None, 'ORDER BY %s' % order_by if order_by else None)
+        with arcpy.da.SearchCursor(self.path, fields, where_clause=where, spatial_reference=spatial_reference,
+                                   sql_clause=sql_clause) as cur:
+            for row in cur:
+                yield row
+
+    def set_point_fields(self, fields, compute):
+        existing = self.field_names()
+        for field, field_type, length in fields:
+            if field.upper() not in existing:
+                if length:
+                    mgmt.AddField(self.path, field, field_type, field_length=length)
+                else:
+                    mgmt.AddField(self.path, field, field_type)
+
+        # Coordinates are read in one pass, computed together and written back in a second pass
+        with arcpy.da.SearchCursor(self.path, ('SHAPE@XY',)) as cur:
+            coords = [row[0] for row in cur]
+        valid = [xy is not None and xy[0] is not None for xy in coords]
+        values = iter(zip(*(np.asarray(v).tolist() for v in compute([xy for xy, ok in zip(coords, valid) if ok]))))
+
+        names = tuple(f[0] for f in fields)
+        with arcpy.da.UpdateCursor(self.path, names) as cur:
+            for row, ok in zip(cur, valid):
+                cur.updateRow(next(values) if ok else (None,) * len(names))
+
+        return sum(valid)
+
+    def ensure_name_index(self):
+        for index in arcpy.ListIndexes(self.path):
+            if [f.name.upper() for f in index.fields] == ['NAME']:
+                return
+        try:
+            mgmt.AddIndex(self.path, 'NAME', 'NAME_IDX')
+        except arcpy.ExecuteError:
+            # Layers and locked datasets can still be queried without the index
+            arcpy.AddWarning('Unable to add NAME index: %s' % self.path)
+
+    def name_clause(self, names):
+        quoted = ', '.join("'%s'" % name.replace("'", "''") for name in names)
+        return '%s IN (%s)' % (arcpy.AddFieldDelimiters(self.path, 'NAME'), quoted)
+
+    def name_prefix_clause(self, prefix):
+        return "%s LIKE '%s%%'" % (arcpy.AddFieldDelimiters(self.path, 'NAME'), prefix.replace("'", "''"))
+
+    def write_tracks(self, rows, sr):
+        temp_fc = self._create(os.path.basename(self.path) + '_Temp', 'POLYLINE', TRACK_FIELDS, sr)
+
+        count = 0
+        fields = ('SHAPE@',) + TRACK_FIELD_NAMES
+        with arcpy.da.InsertCursor(temp_fc, fields) as cur:
+            for coords, *values in rows:
+                geom = arcpy.Polyline(arcpy.Array([arcpy.Point(x, y) for x, y in coords]), sr)
+                cur.insertRow((geom,) + tuple(values))
+                count += 1
+
+        mgmt.CopyFeatures(temp_fc, self.path)
+        mgmt.Delete(temp_fc)
+
+        return count
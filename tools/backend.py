@@ -0,0 +1,24 @@
+import os
+
+#
+# Backend - select the arcpy implementation used by the tools
+#
+# Inside ArcGIS Pro the tools use arcpy. Setting the environment variable
+# TRANSFORM_TOOLS_BACKEND=memory, or running where arcpy is not installed,
+# selects the in-memory implementation in tools.memory instead.
+#
+
+BACKEND = os.environ.get('TRANSFORM_TOOLS_BACKEND', 'arcpy').lower()
+
+if BACKEND == 'memory':
+    import tools.memory as arcpy
+else:
+    try:
+        import arcpy
+        import arcpy.da
+        import arcpy.management
+    except ImportError:
+        import tools.memory as arcpy
+        BACKEND = 'memory'
+
+mgmt = arcpy.management
@@ -1,36 +1,83 @@
-import arcpy
-import os.path
-import xml.etree.ElementTree as etree
+from tools.backend import arcpy
+import numpy as np
 import tools.transform as transform
+import tools.rubber_sheet as rubber_sheet
+from tools.defaults import defaults_path, read_defaults
+from tools.feature_store import canonical_name, open_store
+from tools.network import read_covariances
+import tools.registry as registry
+from tools.scale_factor import GridProjection, ScaleFactorError
+import tools.timing as timing
 import tools.utils as utils
 
 # from importlib import reload
 # reload(transform)
 
-DEFAULTS_FILE = r'transform\Transform.xml'
+CORRECTION_NONE = 'NONE'
 
 #
 # CalculateTransform - calculate transform parameters from source and target points
 #
 
-def calculate_transform(source_fc, target_fc, rotate, scale, param_file, links_list):
+def ellipsoid_coordinates(sr):
+    # (function (x, y) -> (lon, lat), semi-major axis, flattening) for a coordinate system, None if unsupported
+    if sr.type == 'Geographic':
+        if getattr(sr, 'semiMajorAxis', None) is None:
+            return None
+        return (lambda x, y: (x, y)), sr.semiMajorAxis, sr.flattening
+    try:
+        projection = GridProjection.from_spatial_reference(sr)
+    except ScaleFactorError:
+        return None
+    return projection.geographic, projection.a, projection.f
+
+
+def link_covariance(sigma_x, sigma_y=None, correlation=None):
+    # 2x2 x/y covariance from link standard deviations, None without a sigma x
+    # Sigma y defaults to sigma x and the correlation to zero
+    if sigma_x is None or str(sigma_x).strip() == '':
+        return None
+    sx = float(sigma_x)
+    sy = float(sigma_y) if sigma_y is not None and str(sigma_y).strip() != '' else sx
+    r = float(correlation) if correlation is not None and str(correlation).strip() != '' else 0.0
+    if sx <= 0.0 or sy <= 0.0 or abs(r) >= 1.0:
+        raise ValueError('Bad standard deviations: %s %s %s' % (sx, sy, r))
+    return np.array([[sx * sx, r * sx * sy], [r * sx * sy, sy * sy]])
+
+
+@timing.timed('Calculate Transform')
+def calculate_transform(source_fc, target_fc, rotate, scale, param_file, links_list, correction=None, cell_size=None,
+                        cov_file=None):
+
+    source_store = open_store(source_fc)
+    target_store = open_store(target_fc)
 
     # Check source and target are using the same coordinate system
-    source_sr = arcpy.Describe(source_fc).spatialReference
-    target_sr = arcpy.Describe(target_fc).spatialReference
+    source_sr = source_store.spatial_reference()
+    target_sr = target_store.spatial_reference()
     if source_sr.factoryCode != target_sr.factoryCode:
         arcpy.AddError('Source and Target feature classes using different coordinate systems.')
         exit(-1)
 
-    # Read the source and target points
-    with arcpy.da.SearchCursor(source_fc, ['NAME', 'SHAPE@XY']) as cur:
-        source_pts = dict(cur)
-    with arcpy.da.SearchCursor(target_fc, ['NAME', 'SHAPE@XY']) as cur:
-        target_pts = dict(cur)
+    # Read only the source and target points referenced by the links
+    with timing.span('read points', 2 * len(links_list)):
+        source_pts = source_store.find_points([link[1] for link in links_list])
+        target_pts = target_store.find_points([link[2] for link in links_list])
+
+    # Target point covariances from a network adjustment
+    covariances = None
+    if cov_file:
+        try:
+            covariances = read_covariances(cov_file)
+        except (IOError, ValueError):
+            arcpy.AddError('Bad covariance file: %s' % cov_file)
+            exit(-1)
 
     links = []
     weights = []
-    for name, source, target, weight in links_list:
+    for link in links_list:
+        name, source, target, weight = link[:4]
+        source, target = canonical_name(source), canonical_name(target)
         if source not in source_pts:
             arcpy.AddError('Source point not found: link=%s name=%s' % (name, source))
             exit(-1)
@@ -42,24 +89,32 @@ def calculate_transform(source_fc, target_fc, rotate, scale, param_file, links_l
         except ValueError:
             arcpy.AddError('Bad weight value: link=%s weight=%s' % (name, weight))
             exit(-1)
+
+        # Link standard deviations, or the target point covariance from a network adjustment,
+        # make the weight a 2x2 matrix, the weight times the inverse covariance
+        sigmas = (list(link[4:7]) + [None] * 3)[:3]
+        try:
+            covariance = link_covariance(*sigmas)
+        except ValueError:
+            arcpy.AddError('Bad link standard deviations: link=%s sigma=%s' % (name, sigmas))
+            exit(-1)
+        if covariance is None and covariances is not None:
+            if target in covariances:
+                covariance = covariances[target][1]
+            else:
+                arcpy.AddWarning('No covariance for target point: link=%s name=%s' % (name, target))
+        if covariance is not None:
+            if np.linalg.det(covariance) > 0.0:
+                weight = weight * np.linalg.inv(covariance)
+            else:
+                arcpy.AddWarning('Singular covariance, scalar weight used: link=%s name=%s' % (name, target))
         links.append([name, source_pts[source], target_pts[target]])
         weights.append([name, weight])
 
     # Rotation can be expressed as signed decimal degrees or signed DMS
     if rotate is not None:
         try:
-            dms = rotate.split()
-            if len(dms) == 3:
-                deg, min, sec = dms
-                dec = utils.dms_degrees([int(deg), int(min), float(sec)])
-            elif len(dms) == 2:
-                deg, min = dms
-                dec = utils.dms_degrees([int(deg), float(min)])
-            elif len(dms) == 1:
-                dec = float(dms)
-            else:
-                raise ValueError
-            rotate = dec
+            rotate = utils.parse_rotation(rotate)
         except ValueError:
             arcpy.AddError('Bad rotation value: %s' % rotate)
             exit(-1)
@@ -76,53 +131,78 @@ def calculate_transform(source_fc, target_fc, rotate, scale, param_file, links_l
     # arcpy.AddMessage('rotate: %s' % rotate)
     # arcpy.AddMessage('scale: %s' % scale)
 
-    xfm = transform.calculate_transform(links, weights=weights, rotate=rotate, scale=scale)
-    xfm.save(param_file)
+    if cell_size:
+        try:
+            cell_size = float(cell_size)
+        except ValueError:
+            arcpy.AddError('Bad grid cell size: %s' % cell_size)
+            exit(-1)
+
+    with timing.span('fit', len(links)):
+        xfm = transform.calculate_transform(links, weights=weights, rotate=rotate, scale=scale)
 
     arcpy.AddMessage('Number of links: %d' % len(links))
     arcpy.AddMessage('Transform type: %s' % xfm.transform_type)
 
     if len(links) > 1:
 
-        link_errors, rms_error = transform.calculate_errors(xfm, links)
+        with timing.span('errors', len(links)):
+            link_errors, rms_error = transform.calculate_errors(xfm, links)
+
+            # Residuals on the ellipsoid for LCC, TM and geographic targets
+            ellipsoid = ellipsoid_coordinates(target_sr)
+            if ellipsoid is not None:
+                geodesic_errors = transform.geodesic_errors(xfm, links, *ellipsoid)
+            else:
+                geodesic_errors = [None] * len(links)
 
         arcpy.AddMessage('Errors:')
-        for name, err in link_errors:
-            arcpy.AddMessage('link %s: err=%.4f' % (name, err))
+        for (name, err), meters in zip(link_errors, geodesic_errors):
+            if meters is None:
+                arcpy.AddMessage('link %s: err=%.4f' % (name, err))
+            else:
+                arcpy.AddMessage('link %s: err=%.4f (%.4f m ellipsoid)' % (name, err, meters))
 
         arcpy.AddMessage('RMS error: %.4f' % rms_error)
 
+    if xfm.covariance is not None:
+        # Rotation (seconds) and scale (ppm) standard errors from the (a1, b1) covariance
+        a1, b1 = xfm.R[:, 0]
+        k2 = a1 * a1 + b1 * b1
+        C = xfm.covariance[2:, 2:]
+        sr = np.sqrt(np.array([-b1, a1]).dot(C).dot([-b1, a1])) / k2
+        sk = np.sqrt(np.array([a1, b1]).dot(C).dot([a1, b1]) / k2)
+        arcpy.AddMessage('Standard errors: a0=%.4f b0=%.4f rotation=%.2f" scale=%.2f ppm' % (
+            np.sqrt(xfm.covariance[0, 0]), np.sqrt(xfm.covariance[1, 1]), np.degrees(sr) * 3600.0,
+            sk / np.sqrt(k2) * 1e6))
+
+    # Optional rubber sheet correction of the similarity residuals
+    if correction and correction.upper() != CORRECTION_NONE:
+        with timing.span('correction', len(links)):
+            xfm.correction = transform.calculate_correction(xfm, links, method=correction.upper(),
+                                                            cell_size=cell_size)
+        if xfm.correction is None:
+            arcpy.AddWarning('Residual correction needs at least three links, none applied.')
+        else:
+            rms_error = transform.calculate_errors(xfm, links)[1]
+            arcpy.AddMessage('Residual correction: %s' % xfm.correction.method)
+            arcpy.AddMessage('RMS error after correction: %.4f' % rms_error)
+
+    xfm.save(param_file)
+
     return
 
 
 class CalculateTransform(object):
     def __init__(self):
-        self.label = "Calculate Transform"
-        self.description = "Calculate parameters for a similarity transform."
+        registry.describe(self)
         self.category = None
         self.canRunInBackground = False
 
     def getParameterInfo(self):
 
-        # Get initial values for the input parameters
-        aprx_path = os.path.dirname(arcpy.mp.ArcGISProject('current').filePath)
-        defaults_file = os.path.join(aprx_path, DEFAULTS_FILE)
-        defaults = {}
-        if os.path.isfile(defaults_file):
-            xml = etree.parse(defaults_file).getroot()
-            for tag in ('source', 'target', 'rotation', 'scale', 'output'):
-                elem = xml.find(tag)
-                if elem is not None:
-                    defaults[tag] = elem.text
-            links = []
-            for link in xml.findall('link'):
-                vals = []
-                for tag in ('name', 'source', 'target', 'weight'):
-                    elem = link.find(tag)
-                    vals.append(elem.text if elem is not None else '')
-                links.append(vals)
-            if links:
-                defaults['links'] = links
+        # Get initial values for the input parameters, cached until Transform.xml changes
+        defaults = read_defaults(defaults_path())
 
         params = []
 
@@ -201,14 +281,80 @@ class CalculateTransform(object):
             ['GPString', 'Name'],
             ['GPString', 'Source Point'],
             ['GPString', 'Target Point'],
-            ['GPString', 'Weight']
+            ['GPString', 'Weight'],
+            ['GPString', 'Sigma X'],
+            ['GPString', 'Sigma Y'],
+            ['GPString', 'Correlation']
         ]
-        if 'links' in defaults:
-            param.value = defaults['links']
+        links = defaults.links()
+        if links:
+            param.value = links
+        params.append(param)
+
+        # Residual correction (rubber sheeting)
+        param = arcpy.Parameter(
+            displayName='Residual Correction',
+            name='correction',
+            datatype='GPString',
+            parameterType='Optional',
+            direction='Input'
+        )
+        param.filter.type = 'ValueList'
+        param.filter.list = [CORRECTION_NONE, rubber_sheet.TIN, rubber_sheet.GRID]
+        param.value = defaults.get('correction', CORRECTION_NONE)
+        params.append(param)
+
+        # Correction grid cell size (optional)
+        param = arcpy.Parameter(
+            displayName='Correction Grid Cell Size',
+            name='cell_size',
+            datatype='GPDouble',
+            parameterType='Optional',
+            direction='Input'
+        )
+        if 'cellsize' in defaults:
+            param.value = defaults['cellsize']
+        params.append(param)
+
+        # Target point covariances from Adjust Network (optional)
+        param = arcpy.Parameter(
+            displayName='Target Covariance File',
+            name='cov_file',
+            datatype='DEFile',
+            parameterType='Optional',
+            direction='Input'
+        )
+        param.filter.list = ['txt']
+        if 'covariances' in defaults:
+            param.value = defaults['covariances']
+        params.append(param)
+
+        # Named link set from Transform.xml (optional)
+        param = arcpy.Parameter(
+            displayName='Link Set',
+            name='link_set',
+            datatype='GPString',
+            parameterType='Optional',
+            direction='Input'
+        )
+        names = [name for name in defaults.link_set_names() if name]
+        if names:
+            param.filter.type = 'ValueList'
+            param.filter.list = names
+        if defaults.get('linkset') in names:
+            param.value = defaults['linkset']
         params.append(param)
 
         return params
 
+    def updateParameters(self, params):
+        # Fill the links from the chosen link set
+        if params[9].altered and not params[9].hasBeenValidated:
+            links = read_defaults(defaults_path()).links(params[9].valueAsText or '')
+            if links:
+                params[5].value = links
+        return
+
     def execute(self, params, messages):
         source_fc = params[0].valueAsText
         target_fc = params[1].valueAsText
@@ -216,8 +362,12 @@ class CalculateTransform(object):
         scale = params[3].valueAsText
         param_file = params[4].valueAsText
         links_list = params[5].values
+        correction = params[6].valueAsText
+        cell_size = params[7].valueAsText
+        cov_file = params[8].valueAsText
 
-        calculate_transform(source_fc, target_fc, rotate, scale, param_file, links_list)
+        calculate_transform(source_fc, target_fc, rotate, scale, param_file, links_list, correction, cell_size,
+                            cov_file)
 
         return
 
@@ -230,5 +380,9 @@ if __name__ == '__main__':
     scale = arcpy.GetParameterAsText(3)
     param_file = arcpy.GetParameterAsText(4)
     links_list = arcpy.GetParameter(5)
+    correction = arcpy.GetParameterAsText(6)
+    cell_size = arcpy.GetParameterAsText(7)
+    cov_file = arcpy.GetParameterAsText(8)
 
-    calculate_transform(source_fc, target_fc, rotate, scale, param_file, links_list)
\ No newline at end of file
+    calculate_transform(source_fc, target_fc, rotate, scale, param_file, links_list, correction, cell_size,
+                        cov_file)
\ No newline at end of file
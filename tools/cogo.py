@@ -0,0 +1,398 @@
+from tools.backend import arcpy
+import tools.registry as registry
+import math
+import re
+import numpy as np
+
+from tools.utils import dms_degrees_array
+
+
+#
+# CogoTraverse - compute traverse points from record bearings and distances
+#
+# Traverse files are plain text, one record per line, comma separated, with
+# # comments -
+#
+#   START,name[,northing,easting[,description]]  begin a traverse at a new or an earlier point
+#   bearing,distance[,name[,description]]        a course ending at a new point
+#   CLOSE,name[,northing,easting]                the last course ends on a known point
+#
+# Bearings are quadrant bearings (N 45-30-15 E, N45°30'15"E, S 12 00 W) or
+# azimuths from north (123-45-30). A single number is DDD.MMSS, as elsewhere in
+# the tools. Courses without a point name are numbered on from the highest
+# numeric name in the file. A traverse without a CLOSE line is open and is left
+# unadjusted.
+#
+# All the bearings in a file are parsed in one regular expression pass and
+# converted with dms_degrees_array. Coordinates are cumulative sums of the
+# course latitudes and departures, so thousands of courses take milliseconds.
+#
+# The misclosure of a closed traverse is distributed by the compass (Bowditch)
+# rule, in proportion to the course lengths, the transit rule, in proportion
+# to the course latitudes and departures, or by least squares, in proportion
+# to the course covariances from the distance and bearing standard deviations.
+#
+
+ADJUST_NONE = 'NONE'
+COMPASS = 'COMPASS'
+TRANSIT = 'TRANSIT'
+LEAST_SQUARES = 'LEAST_SQUARES'
+
+# Default standard deviations for the least squares adjustment, distance (file units) and bearing (seconds)
+DISTANCE_SIGMA = 0.02
+BEARING_SIGMA = 10.0
+
+# Degree, minute and second marks, replaced by blanks before the bearings are parsed
+DMS_MARKS = str.maketrans({'°': ' ', '�': ' ', "'": ' ', '"': ' ', '-': ' ', ':': ' '})
+
+# Quadrant bearing or azimuth, (N|S) deg [min [sec]] (E|W), one per line
+BEARING = re.compile(r'^[ \t]*([NS]?)[ \t]*(\d+(?:\.\d*)?)(?:[ \t]+(\d+(?:\.\d*)?))?(?:[ \t]+(\d+(?:\.\d*)?))?'
+                     r'[ \t]*([EW]?)[ \t]*$', re.MULTILINE | re.IGNORECASE)
+
+
+def parse_bearings(texts):
+    """ Parse quadrant bearings and azimuths, see the file format above.
+        :param texts: sequence of bearing strings
+        :return: array of azimuths in decimal degrees clockwise from north
+
+    """
+    texts = list(texts)
+    fields = BEARING.findall('\n'.join(texts).translate(DMS_MARKS))
+    if len(fields) != len(texts):
+        for text in texts:
+            if '\n' in text or not BEARING.match(text.translate(DMS_MARKS)):
+                raise ValueError('Bad bearing: %s' % text)
+    if not fields:
+        return np.zeros(0)
+
+    q1, deg, min, sec, q2 = (np.array(column) for column in zip(*fields))
+    q1, q2 = np.char.upper(q1), np.char.upper(q2)
+    quadrant = q1 != ''
+    if (quadrant != (q2 != '')).any():
+        i = np.flatnonzero(quadrant != (q2 != ''))[0]
+        raise ValueError('Bad quadrant bearing: %s' % texts[i])
+
+    # Single numbers are DDD.MMSS, minutes may be fractional without seconds
+    angle = np.empty(len(fields))
+    single = min == ''
+    angle[single] = dms_degrees_array(deg[single].astype(np.float64), None)
+    minutes = ~single
+    m = min[minutes].astype(np.float64)
+    no_sec = sec[minutes] == ''
+    s = np.where(no_sec, (m - np.trunc(m)) * 60.0, np.where(no_sec, '0', sec[minutes]).astype(np.float64))
+    m = np.where(no_sec, np.trunc(m), m)
+    angle[minutes] = dms_degrees_array(deg[minutes].astype(np.float64), m, s)
+
+    bad = np.where(quadrant, angle > 90.0, angle >= 360.0)
+    if bad.any():
+        raise ValueError('Bad bearing: %s' % texts[np.flatnonzero(bad)[0]])
+
+    # NE = angle, SE = 180 - angle, SW = 180 + angle, NW = 360 - angle
+    south, east = q1 == 'S', q2 == 'E'
+    base = np.where(south, 180.0, np.where(quadrant & ~east, 360.0, 0.0))
+    sign = np.where(quadrant & (south == east), -1.0, 1.0)
+    return (base + sign * angle) % 360.0
+
+
+class Traverse(object):
+    """ A traverse from a start point through a sequence of courses.
+        Northing/easting pairs are None for points that are not fixed in the traverse record.
+
+    """
+
+    def __init__(self, start, start_ne=None, description=''):
+        self.start = start
+        self.start_ne = start_ne
+        self.description = description
+        self.bearings = []
+        self.distances = []
+        self.names = []
+        self.descriptions = []
+        self.close = None
+        self.close_ne = None
+        self.azimuths = None
+
+    def __len__(self):
+        return len(self.distances)
+
+
+def _coordinates(fields, line):
+    try:
+        return float(fields[0]), float(fields[1])
+    except (IndexError, ValueError):
+        raise ValueError('Bad northing/easting: %s' % line)
+
+
+def read_traverse_file(traverse_file):
+    # List of Traverse from a traverse file, with the bearings parsed and the course points named
+    traverses = []
+    traverse = None
+    with open(traverse_file, errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+
+            fields = [v.strip() for v in line.split(',')]
+            keyword = fields[0].upper()
+            if keyword == 'START':
+                if len(fields) < 2 or not fields[1]:
+                    raise ValueError('Missing start point: %s' % line)
+                start_ne = _coordinates(fields[2:4], line) if len(fields) > 2 else None
+                traverse = Traverse(fields[1], start_ne, ','.join(fields[4:]))
+                traverses.append(traverse)
+            elif traverse is None or traverse.close is not None:
+                raise ValueError('Course outside a traverse: %s' % line)
+            elif keyword == 'CLOSE':
+                if len(fields) < 2 or not fields[1] or not traverse.distances:
+                    raise ValueError('Bad closing point: %s' % line)
+                traverse.close = fields[1]
+                traverse.close_ne = _coordinates(fields[2:4], line) if len(fields) > 2 else None
+            else:
+                if len(fields) < 2:
+                    raise ValueError('Bad course: %s' % line)
+                try:
+                    distance = float(fields[1])
+                except ValueError:
+                    raise ValueError('Bad distance: %s' % line)
+                traverse.bearings.append(fields[0])
+                traverse.distances.append(distance)
+                traverse.names.append(fields[2] if len(fields) > 2 else '')
+                traverse.descriptions.append(','.join(fields[3:]))
+
+    # Every bearing in the file at once
+    azimuths = parse_bearings(b for t in traverses for b in t.bearings)
+    offset = 0
+    for t in traverses:
+        t.azimuths = azimuths[offset:offset + len(t)]
+        t.distances = np.array(t.distances, dtype=np.float64)
+        offset += len(t)
+
+    # The last course of a closed traverse ends on the closing point
+    for t in traverses:
+        if t.close is not None:
+            if t.names[-1] not in ('', t.close):
+                raise ValueError('Last course ends on %s, not the closing point %s' % (t.names[-1], t.close))
+            t.names[-1] = t.close
+
+    # Unnamed courses are numbered on from the highest numeric name, starts without coordinates are earlier points
+    names = [t.start for t in traverses if t.start_ne is not None] + [n for t in traverses for n in t.names]
+    number = max([int(n) for n in names if n.isdigit()] + [0])
+    for t in traverses:
+        for i, name in enumerate(t.names):
+            if name == '':
+                number += 1
+                t.names[i] = str(number)
+
+    return traverses
+
+
+def closure_corrections(azimuths, distances, misclosure, method, distance_sigma=DISTANCE_SIGMA,
+                        bearing_sigma=BEARING_SIGMA):
+    """ Corrections to the course latitudes and departures that remove a misclosure.
+        :param azimuths: course azimuths (degrees)
+        :param distances: course distances
+        :param misclosure: (northing, easting) computed minus fixed closing coordinates
+        :param method: COMPASS, TRANSIT or LEAST_SQUARES
+        :param distance_sigma: distance standard deviation (LEAST_SQUARES)
+        :param bearing_sigma: bearing standard deviation in seconds (LEAST_SQUARES)
+        :return: array of (northing, easting) corrections (shape: n, 2)
+
+    """
+    a = np.radians(azimuths)
+    cos, sin = np.cos(a), np.sin(a)
+    w = np.asarray(misclosure, dtype=np.float64)
+
+    if method == COMPASS:
+        return -np.outer(distances / distances.sum(), w)
+
+    if method == TRANSIT:
+        lat_dep = np.abs(np.column_stack((distances * cos, distances * sin)))
+        totals = lat_dep.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            share = np.where(totals > 0, lat_dep / totals, 0.0)
+        return -share * w
+
+    if method == LEAST_SQUARES:
+        # Course covariances from the distance and bearing variances, J diag(sd^2, sb^2) J^T
+        sb = math.radians(bearing_sigma / 3600.0)
+        J = np.empty((len(distances), 2, 2))
+        J[:, 0, 0], J[:, 0, 1] = cos, -distances * sin
+        J[:, 1, 0], J[:, 1, 1] = sin, distances * cos
+        Q = np.einsum('nij,j,nkj->nik', J, np.array([distance_sigma ** 2, sb ** 2]), J)
+
+        # One condition, the corrections sum to -w: v_i = -Q_i (sum Q)^-1 w
+        k = np.linalg.pinv(Q.sum(axis=0)).dot(w)
+        return -Q.dot(k)
+
+    raise ValueError('Unknown adjustment: %s' % method)
+
+
+def compute_traverse(traverse, known, method=COMPASS, distance_sigma=DISTANCE_SIGMA, bearing_sigma=BEARING_SIGMA):
+    """ Coordinates of the course points of a traverse.
+        :param known: dict of point name -> (northing, easting) fixed by earlier traverses
+        :return: (array of course point (northing, easting) (shape: n, 2), misclosure or None)
+
+    """
+    start = traverse.start_ne if traverse.start_ne is not None else known.get(traverse.start)
+    if start is None:
+        raise ValueError('Unknown start point: %s' % traverse.start)
+
+    a = np.radians(traverse.azimuths)
+    deltas = np.column_stack((traverse.distances * np.cos(a), traverse.distances * np.sin(a)))
+
+    misclosure = None
+    if traverse.close is not None:
+        fixed = traverse.close_ne if traverse.close_ne is not None else known.get(traverse.close)
+        if fixed is None and traverse.close == traverse.start:
+            fixed = start
+        if fixed is None:
+            raise ValueError('Unknown closing point: %s' % traverse.close)
+        misclosure = np.asarray(start) + deltas.sum(axis=0) - np.asarray(fixed)
+        if method and method != ADJUST_NONE:
+            deltas = deltas + closure_corrections(traverse.azimuths, traverse.distances, misclosure, method,
+                                                  distance_sigma, bearing_sigma)
+
+    return np.asarray(start, dtype=np.float64) + np.cumsum(deltas, axis=0), misclosure
+
+
+def cogo_traverse(traverse_file, pnezd_file, adjustment=COMPASS, distance_sigma=None, bearing_sigma=None):
+
+    adjustment = (adjustment or ADJUST_NONE).upper()
+    try:
+        distance_sigma = float(distance_sigma) if distance_sigma else DISTANCE_SIGMA
+        bearing_sigma = float(bearing_sigma) if bearing_sigma else BEARING_SIGMA
+        traverses = read_traverse_file(traverse_file)
+    except ValueError as e:
+        arcpy.AddError(str(e))
+        raise arcpy.ExecuteError
+
+    known = {}
+    pts = []
+    for t in traverses:
+        if t.start_ne is not None and t.start not in known:
+            known[t.start] = t.start_ne
+            pts.append((t.start, t.start_ne, t.description))
+        if t.close_ne is not None and t.close not in known:
+            known[t.close] = t.close_ne
+            pts.append((t.close, t.close_ne, ''))
+
+        try:
+            coords, misclosure = compute_traverse(t, known, adjustment, distance_sigma, bearing_sigma)
+        except ValueError as e:
+            arcpy.AddError(str(e))
+            raise arcpy.ExecuteError
+
+        length = t.distances.sum()
+        if misclosure is not None:
+            error = math.hypot(*misclosure)
+            arcpy.AddMessage('Traverse %s-%s: courses=%d length=%.4f misclosure=%.4f (N %.4f E %.4f) precision=1:%s' % (
+                t.start, t.close, len(t), length, error, misclosure[0], misclosure[1],
+                '%.0f' % (length / error) if error else 'inf'))
+        else:
+            arcpy.AddMessage('Traverse %s: courses=%d length=%.4f (open)' % (t.start, len(t), length))
+
+        for name, ne, desc in zip(t.names, coords.tolist(), t.descriptions):
+            if name in known:
+                # Closing points are fixed
+                continue
+            known[name] = tuple(ne)
+            pts.append((name, ne, desc))
+
+    arcpy.AddMessage('Adjustment: %s  Points: %d' % (adjustment, len(pts)))
+
+    with open(pnezd_file, 'w') as f:
+        f.write('\n'.join('%s,%.4f,%.4f,%.4f,%s' % (name, ne[0], ne[1], 0.0, desc) for name, ne, desc in pts) + '\n')
+
+    return
+
+
+class CogoTraverse(object):
+    def __init__(self):
+        registry.describe(self)
+        self.category = None
+        self.canRunInBackground = False
+
+    def getParameterInfo(self):
+        params = []
+
+        # Input traverse file
+        param = arcpy.Parameter(
+            displayName='Traverse File',
+            name='traverse_file',
+            datatype='DEFile',
+            parameterType='Required',
+            direction='Input'
+        )
+        param.filter.list = ['txt', 'csv']
+        params.append(param)
+
+        # Output PNEZD File
+        param = arcpy.Parameter(
+            displayName='Output PNEZD File',
+            name='pnezd_file',
+            datatype='DEFile',
+            parameterType='Required',
+            direction='Output'
+        )
+        param.filter.list = ['txt']
+        params.append(param)
+
+        # Closure adjustment
+        param = arcpy.Parameter(
+            displayName='Closure Adjustment',
+            name='adjustment',
+            datatype='GPString',
+            parameterType='Optional',
+            direction='Input'
+        )
+        param.filter.type = 'ValueList'
+        param.filter.list = [ADJUST_NONE, COMPASS, TRANSIT, LEAST_SQUARES]
+        param.value = COMPASS
+        params.append(param)
+
+        # Distance standard deviation (least squares)
+        param = arcpy.Parameter(
+            displayName='Distance Standard Deviation',
+            name='distance_sigma',
+            datatype='GPDouble',
+            parameterType='Optional',
+            direction='Input'
+        )
+        param.value = DISTANCE_SIGMA
+        params.append(param)
+
+        # Bearing standard deviation (least squares)
+        param = arcpy.Parameter(
+            displayName='Bearing Standard Deviation (seconds)',
+            name='bearing_sigma',
+            datatype='GPDouble',
+            parameterType='Optional',
+            direction='Input'
+        )
+        param.value = BEARING_SIGMA
+        params.append(param)
+
+        return params
+
+    def execute(self, params, messages):
+        traverse_file = params[0].valueAsText
+        pnezd_file = params[1].valueAsText
+        adjustment = params[2].valueAsText
+        distance_sigma = params[3].valueAsText
+        bearing_sigma = params[4].valueAsText
+
+        cogo_traverse(traverse_file, pnezd_file, adjustment, distance_sigma, bearing_sigma)
+
+        return
+
+
+if __name__ == '__main__':
+
+    traverse_file = arcpy.GetParameterAsText(0)
+    pnezd_file = arcpy.GetParameterAsText(1)
+    adjustment = arcpy.GetParameterAsText(2)
+    distance_sigma = arcpy.GetParameterAsText(3)
+    bearing_sigma = arcpy.GetParameterAsText(4)
+
+    cogo_traverse(traverse_file, pnezd_file, adjustment, distance_sigma, bearing_sigma)
@@ -0,0 +1,111 @@
+import os.path
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+#
+# Columnar - Parquet and Arrow IPC point files
+#
+# Export PNEZD and Export GPX write a columnar file in place of the text output
+# when the output path ends in one of the extensions below. Columns are handed
+# to pyarrow as NumPy arrays, floats and integers are wrapped without copies
+# and missing values in float columns are kept as NaN. Text columns go in as
+# dictionary arrays built from the PointSet string table codes and the table
+# itself, so no Python work is done per row.
+#
+# read_columns returns the columns of either format as NumPy arrays. Arrow IPC
+# files are memory mapped and numeric columns without nulls are returned as
+# views of the mapped buffers, so they go straight into forward_points or
+# inverse_points with no copy beyond stacking the coordinate pair. Import PNEZD
+# reads its points this way from a Parquet or Arrow file.
+#
+
+PARQUET_EXTENSIONS = ('.parquet',)
+ARROW_EXTENSIONS = ('.arrow', '.feather', '.ipc')
+
+
+class ColumnarError(Exception):
+    pass
+
+
+def is_columnar(path):
+    # True for Parquet and Arrow IPC file paths
+    return os.path.splitext(path or '')[1].lower() in PARQUET_EXTENSIONS + ARROW_EXTENSIONS
+
+
+def _array(values):
+    # Arrow array from a NumPy array, (codes, strings) from PointSet.codes or a list of str/None
+    if isinstance(values, tuple):
+        # Dictionary of the string table, Parquet can't write a null in the dictionary so the
+        # None at code 0 is left out and those rows are masked
+        codes, strings = values
+        indices = pa.array(np.maximum(codes - 1, 0), mask=codes == 0)
+        return pa.DictionaryArray.from_arrays(indices, pa.array(strings[1:], type=pa.string()))
+    if isinstance(values, np.ma.MaskedArray):
+        return pa.array(values.data, mask=np.ma.getmaskarray(values))
+    if isinstance(values, np.ndarray) and values.dtype.kind in 'fiub':
+        return pa.array(values)
+    return pa.array([None if v is None else str(v) for v in values], type=pa.string())
+
+
+def write_columns(path, columns):
+    """ Write a Parquet or Arrow IPC file, the format is chosen by the file extension.
+        :param path: output file path
+        :param columns: list of (name, values) - NumPy arrays, masked integer arrays for
+            nullable integers, (codes, strings) text columns from PointSet.codes or sequences
+            of text values
+        :return: number of rows written
+
+    """
+    if pa is None:
+        raise ColumnarError('Parquet and Arrow output needs the pyarrow package')
+
+    table = pa.table(dict((name, _array(values)) for name, values in columns))
+    if os.path.splitext(path)[1].lower() in PARQUET_EXTENSIONS:
+        pq.write_table(table, path)
+    else:
+        with pa.OSFile(path, 'wb') as sink:
+            with ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+    return table.num_rows
+
+
+def read_columns(path, columns=None):
+    """ Read a Parquet or Arrow IPC file.
+        :param path: input file path
+        :param columns: names of the columns to read, default all
+        :return: dict of column name -> NumPy array, text columns as object arrays and integer
+            columns with nulls as floats with NaN
+
+    """
+    if pa is None:
+        raise ColumnarError('Parquet and Arrow input needs the pyarrow package')
+
+    if os.path.splitext(path)[1].lower() in PARQUET_EXTENSIONS:
+        table = pq.read_table(path, columns=columns, memory_map=True)
+    else:
+        table = ipc.open_file(pa.memory_map(path)).read_all()
+        if columns is not None:
+            table = table.select(columns)
+
+    result = {}
+    for name in table.column_names:
+        column = table.column(name)
+        if pa.types.is_dictionary(column.type):
+            # to_numpy decodes the indices of null rows as dictionary values
+            column = column.cast(column.type.value_type)
+        numeric = pa.types.is_floating(column.type) or pa.types.is_integer(column.type)
+        if numeric and column.num_chunks == 1 and column.null_count == 0:
+            # View of the Arrow buffer
+            result[name] = column.chunk(0).to_numpy(zero_copy_only=True)
+        else:
+            result[name] = column.to_numpy(zero_copy_only=False)
+
+    return result
@@ -0,0 +1,179 @@
+import os.path
+import struct
+import threading
+
+import numpy as np
+
+from tools.grid_file import TiledGrid
+
+
+#
+# DatumGrid - horizontal datum shifts from NTv2 grid files
+#
+# NTv2 (.gsb) files hold one or more sub-grids of latitude and longitude shifts
+# in arc seconds, with longitudes positive west and each row running east to
+# west. Sub-grids are memory mapped in place and interpolated with TiledGrid,
+# so opening a national grid costs only the header reads. Where sub-grids are
+# nested the densest one containing a point is used.
+#
+# The shifts convert coordinates from the grid's source datum to its target
+# datum, e.g. NAD 1927 to NAD 1983 with the NADCON conversion published as
+# NTv2. The inverse is found by iterating on the forward shift.
+#
+
+# Seconds per header unit for the NTv2 GS_TYPE values
+GS_UNITS = {'SECONDS': 1.0, 'MINUTES': 60.0, 'DEGREES': 3600.0}
+
+# Iteration limit and tolerance (degrees) for the inverse shift
+INVERSE_ITERATIONS = 10
+INVERSE_TOLERANCE = 1e-12
+
+_RECORD = 16
+
+# Open grids by absolute path
+_grids = {}
+_grids_lock = threading.Lock()
+
+
+class DatumGridError(Exception):
+    pass
+
+
+def _records(header, count):
+    # NTv2 header records as a dict of label -> value (8 byte label, 8 byte value)
+    values = {}
+    for k in range(count):
+        record = header[k * _RECORD:(k + 1) * _RECORD]
+        label = record[:8].decode('ascii', 'replace').strip().rstrip('\x00')
+        values[label] = record[8:]
+    return values
+
+
+def _int(value, byte_order):
+    return struct.unpack(byte_order + 'i', value[:4])[0]
+
+
+def _float(value, byte_order):
+    return struct.unpack(byte_order + 'd', value)[0]
+
+
+def _text(value):
+    return value.decode('ascii', 'replace').strip().rstrip('\x00').strip()
+
+
+class DatumGrid(object):
+    """ NTv2 datum shift grid.
+        :param path: .gsb grid file
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.subgrids = []
+
+        with open(path, 'rb') as f:
+            overview = f.read(11 * _RECORD)
+
+        # NUM_OREC is 11, which gives the byte order
+        byte_order = '<'
+        if len(overview) < 11 * _RECORD or overview[:8] != b'NUM_OREC':
+            raise DatumGridError('Not an NTv2 grid file: %s' % path)
+        if _int(overview[8:], '<') != 11:
+            byte_order = '>'
+            if _int(overview[8:], '>') != 11:
+                raise DatumGridError('Bad NTv2 header: %s' % path)
+
+        header = _records(overview, 11)
+        num_orec = _int(header['NUM_OREC'], byte_order)
+        num_srec = _int(header['NUM_SREC'], byte_order)
+        num_file = _int(header['NUM_FILE'], byte_order)
+        gs_type = _text(header['GS_TYPE']).upper()
+        if gs_type not in GS_UNITS:
+            raise DatumGridError('Unsupported NTv2 GS_TYPE %s: %s' % (gs_type, path))
+        unit = GS_UNITS[gs_type] / 3600.0
+        self.source = _text(header.get('SYSTEM_F', b''))
+        self.target = _text(header.get('SYSTEM_T', b''))
+
+        offset = num_orec * _RECORD
+        names = {}
+        with open(path, 'rb') as f:
+            for _ in range(num_file):
+                f.seek(offset)
+                sub = _records(f.read(num_srec * _RECORD), num_srec)
+                s_lat, n_lat, e_long, w_long, lat_inc, long_inc = (
+                    _float(sub[k], byte_order) * unit for k in ('S_LAT', 'N_LAT', 'E_LONG', 'W_LONG', 'LAT_INC', 'LONG_INC'))
+                count = _int(sub['GS_COUNT'], byte_order)
+                rows = int(round((n_lat - s_lat) / lat_inc)) + 1
+                cols = int(round((w_long - e_long) / long_inc)) + 1
+                if rows * cols != count:
+                    raise DatumGridError('Bad NTv2 sub-grid size: %s' % path)
+
+                # Node records are float32 (lat shift, lon shift, lat accuracy, lon accuracy)
+                offset += num_srec * _RECORD
+                data = np.memmap(path, dtype=byte_order + 'f4', mode='r', offset=offset, shape=(rows, cols, 4))
+                offset += count * _RECORD
+
+                # Longitudes positive west, the first column is the eastern edge
+                grid = TiledGrid(data[:, :, :2], s_lat, -w_long, lat_inc, long_inc, flip=True, scale=unit)
+                grid.name = _text(sub['SUB_NAME'])
+                parent = _text(sub['PARENT'])
+                grid.level = names[parent].level + 1 if parent in names else 0
+                names[grid.name] = grid
+                self.subgrids.append(grid)
+
+        # Parent grids first, nested grids override them
+        self.subgrids.sort(key=lambda g: g.level)
+
+    def shift(self, lon, lat):
+        """ Datum shifts at arrays of points.
+            :return: (dlon, dlat) in degrees east and north, nan outside the grid
+
+        """
+        lon = np.asarray(lon, dtype=np.float64).reshape(-1)
+        lat = np.asarray(lat, dtype=np.float64).reshape(-1)
+        dlat = np.full(len(lon), np.nan)
+        dlon = np.full(len(lon), np.nan)
+        for grid in self.subgrids:
+            values = grid.interpolate(lon, lat)
+            found = ~np.isnan(values[:, 0])
+            dlat[found] = values[found, 0]
+            dlon[found] = -values[found, 1]
+        return dlon, dlat
+
+    def forward(self, lon, lat):
+        """ Source datum to target datum for arrays of longitudes and latitudes (degrees).
+            :return: (lon, lat, inside) - shifted coordinates, points outside the grid are
+                returned unchanged and flagged False in inside
+
+        """
+        lon = np.asarray(lon, dtype=np.float64).reshape(-1)
+        lat = np.asarray(lat, dtype=np.float64).reshape(-1)
+        dlon, dlat = self.shift(lon, lat)
+        inside = ~np.isnan(dlon)
+        return lon + np.where(inside, dlon, 0.0), lat + np.where(inside, dlat, 0.0), inside
+
+    def inverse(self, lon, lat):
+        """ Target datum to source datum, see forward. """
+        lon = np.asarray(lon, dtype=np.float64).reshape(-1)
+        lat = np.asarray(lat, dtype=np.float64).reshape(-1)
+        src_lon, src_lat = lon.copy(), lat.copy()
+        for _ in range(INVERSE_ITERATIONS):
+            dlon, dlat = self.shift(src_lon, src_lat)
+            inside = ~np.isnan(dlon)
+            update_lon = lon - np.where(inside, dlon, 0.0)
+            update_lat = lat - np.where(inside, dlat, 0.0)
+            step = max(np.abs(update_lon - src_lon).max(), np.abs(update_lat - src_lat).max()) if len(lon) else 0.0
+            src_lon, src_lat = update_lon, update_lat
+            if step < INVERSE_TOLERANCE:
+                break
+        return src_lon, src_lat, inside
+
+
+def open_datum_grid(path):
+    # Shared DatumGrid for a grid file, the tile cache is kept between calls
+    key = os.path.normcase(os.path.abspath(path))
+    with _grids_lock:
+        grid = _grids.get(key)
+        if grid is None:
+            grid = _grids[key] = DatumGrid(path)
+    return grid
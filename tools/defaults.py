@@ -0,0 +1,149 @@
+from tools.backend import arcpy
+import os.path
+import time
+import xml.etree.ElementTree as etree
+
+
+#
+# Defaults - cached Transform.xml tool defaults
+#
+# Calculate Transform fills its dialog from transform\Transform.xml in the project
+# folder, and ArcGIS Pro asks for the parameters on every open and refresh. The file
+# is parsed once per change (path, mtime and size) with iterparse, link elements are
+# cleared as they are read so large link tables are streamed.
+#
+# Links directly under the root form the default link set. Further sets are grouped
+# in named links elements, and a linkset element picks the set shown in the dialog -
+#
+#   <transform>
+#       <source>...</source>
+#       <linkset>north</linkset>
+#       <link>...</link>
+#       <links name="north">
+#           <link>...</link>
+#       </links>
+#   </transform>
+#
+
+DEFAULTS_FILE = r'transform\Transform.xml'
+
+# Single value elements read from the defaults file
+DEFAULT_TAGS = ('source', 'target', 'rotation', 'scale', 'output', 'correction', 'cellsize', 'covariances', 'linkset')
+
+# Link columns in value table order
+LINK_TAGS = ('name', 'source', 'target', 'weight', 'sigmax', 'sigmay', 'correlation')
+
+_link_columns = {tag: column for column, tag in enumerate(LINK_TAGS)}
+
+# Name of the link set directly under the root
+DEFAULT_LINK_SET = ''
+
+# Seconds the current project folder is reused before asking ArcGIS Pro again
+PROJECT_CACHE_SECONDS = 30.0
+
+# Parsed defaults by absolute path, with the (mtime, size) they were read at
+_cache = {}
+
+_project = [None, 0.0]
+
+
+class TransformDefaults(object):
+    """ Tool defaults from a Transform.xml file.
+        values holds the single value elements by tag, link_sets the link rows of each
+        set by name in file order. Link rows are lists of strings in LINK_TAGS order.
+
+    """
+
+    def __init__(self, values=None, link_sets=None):
+        self.values = values or {}
+        self.link_sets = link_sets or {}
+
+    def __contains__(self, tag):
+        return tag in self.values
+
+    def __getitem__(self, tag):
+        return self.values[tag]
+
+    def get(self, tag, default=None):
+        return self.values.get(tag, default)
+
+    def link_set_names(self):
+        return list(self.link_sets)
+
+    def links(self, name=None):
+        # Copies of the link rows of a set, by default the set named in linkset or the root links
+        if name is None:
+            name = self.values.get('linkset') or DEFAULT_LINK_SET
+        return [list(row) for row in self.link_sets.get(name, [])]
+
+
+def parse_defaults(defaults_file):
+    # Stream a Transform.xml file into TransformDefaults
+    values, link_sets = {}, {}
+    path = []
+    link_set = None
+    for event, elem in etree.iterparse(defaults_file, events=('start', 'end')):
+        if event == 'start':
+            path.append(elem)
+            if len(path) == 2 and elem.tag == 'links':
+                link_set = link_sets.setdefault(elem.get('name') or DEFAULT_LINK_SET, [])
+            continue
+
+        path.pop()
+        depth = len(path)
+        if elem.tag == 'link' and (depth == 1 or (depth == 2 and path[-1].tag == 'links')):
+            row = [''] * len(LINK_TAGS)
+            for child in elem:
+                column = _link_columns.get(child.tag)
+                if column is not None and child.text is not None:
+                    row[column] = child.text
+            (link_set if depth == 2 else link_sets.setdefault(DEFAULT_LINK_SET, [])).append(row)
+            path[-1].clear()
+        elif depth == 1 and elem.tag in DEFAULT_TAGS:
+            values[elem.tag] = elem.text
+        elif depth == 1 and elem.tag == 'links':
+            link_set = None
+            path[-1].clear()
+
+    return TransformDefaults(values, link_sets)
+
+
+def read_defaults(defaults_file):
+    """ Cached defaults from a Transform.xml file.
+        :return: TransformDefaults, empty when the file does not exist
+        The file is parsed again only when its mtime or size changes.
+
+    """
+    if not defaults_file:
+        return TransformDefaults()
+    path = os.path.abspath(defaults_file)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        _cache.pop(path, None)
+        return TransformDefaults()
+
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _cache.get(path)
+    if cached is None or cached[0] != signature:
+        cached = _cache[path] = (signature, parse_defaults(path))
+    return cached[1]
+
+
+def project_folder():
+    # Folder of the current ArcGIS Pro project, None outside ArcGIS Pro
+    folder, checked = _project
+    if checked and time.monotonic() - checked < PROJECT_CACHE_SECONDS:
+        return folder
+    try:
+        folder = os.path.dirname(arcpy.mp.ArcGISProject('current').filePath)
+    except (AttributeError, OSError):
+        folder = None
+    _project[:] = [folder, time.monotonic()]
+    return folder
+
+
+def defaults_path():
+    # Transform.xml in the current project folder, None outside ArcGIS Pro
+    folder = project_folder()
+    return os.path.join(folder, DEFAULTS_FILE) if folder else None
@@ -0,0 +1,134 @@
+import numpy as np
+
+from dateutil import parser, tz, utils
+
+
+#
+# Dwell detection - find stationary intervals in track logs
+#
+# A receiver left logging on a monument leaves a run of track points that
+# barely move. Windows of consecutive points slower than the speed threshold
+# are chained into candidate runs, points farther than the radius from the run
+# centroid are trimmed, and runs that still cover enough points and time become
+# averaged stations. Every step is a vectorized pass over the track arrays so
+# the cost grows linearly with the number of track points.
+#
+
+# Maximum speed (m/s) over the track points of a dwell
+DWELL_MAX_SPEED = 0.5
+
+# Maximum distance (m) of a dwell point from the station position
+DWELL_RADIUS = 3.0
+
+# Minimum dwell duration (s) and number of track points for a station
+DWELL_MIN_SECS = 120.0
+DWELL_MIN_POINTS = 10
+
+# Number of track point steps the speed is measured over
+DWELL_WINDOW = 5
+
+EPOCH = np.datetime64('1970-01-01T00:00:00', 'ms')
+
+
+def track_times(texts):
+    """ Seconds since 1970-01-01 UTC for GPX time strings, nan where missing.
+        Plain UTC times (...Z) are converted as a single numpy array, anything
+        else falls back to dateutil.
+
+    """
+    t = np.full(len(texts), np.nan)
+
+    utc = [i for i, s in enumerate(texts) if s and s.endswith('Z')]
+    if utc:
+        stamps = np.array([texts[i][:-1] for i in utc], dtype='datetime64[ms]')
+        t[utc] = (stamps - EPOCH) / np.timedelta64(1, 's')
+
+    for i, s in enumerate(texts):
+        if s and not s.endswith('Z'):
+            dt = utils.default_tzinfo(parser.parse(s), tz.UTC)
+            t[i] = dt.timestamp()
+
+    return t
+
+
+def detect_dwells(xy, t, segment, max_speed, radius, min_secs=DWELL_MIN_SECS, min_points=DWELL_MIN_POINTS,
+                  window=DWELL_WINDOW):
+    """ Find stationary intervals in a sequence of track points.
+        :param xy: track point coordinates (shape: n, 2)
+        :param t: track point times in seconds, nan where unknown
+        :param segment: track segment number for each point, runs do not cross segments
+        :param max_speed: maximum speed between consecutive points in xy units per second
+        :param radius: maximum distance from the station position in xy units
+        :param window: number of steps the speed is measured over
+        :return: (station, keep) - station number for each point (-1 outside a dwell)
+            and a mask of the points used for the station positions
+
+    """
+    n = len(xy)
+    w = min(window, n - 1)
+    if w < 1:
+        return np.full(n, -1, dtype=np.int64), np.zeros(n, dtype=bool)
+
+    # Windows of w steps slow enough to be stationary, measuring over several
+    # steps keeps the position noise from looking like movement
+    dt = t[w:] - t[:-w]
+    dist = np.hypot(*(xy[w:] - xy[:-w]).T)
+    with np.errstate(invalid='ignore'):
+        slow = np.flatnonzero((segment[w:] == segment[:-w]) & (dt > 0) & (dist <= max_speed * dt))
+
+    # Points covered by a slow window, contiguous covered points in a segment form a run
+    cover = np.cumsum(np.bincount(slow, minlength=n + 1) - np.bincount(slow + w + 1, minlength=n + 1))[:n]
+    linked = cover > 0
+    joined = np.concatenate(([False], linked[:-1] & (segment[1:] == segment[:-1])))
+    run = np.where(linked, np.cumsum(linked & ~joined), 0)
+    runs = run.max() + 1
+
+    # Trim points beyond the radius from the run centroid
+    count = np.bincount(run, minlength=runs)
+    cx = np.bincount(run, weights=xy[:, 0], minlength=runs) / np.maximum(count, 1)
+    cy = np.bincount(run, weights=xy[:, 1], minlength=runs) / np.maximum(count, 1)
+    keep = linked & (np.hypot(xy[:, 0] - cx[run], xy[:, 1] - cy[run]) <= radius)
+
+    # Runs with enough points and time after trimming become stations
+    kept = np.bincount(run[keep], minlength=runs)
+    first = np.full(runs, np.inf)
+    last = np.full(runs, -np.inf)
+    np.minimum.at(first, run[keep], t[keep])
+    np.maximum.at(last, run[keep], t[keep])
+    good = (kept >= min_points) & (last - first >= min_secs)
+    good[0] = False
+
+    station = np.cumsum(good) - 1
+    station = np.where(good[run], station[run], -1)
+    keep &= station >= 0
+
+    return station, keep
+
+
+def dwell_stations(xy, z, t, station, keep):
+    """ Averaged station positions from the detected dwells.
+        :return: dict of column arrays - x, y, z (nan without elevations), count,
+            spread (RMS distance from the station position), start and end times
+
+    """
+    s = station[keep]
+    count = np.bincount(s)
+    n = len(count)
+
+    x = np.bincount(s, weights=xy[keep, 0], minlength=n) / count
+    y = np.bincount(s, weights=xy[keep, 1], minlength=n) / count
+
+    zk = z[keep]
+    has_z = ~np.isnan(zk)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z = np.bincount(s[has_z], weights=zk[has_z], minlength=n) / np.bincount(s[has_z], minlength=n)
+
+    d2 = (xy[keep, 0] - x[s]) ** 2 + (xy[keep, 1] - y[s]) ** 2
+    spread = np.sqrt(np.bincount(s, weights=d2, minlength=n) / count)
+
+    start = np.full(n, np.inf)
+    end = np.full(n, -np.inf)
+    np.minimum.at(start, s, t[keep])
+    np.maximum.at(end, s, t[keep])
+
+    return {'x': x, 'y': y, 'z': z, 'count': count, 'spread': spread, 'start': start, 'end': end}
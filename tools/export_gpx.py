@@ -1,18 +1,26 @@
-import arcpy
-import arcpy.management as mgmt
-import arcpy.analysis as anlys
+from tools.backend import arcpy
 
 import copy
+import numpy as np
 from datetime import datetime
 import xml.etree.ElementTree as etree
 import xml.dom.minidom as minidom
 
+from tools.columnar import ColumnarError, is_columnar, write_columns
+from tools.datum_grid import open_datum_grid
+from tools.feature_store import POINT_FIELD_NAMES, is_numeric_name, open_store
+from tools.geoid import open_geoid
+from tools.points import PointSet
+import tools.registry as registry
+import tools.timing as timing
+
 
 #
 # ExportGPX - Create a GPX file from point features
 #
 
-def export_gpx(wpt_fc, gpx_file, create_rte, close_rte):
+@timing.timed('Export GPX')
+def export_gpx(wpt_fc, gpx_file, create_rte, close_rte, datum_grid=None, geoid_grid=None):
 
     scratch = arcpy.env.scratchWorkspace
     arcpy.env.addOutputsToMap = False
@@ -51,20 +59,32 @@ def export_gpx(wpt_fc, gpx_file, create_rte, close_rte):
     time = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
     etree.SubElement(meta, 'time').text = time
 
-    sr = arcpy.Describe(wpt_fc).spatialReference
+    sr = open_store(wpt_fc.split(';')[0]).spatial_reference()
+
+    # With a datum grid points are read in the geographic system of the feature class
+    # and shifted back to the GPX datum, otherwise the geographic transformations apply
+    grid = open_datum_grid(datum_grid) if datum_grid else None
+    read_sr = sr.GCS if grid is not None else GCS_WGS_84
+
+    # With a geoid grid orthometric elevations are written as ellipsoid heights
+    geoid = open_geoid(geoid_grid) if geoid_grid else None
 
     # A list of rte elements to append after the waypoints
     routes = []
 
+    # Parquet or Arrow output collects the points of every feature class in place of the GPX
+    columnar = is_columnar(gpx_file)
+    collected = []
+
     for fc in wpt_fc.split(';'):
 
-        desc = arcpy.Describe(fc)
-        hasZ = desc.hasZ
+        store = open_store(fc)
+        hasZ = store.has_z()
 
-        fc_fields = list(f.name.upper() for f in arcpy.ListFields(fc))
-        sql_clause = (None, 'ORDER BY NAME' if 'NAME' in fc_fields else None)
+        fc_fields = [f for f in store.field_names() if f != 'SHAPE']
+        order_by = 'NAME' if 'NAME' in fc_fields else None
 
-        if create_rte:
+        if create_rte and not columnar:
             # Add a new rte element to the end of the routes list
             routes.append(etree.Element('rte'))
             etree.SubElement(routes[-1], 'name').text = fc
@@ -75,14 +95,41 @@ def export_gpx(wpt_fc, gpx_file, create_rte, close_rte):
         arcpy.AddMessage('Fields: ' + ', '.join(fc_fields))
         arcpy.AddMessage('Has Z: ' + str(hasZ))
 
-        with arcpy.da.SearchCursor(fc, '*', spatial_reference=GCS_WGS_84, sql_clause=sql_clause) as cur:
-
-            for row in cur:
-
-                row = dict(zip(fc_fields, row))
-
-                coords = row['SHAPE']
-                lon, lat = ('%.8f' % c for c in coords[0:2])
+        # Elevations from Z or the first ELE* field
+        ele_field = 'SHAPE@Z' if hasZ else next((f for f in fc_fields if f.startswith('ELE')), None)
+        with timing.span('read') as stage:
+            points = PointSet.read(store, spatial_reference=read_sr, order_by=order_by, elevation=ele_field)
+            stage.rows = len(points)
+
+        lonlat = points.xy
+        if grid is not None and len(points):
+            lon, lat, inside = grid.inverse(*lonlat.T)
+            if not inside.all():
+                arcpy.AddWarning('%d points outside the datum grid not shifted' % np.count_nonzero(~inside))
+            lonlat = np.column_stack((lon, lat))
+
+        # Elevations in meters, converted together
+        elevations = points.column('ELEVATION') * sr.metersPerUnit
+        if geoid is not None and len(points):
+            h = geoid.ellipsoid(*lonlat.T, elevations)
+            outside = np.count_nonzero(np.isnan(h) & ~np.isnan(elevations))
+            if outside:
+                arcpy.AddWarning('%d elevations outside the geoid grid dropped' % outside)
+            elevations = h
+
+        if columnar:
+            # Longitude, latitude and elevation as written to the GPX, with the X, Y coordinates of the
+            # feature class
+            xy = np.array([row[0] for row in store.read_points(['SHAPE@XY'], order_by=order_by)],
+                          dtype=np.float64).reshape(-1, 2)
+            collected.append((points, lonlat, elevations, xy))
+            continue
+
+        with timing.span('waypoint elements', len(points)):
+            for row, xy, ele in zip(points, lonlat.tolist(), elevations.tolist()):
+
+                row = dict(zip(POINT_FIELD_NAMES, row[1:]))
+                lon, lat = ('%.8f' % c for c in xy)
                 wpt = etree.SubElement(gpx, 'wpt', attrib={'lat': lat, 'lon': lon})
 
                 # Match waypoint elements to feature class fields
@@ -90,25 +137,20 @@ def export_gpx(wpt_fc, gpx_file, create_rte, close_rte):
                     tag = tag.rsplit(':')[-1]
 
                     if wpt_field == 'ELEVATION':
-                        if hasZ:
-                            etree.SubElement(wpt, tag).text = '%.4f' % (coords[2] * sr.metersPerUnit)
-                        else:
-                            # Search for elevation field in fc
-                            for f in fc_fields:
-                                if f.startswith('ELE'):
-                                    etree.SubElement(wpt, tag).text = '%.4f' % (row[f] * sr.metersPerUnit)
-                                    break
+                        if not np.isnan(ele):
+                            etree.SubElement(wpt, tag).text = '%.4f' % ele
 
                     elif wpt_field == 'NAME' and 'NAME' in fc_fields:
-                        if row['NAME'].isdigit():
+                        if is_numeric_name(row['NAME']):
                             row['NAME'] = '%04d' % int(row['NAME'])
                         etree.SubElement(wpt, tag).text = row['NAME']
 
                     elif wpt_field == 'SAMPLES' and 'SAMPLES' in fc_fields:
                         # gpx:extensions/wptx1:WaypointExtension/wptx1:Samples
-                        ext = etree.SubElement(wpt, 'extensions')
-                        wptx1 = etree.SubElement(ext, 'wptx1:WaypointExtension')
-                        etree.SubElement(wptx1, 'wptx1:Samples').text = row['SAMPLES']
+                        if row['SAMPLES'] is not None:
+                            ext = etree.SubElement(wpt, 'extensions')
+                            wptx1 = etree.SubElement(ext, 'wptx1:WaypointExtension')
+                            etree.SubElement(wptx1, 'wptx1:Samples').text = str(row['SAMPLES'])
 
                     elif wpt_field in fc_fields:
                         etree.SubElement(wpt, tag).text = row[wpt_field]
@@ -128,6 +170,28 @@ def export_gpx(wpt_fc, gpx_file, create_rte, close_rte):
             # Append the closing route point
             routes[-1].append(closing_rtept)
 
+    if columnar:
+        points = PointSet.concatenate(c[0] for c in collected)
+        lonlat = np.concatenate([c[1] for c in collected])
+        xy = np.concatenate([c[3] for c in collected])
+        columns = [
+            ('NAME', points.codes('NAME')),
+            ('LON', lonlat[:, 0]),
+            ('LAT', lonlat[:, 1]),
+            ('ELEVATION', np.concatenate([c[2] for c in collected])),
+        ]
+        columns += [(field, points.codes(field)) for field in ('TIME', 'DESCRIPTION', 'SYMBOL', 'TYPE')]
+        columns += [('SAMPLES', points.column('SAMPLES'))]
+        columns += [('X', xy[:, 0]), ('Y', xy[:, 1])]
+        with timing.span('write columns', len(points)):
+            try:
+                count = write_columns(gpx_file, columns)
+            except ColumnarError as e:
+                arcpy.AddError(str(e))
+                raise arcpy.ExecuteError
+        arcpy.AddMessage('Points: %d' % count)
+        return
+
     for rte in routes:
         # Append the routes
         gpx.append(rte)
@@ -136,18 +200,18 @@ def export_gpx(wpt_fc, gpx_file, create_rte, close_rte):
     #     etree.ElementTree(gpx).write(f)
 
     # Reparse the etree gpx with minidom and write pretty xml.
-    dom = minidom.parseString(etree.tostring(gpx, encoding='utf-8'))
+    with timing.span('XML serialize'):
+        dom = minidom.parseString(etree.tostring(gpx, encoding='utf-8'))
 
-    with open(gpx_file, 'w') as f:
-        dom.writexml(f, addindent='  ', newl='\n', encoding='utf-8')
+        with open(gpx_file, 'w') as f:
+            dom.writexml(f, addindent='  ', newl='\n', encoding='utf-8')
 
     return
 
 
 class ExportGPX(object):
     def __init__(self):
-        self.label = "Export GPX"
-        self.description = "Create a GPX file from waypoint and route point features."
+        registry.describe(self)
         self.category = None
         self.canRunInBackground = False
 
@@ -174,7 +238,7 @@ class ExportGPX(object):
             parameterType='Required',
             direction='Output'
         )
-        param.filter.list = ['gpx']
+        param.filter.list = ['gpx', 'parquet', 'arrow']
         params.append(param)
 
         # Input enable routes switch
@@ -201,6 +265,28 @@ class ExportGPX(object):
         param.value = False
         params.append(param)
 
+        # Datum shift grid (optional)
+        param = arcpy.Parameter(
+            displayName='Datum Grid File (Optional)',
+            name='datum_grid',
+            datatype='DEFile',
+            parameterType='Optional',
+            direction='Input'
+        )
+        param.filter.list = ['gsb']
+        params.append(param)
+
+        # Geoid grid (optional)
+        param = arcpy.Parameter(
+            displayName='Geoid Grid File (Optional)',
+            name='geoid_grid',
+            datatype='DEFile',
+            parameterType='Optional',
+            direction='Input'
+        )
+        param.filter.list = ['bin']
+        params.append(param)
+
         return params
 
     def execute(self, params, messages):
@@ -208,8 +294,10 @@ class ExportGPX(object):
         gpx_file = params[1].valueAsText
         create_rte = params[2].value
         close_rte = params[3].value
+        datum_grid = params[4].valueAsText
+        geoid_grid = params[5].valueAsText
 
-        export_gpx(wpt_fc, gpx_file, create_rte, close_rte)
+        export_gpx(wpt_fc, gpx_file, create_rte, close_rte, datum_grid, geoid_grid)
 
         return
 
@@ -220,5 +308,7 @@ if __name__ == '__main__':
     gpx_file = arcpy.GetParameterAsText(1)
     create_rte = arcpy.GetParameter(2)
     close_rte = arcpy.GetParameter(3)
+    datum_grid = arcpy.GetParameterAsText(4)
+    geoid_grid = arcpy.GetParameterAsText(5)
 
-    export_gpx(wpt_fc, gpx_file, create_rte, close_rte)
+    export_gpx(wpt_fc, gpx_file, create_rte, close_rte, datum_grid, geoid_grid)
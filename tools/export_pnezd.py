@@ -1,6 +1,12 @@
-import arcpy
-import arcpy.management as mgmt
-
+from tools.backend import arcpy
+import numpy as np
+
+from tools.columnar import ColumnarError, is_columnar, write_columns
+from tools.feature_store import open_store
+from tools.points import PointSet
+import tools.registry as registry
+from tools.scale_factor import GRID, GROUND, GridProjection, ScaleFactorError, grid_to_ground
+import tools.timing as timing
 from tools.transform import Transform
 
 
@@ -8,24 +14,86 @@ from tools.transform import Transform
 # ExportPNEZD - Create a PNEZD file from a point feature class
 #
 
-def export_pnezd(input_fc, param_file, pnezd_file):
+@timing.timed('write columns')
+def write_point_columns(out_file, points, coords, scale):
+    # Parquet or Arrow file of the points with the PNEZD (N, E, Z) and feature class (X, Y, ELEVATION)
+    # coordinates, built from column arrays
+    elevations = points.column('ELEVATION')
+    columns = [
+        ('NAME', points.codes('NAME')),
+        ('N', coords[:, 1]),
+        ('E', coords[:, 0]),
+        ('Z', elevations / scale),
+    ]
+    columns += [(field, points.codes(field)) for field in ('DESCRIPTION', 'TIME', 'SYMBOL', 'TYPE')]
+    columns += [('SAMPLES', points.column('SAMPLES'))]
+    columns += [('X', points.xy[:, 0]), ('Y', points.xy[:, 1]), ('ELEVATION', elevations)]
+
+    try:
+        count = write_columns(out_file, columns)
+    except ColumnarError as e:
+        arcpy.AddError(str(e))
+        raise arcpy.ExecuteError
+    arcpy.AddMessage('Points: %d' % count)
+
+
+@timing.timed('Export PNEZD')
+def export_pnezd(input_fc, param_file, pnezd_file, coordinates=GRID, elevation=None, geoid_height=None):
 
     arcpy.env.addOutputsToMap = False
 
+    ground = (coordinates or GRID).upper() == GROUND
+    if ground and not param_file:
+        arcpy.AddError('Ground coordinates need transform parameters.')
+        raise arcpy.ExecuteError
+    if ground and elevation in (None, ''):
+        # The combined factor at the origin is taken at this elevation, no default fits every project
+        arcpy.AddError('Ground coordinates need the Project Elevation the transform was fitted at.')
+        raise arcpy.ExecuteError
+
     if param_file:
         xfm = Transform()
         xfm.load(param_file)
+        if ground and xfm.origin is None:
+            arcpy.AddError('Transform parameters have no project origin, recalculate the transform: %s' % param_file)
+            raise arcpy.ExecuteError
+
+    store = open_store(input_fc)
+    with timing.span('read') as stage:
+        points = PointSet.read(store)
+        stage.rows = len(points)
+
+    # Transform all points at once, the residual correction is vectorized
+    coords = points.xy
+    if param_file and len(points):
+        with timing.span('transform', len(points)):
+            if ground:
+                # Grid distances scaled to ground by each point's combined factor
+                try:
+                    projection = GridProjection.from_spatial_reference(store.spatial_reference())
+                except ScaleFactorError as e:
+                    arcpy.AddError(str(e))
+                    raise arcpy.ExecuteError
+                if xfm.correction is not None:
+                    coords = xfm.correction.remove(coords)
+                coords = grid_to_ground(coords, np.nan_to_num(points.column('ELEVATION')), xfm.origin, projection,
+                                        float(elevation), float(geoid_height or 0.0))
+                coords = xfm.similarity().inverse_points(coords)
+            else:
+                coords = xfm.inverse_points(coords)
+
+    if is_columnar(pnezd_file):
+        write_point_columns(pnezd_file, points, coords, xfm.scale() if param_file else 1.0)
+        return
 
-    pts = []
-    fields = ('SHAPE@XY', 'ELEVATION', 'NAME', 'DESCRIPTION')
-    with arcpy.da.SearchCursor(input_fc, fields) as cur:
-        for coords, z, name, desc in cur:
+    with timing.span('format', len(points)):
+        pts = []
+        for (_, z, _, name, desc, _, _, _), xy in zip(points, coords.tolist()):
             if param_file:
-                coords = xfm.inverse(coords)
                 z /= xfm.scale()
-            pts.append('%d,%.4f,%.4f,%.4f,%s' % (int(name), *coords[::-1], z, desc if desc else ''))
+            pts.append('%d,%.4f,%.4f,%.4f,%s' % (int(name), *xy[::-1], z, desc if desc else ''))
 
-    with open(pnezd_file, 'w') as f:
+    with timing.span('write', len(pts)), open(pnezd_file, 'w') as f:
         f.write('\n'.join(pts) + '\n')
 
     return
@@ -33,8 +101,7 @@ def export_pnezd(input_fc, param_file, pnezd_file):
 
 class ExportPNEZD(object):
     def __init__(self):
-        self.label = "Export PNEZD"
-        self.description = "Create a PNEZD file from a point feature class."
+        registry.describe(self)
         self.category = None
         self.canRunInBackground = False
 
@@ -71,7 +138,40 @@ class ExportPNEZD(object):
             parameterType='Required',
             direction='Output'
         )
-        param.filter.list = ['txt']
+        param.filter.list = ['txt', 'parquet', 'arrow']
+        params.append(param)
+
+        # Grid or ground output coordinates
+        param = arcpy.Parameter(
+            displayName='PNEZD Coordinates',
+            name='coordinates',
+            datatype='GPString',
+            parameterType='Optional',
+            direction='Input'
+        )
+        param.filter.type = 'ValueList'
+        param.filter.list = [GRID, GROUND]
+        param.value = GRID
+        params.append(param)
+
+        # Elevation the transform scale was fitted at (required for ground coordinates)
+        param = arcpy.Parameter(
+            displayName='Project Elevation',
+            name='elevation',
+            datatype='GPDouble',
+            parameterType='Optional',
+            direction='Input'
+        )
+        params.append(param)
+
+        # Geoid height in meters (ground coordinates)
+        param = arcpy.Parameter(
+            displayName='Geoid Height (meters)',
+            name='geoid_height',
+            datatype='GPDouble',
+            parameterType='Optional',
+            direction='Input'
+        )
         params.append(param)
 
         return params
@@ -80,8 +180,11 @@ class ExportPNEZD(object):
         input_fc = params[0].valueAsText
         param_file = params[1].valueAsText
         pnezd_file = params[2].valueAsText
+        coordinates = params[3].valueAsText
+        elevation = params[4].valueAsText
+        geoid_height = params[5].valueAsText
 
-        export_pnezd(input_fc, param_file, pnezd_file)
+        export_pnezd(input_fc, param_file, pnezd_file, coordinates, elevation, geoid_height)
 
         return
 
@@ -90,5 +193,8 @@ if __name__ == '__main__':
     input_fc = arcpy.GetParameterAsText(0)
     param_file = arcpy.GetParameterAsText(1)
     pnezd_file = arcpy.GetParameterAsText(2)
+    coordinates = arcpy.GetParameterAsText(3)
+    elevation = arcpy.GetParameterAsText(4)
+    geoid_height = arcpy.GetParameterAsText(5)
 
-    export_pnezd(input_fc, param_file, pnezd_file)
+    export_pnezd(input_fc, param_file, pnezd_file, coordinates, elevation, geoid_height)
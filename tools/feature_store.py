@@ -0,0 +1,182 @@
+import re
+
+#
+# Feature stores - storage backends for points and track features
+#
+# The tools read and write features through a store object selected from the
+# feature class path. Paths inside a GeoPackage (.gpkg) use the sqlite3 based
+# GeoPackageStore, everything else goes through arcpy.
+#
+
+# Standard points schema (field, type, length)
+POINT_FIELDS = [
+    ('ELEVATION', 'DOUBLE', None),
+    ('TIME', 'TEXT', 64),
+    ('NAME', 'TEXT', 64),
+    ('DESCRIPTION', 'TEXT', 64),
+    ('SYMBOL', 'TEXT', 64),
+    ('TYPE', 'TEXT', 64),
+    ('SAMPLES', 'LONG', None),
+]
+
+# Track (polyline) schema
+TRACK_FIELDS = [
+    ('NAME', 'TEXT', 64),
+    ('POINTS', 'LONG', None),
+    ('LENGTH', 'DOUBLE', None),
+]
+
+# Standard error ellipse fields, added to points by Import PNEZD and Transform Features
+ELLIPSE_FIELDS = [
+    ('SEMI_MAJOR', 'DOUBLE', None),
+    ('SEMI_MINOR', 'DOUBLE', None),
+    ('ORIENTATION', 'DOUBLE', None),
+]
+
+# GeoPackage feature class paths look like D:\Project\Project.gpkg\main.Points
+GPKG_PATH = re.compile(r'^(.*?\.gpkg)[\\/]+(?:main\.)?([^\\/]+)$', re.IGNORECASE)
+
+# Numeric point names are looked up by their zero padded forms up to this width, names
+# padded further are found among the names starting with a zero
+NAME_PAD_WIDTH = 4
+
+# Maximum number of values in a NAME IN (...) or object id IN (...) clause
+NAME_CHUNK_SIZE = 500
+
+POINT_FIELD_NAMES = tuple(f[0] for f in POINT_FIELDS)
+TRACK_FIELD_NAMES = tuple(f[0] for f in TRACK_FIELDS)
+
+
+class FeatureStore(object):
+    """ Base class for a point or track feature store.
+
+        Point rows are inserted as tuples matching an arcpy InsertCursor with the fields -
+        ('SHAPE@XY', 'ELEVATION', 'TIME', 'NAME', 'DESCRIPTION', 'SYMBOL', 'TYPE', 'SAMPLES')
+        A tools.points.PointSet iterates as these rows and is inserted directly.
+
+        Track rows are inserted as (coords, NAME, POINTS, LENGTH) where coords is a sequence of (x, y)
+        and LENGTH is the ellipsoid length in meters.
+
+        Inserted rows are identified by their object id for later updates and deletes.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self):
+        raise NotImplementedError
+
+    def spatial_reference(self):
+        raise NotImplementedError
+
+    def field_names(self):
+        raise NotImplementedError
+
+    def has_z(self):
+        return False
+
+    def create_points(self, sr):
+        # Create (or replace) an empty points feature class
+        raise NotImplementedError
+
+    def insert_points(self, rows):
+        # Bulk insert point rows, returns the object ids of the inserted rows
+        raise NotImplementedError
+
+    def update_points(self, rows):
+        # Replace point rows given as (object id, row) pairs, returns the number of rows updated
+        raise NotImplementedError
+
+    def delete_points(self, oids):
+        # Delete point rows by object id, returns the number of rows deleted
+        raise NotImplementedError
+
+    def read_points(self, fields, spatial_reference=None, order_by=None, where=None):
+        # Iterate over point rows as tuples of the requested fields
+        raise NotImplementedError
+
+    def set_point_fields(self, fields, compute):
+        # Add the (field, type, length) fields where missing and set them on every row.
+        # compute maps the (n, 2) point coordinates to one array of values per field.
+        raise NotImplementedError
+
+    def ensure_name_index(self):
+        # Create an attribute index on NAME if one is missing
+        pass
+
+    def name_clause(self, names):
+        quoted = ', '.join("'%s'" % name.replace("'", "''") for name in names)
+        return 'NAME IN (%s)' % quoted
+
+    def name_prefix_clause(self, prefix):
+        return "NAME LIKE '%s%%'" % prefix.replace("'", "''")
+
+    def find_points(self, names, chunk_size=NAME_CHUNK_SIZE):
+        # Look up point coordinates by canonical name without scanning the whole table
+        keys = set(canonical_name(name) for name in names)
+        values = sorted(set(v for key in keys for v in name_variants(key)))
+
+        self.ensure_name_index()
+
+        pts = {}
+        for i in range(0, len(values), chunk_size):
+            where = self.name_clause(values[i:i + chunk_size])
+            for name, coords in self.read_points(('NAME', 'SHAPE@XY'), where=where):
+                key = canonical_name(name)
+                if key in keys:
+                    pts[key] = coords
+
+        missing = set(key for key in keys if key not in pts and is_numeric_name(key))
+        if missing:
+            for name, coords in self.read_points(('NAME', 'SHAPE@XY'), where=self.name_prefix_clause('0')):
+                key = canonical_name(name)
+                if key in missing:
+                    pts[key] = coords
+
+        return pts
+
+    def write_tracks(self, rows, sr):
+        # Create (or replace) a polyline feature class and insert track rows
+        raise NotImplementedError
+
+
+def is_numeric_name(name):
+    # Names of the ASCII digits 0-9 only, isdigit alone also accepts digits int() rejects
+    return name.isascii() and name.isdigit()
+
+
+def canonical_name(name):
+    # Point names compare without surrounding blanks and leading zeros on numeric names
+    if name is None:
+        return None
+    name = str(name).strip()
+    return str(int(name)) if is_numeric_name(name) else name
+
+
+def name_variants(name):
+    # Stored forms of a canonical name, numeric names are also zero padded up to NAME_PAD_WIDTH
+    if not is_numeric_name(name):
+        return [name]
+    return [name.zfill(width) for width in range(len(name), max(len(name), NAME_PAD_WIDTH) + 1)]
+
+
+def geopackage_path(path):
+    # Split a path into (gpkg file, table name) or return None if not a GeoPackage path
+    m = GPKG_PATH.match(path or '')
+    return m.groups() if m else None
+
+
+def is_geopackage(path):
+    return geopackage_path(path) is not None
+
+
+def open_store(path):
+    # Select a storage backend for a feature class path
+    gpkg = geopackage_path(path)
+    if gpkg is not None:
+        from tools.geopackage import GeoPackageStore
+        return GeoPackageStore(*gpkg)
+
+    from tools.arcpy_store import ArcpyStore
+    return ArcpyStore(path)
@@ -0,0 +1,180 @@
+import numpy as np
+
+
+#
+# Geodesic - ellipsoid distances and azimuths for arrays of point pairs
+#
+# The inverse problem is solved with Vincenty's iteration (Survey Review, 1975),
+# run on whole numpy arrays. Each pass only updates the pairs that have not yet
+# converged, so a batch of short lines finishes in three or four passes.
+# Vincenty's iteration fails to converge for nearly antipodal pairs, and on the
+# equator it settles on the equatorial line even past (1 - f) pi of longitude,
+# where the shortest line runs towards a pole. Pairs that far apart in longitude
+# are solved instead as Karney does (J Geodesy, 2013), for the azimuth at the
+# first point, which the longitude difference increases with monotonically once
+# the pair is put in a canonical position. The azimuth is found by bisection,
+# using Vincenty's series for the longitude and distance along the line, so
+# these pairs are as accurate as the rest.
+#
+
+# WGS 1984 ellipsoid
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+
+# Iteration limit and tolerance (radians) for Vincenty's lambda
+ITERATIONS = 200
+TOLERANCE = 1e-12
+
+# Bisection steps for the azimuth of nearly antipodal pairs, enough to resolve [0, pi] in doubles
+BISECTIONS = 64
+
+
+def _series(cos2_alpha, sigma1, sigma2, a, f):
+    # Vincenty's series along a line from sigma1 to sigma2 on the auxiliary sphere, returns the
+    # distance (meters) and the longitude correction (radians, without the f sin(alpha) factor)
+    b = a * (1 - f)
+    sigma = sigma2 - sigma1
+    cos_2sm = np.cos(sigma1 + sigma2)
+    sin_sigma, cos_sigma = np.sin(sigma), np.cos(sigma)
+    u2 = cos2_alpha * (a * a - b * b) / (b * b)
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    delta_sigma = B * sin_sigma * (cos_2sm + B / 4 * (
+        cos_sigma * (-1 + 2 * cos_2sm ** 2) -
+        B / 6 * cos_2sm * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sm ** 2)))
+    C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+    correction = (1 - C) * (sigma + C * sin_sigma * (cos_2sm + C * cos_sigma * (-1 + 2 * cos_2sm ** 2)))
+    return b * A * (sigma - delta_sigma), correction
+
+
+def _antipodal(U1, U2, L, a, f):
+    # Distances (meters) and forward azimuths (radians) for reduced latitudes and longitude
+    # differences, solved for the azimuth at the first point. The pairs are put in Karney's
+    # canonical position, |U2| <= |U1|, U1 <= 0 and L >= 0, where the longitude difference
+    # rises monotonically from 0 to pi as the azimuth goes from 0 to pi.
+    swap = np.abs(U2) > np.abs(U1)
+    U1, U2 = np.where(swap, U2, U1), np.where(swap, U1, U2)
+    L = np.where(swap, -L, L)
+    east = L >= 0
+    L = np.abs(L)
+    north = ~np.signbit(U1)
+    U1, U2 = np.where(north, -U1, U1), np.where(north, -U2, U2)
+    sinU1, cosU1 = np.sin(U1), np.cos(U1)
+    sinU2, cosU2 = np.sin(U2), np.cos(U2)
+
+    def line(alpha1):
+        # The line at azimuth alpha1 from the first point up to the latitude of the second
+        sin_a1, cos_a1 = np.sin(alpha1), np.cos(alpha1)
+        sin_a0 = sin_a1 * cosU1
+        cos2_a0 = cos_a1 ** 2 + (sin_a1 * sinU1) ** 2
+        cos_a2 = np.sqrt(np.maximum((cos_a1 * cosU1) ** 2 + (cosU2 ** 2 - cosU1 ** 2), 0.0)) / cosU2
+        sigma1, sigma2 = np.arctan2(sinU1, cos_a1 * cosU1), np.arctan2(sinU2, cos_a2 * cosU2)
+        omega = np.arctan2(sin_a0 * sinU2, cos_a2 * cosU2) - np.arctan2(sin_a0 * sinU1, cos_a1 * cosU1)
+        s, correction = _series(cos2_a0, sigma1, sigma2, a, f)
+        return omega - f * sin_a0 * correction, s, np.arctan2(sin_a0 / cosU2, cos_a2)
+
+    lo, hi = np.zeros_like(L), np.full_like(L, np.pi)
+    for _ in range(BISECTIONS):
+        mid = (lo + hi) / 2
+        below = line(mid)[0] < L
+        lo, hi = np.where(below, mid, lo), np.where(below, hi, mid)
+    # Antipodal in longitude, the line runs over the pole
+    alpha1 = np.where(L < np.pi, (lo + hi) / 2, np.pi)
+    _, s, alpha2 = line(alpha1)
+
+    # Back from the canonical position
+    alpha1, alpha2 = np.where(north, np.pi - alpha1, alpha1), np.where(north, np.pi - alpha2, alpha2)
+    alpha1, alpha2 = np.where(east, alpha1, -alpha1), np.where(east, alpha2, -alpha2)
+    alpha1, alpha2 = np.where(swap, alpha2 + np.pi, alpha1), np.where(swap, alpha1 + np.pi, alpha2)
+    return s, alpha1, alpha2
+
+
+def inverse(lon1, lat1, lon2, lat2, a=WGS84_A, f=WGS84_F):
+    """ Geodesic inverse problem for arrays of point pairs.
+        :param lon1, lat1: first points (degrees)
+        :param lon2, lat2: second points (degrees)
+        :param a: ellipsoid semi-major axis (meters)
+        :param f: ellipsoid flattening
+        :return: (distance, azimuth1, azimuth2) - distances in meters, the forward azimuths at
+            each point in degrees clockwise from north
+
+    """
+    lon1, lat1, lon2, lat2 = np.broadcast_arrays(*(np.asarray(v, dtype=np.float64) for v in (lon1, lat1, lon2, lat2)))
+    shape = lon1.shape
+    lon1, lat1, lon2, lat2 = (np.radians(v.reshape(-1)) for v in (lon1, lat1, lon2, lat2))
+    b = a * (1 - f)
+
+    L = (lon2 - lon1 + np.pi) % (2 * np.pi) - np.pi
+    U1 = np.arctan((1 - f) * np.tan(lat1))
+    U2 = np.arctan((1 - f) * np.tan(lat2))
+    sinU1, cosU1 = np.sin(U1), np.cos(U1)
+    sinU2, cosU2 = np.sin(U2), np.cos(U2)
+    ss12, cc12 = sinU1 * sinU2, cosU1 * cosU2
+    cs12, sc12 = cosU1 * sinU2, sinU1 * cosU2
+
+    lam = L.copy()
+    sin_sigma = np.zeros_like(L)
+    cos_sigma = np.ones_like(L)
+    sigma = np.zeros_like(L)
+    cos2_alpha = np.ones_like(L)
+    cos_2sm = np.zeros_like(L)
+
+    # Indices of the pairs still iterating
+    active = np.arange(len(L))
+    for _ in range(ITERATIONS):
+        if not len(active):
+            break
+        # All pairs take the first passes, slicing avoids the index copies
+        i = active if len(active) < len(L) else slice(None)
+        sin_lam, cos_lam = np.sin(lam[i]), np.cos(lam[i])
+        ss = np.hypot(cosU2[i] * sin_lam, cs12[i] - sc12[i] * cos_lam)
+        cs = ss12[i] + cc12[i] * cos_lam
+        sg = np.arctan2(ss, cs)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sin_alpha = np.where(ss > 0, cc12[i] * sin_lam / ss, 0.0)
+            c2a = 1 - sin_alpha ** 2
+            c2m = np.where(c2a > 0, cs - 2 * ss12[i] / c2a, 0.0)
+        C = f / 16 * c2a * (4 + f * (4 - 3 * c2a))
+        update = L[i] + (1 - C) * f * sin_alpha * (sg + C * ss * (c2m + C * cs * (-1 + 2 * c2m ** 2)))
+
+        sin_sigma[i], cos_sigma[i], sigma[i], cos2_alpha[i], cos_2sm[i] = ss, cs, sg, c2a, c2m
+        done = np.abs(update - lam[i]) < TOLERANCE
+        lam[i] = update
+        active = np.flatnonzero(~done) if isinstance(i, slice) else i[~done]
+
+    u2 = cos2_alpha * (a * a - b * b) / (b * b)
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    delta_sigma = B * sin_sigma * (cos_2sm + B / 4 * (
+        cos_sigma * (-1 + 2 * cos_2sm ** 2) -
+        B / 6 * cos_2sm * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sm ** 2)))
+    s = b * A * (sigma - delta_sigma)
+
+    sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+    az1 = np.arctan2(cosU2 * sin_lam, cosU1 * sinU2 - sinU1 * cosU2 * cos_lam)
+    az2 = np.arctan2(cosU1 * sin_lam, -sinU1 * cosU2 + cosU1 * sinU2 * cos_lam)
+
+    # Pairs that did not converge, converged on the long way round, or are far enough apart in
+    # longitude to be nearly antipodal
+    failed = np.union1d(active, np.flatnonzero((np.abs(lam) > np.pi) | (np.abs(L) > (1 - f) * np.pi)))
+    if len(failed):
+        s[failed], az1[failed], az2[failed] = _antipodal(U1[failed], U2[failed], L[failed], a, f)
+
+    # A tiny negative azimuth wraps to 360 in floating point
+    az1 = np.degrees(az1) % 360.0
+    az2 = np.degrees(az2) % 360.0
+    az1[az1 == 360.0] = 0.0
+    az2[az2 == 360.0] = 0.0
+    return s.reshape(shape), az1.reshape(shape), az2.reshape(shape)
+
+
+def distance(lon1, lat1, lon2, lat2, a=WGS84_A, f=WGS84_F):
+    # Ellipsoid distances (meters) between arrays of points (degrees)
+    return inverse(lon1, lat1, lon2, lat2, a, f)[0]
+
+
+def leg_lengths(lon, lat, a=WGS84_A, f=WGS84_F):
+    # Ellipsoid distances (meters) between consecutive points of a path (degrees)
+    lon = np.asarray(lon, dtype=np.float64).reshape(-1)
+    lat = np.asarray(lat, dtype=np.float64).reshape(-1)
+    return inverse(lon[:-1], lat[:-1], lon[1:], lat[1:], a, f)[0]
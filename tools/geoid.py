@@ -0,0 +1,93 @@
+import os.path
+import struct
+import threading
+
+import numpy as np
+
+from tools.grid_file import TiledGrid
+
+
+#
+# GeoidGrid - geoid heights from NGS binary geoid model files
+#
+# GEOID18, GEOID12B and the other NGS models are distributed as .bin files -
+# a 44 byte header (south latitude, west longitude, latitude and longitude
+# spacing as float64 degrees, then rows, columns and kind as int32) followed by
+# float32 geoid heights in meters, row by row from the south, west to east.
+# Files come in either byte order. The heights are memory mapped and
+# interpolated with TiledGrid.
+#
+# Orthometric height H = h - N for ellipsoid height h and geoid height N.
+#
+
+_HEADER = 44
+
+# Open grids by absolute path
+_geoids = {}
+_geoids_lock = threading.Lock()
+
+
+class GeoidGridError(Exception):
+    pass
+
+
+class GeoidGrid(object):
+    """ NGS binary geoid height grid.
+        :param path: .bin geoid model file
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, 'rb') as f:
+            header = f.read(_HEADER)
+        if len(header) < _HEADER:
+            raise GeoidGridError('Not an NGS geoid grid file: %s' % path)
+
+        # The kind flag is 1 for float32 heights, which gives the byte order
+        for byte_order in '<>':
+            south, west, dlat, dlon = struct.unpack(byte_order + '4d', header[:32])
+            rows, cols, kind = struct.unpack(byte_order + '3i', header[32:])
+            if kind == 1:
+                break
+        else:
+            raise GeoidGridError('Unsupported NGS geoid grid: %s' % path)
+
+        if rows * cols * 4 + _HEADER > os.path.getsize(path):
+            raise GeoidGridError('Bad NGS geoid grid size: %s' % path)
+
+        # West longitude is 0-360 in the NGS files
+        west = (west + 180.0) % 360.0 - 180.0
+        data = np.memmap(path, dtype=byte_order + 'f4', mode='r', offset=_HEADER, shape=(rows, cols))
+        self.grid = TiledGrid(data, south, west, dlat, dlon)
+
+    def undulation(self, lon, lat):
+        """ Geoid height N (meters) at arrays of longitudes and latitudes (degrees).
+            :return: geoid heights, nan outside the grid
+
+        """
+        lon = np.asarray(lon, dtype=np.float64).reshape(-1)
+        lat = np.asarray(lat, dtype=np.float64).reshape(-1)
+
+        # Longitudes east of the grid's western edge
+        lon = self.grid.west + (lon - self.grid.west) % 360.0
+        return self.grid.interpolate(lon, lat)[:, 0]
+
+    def orthometric(self, lon, lat, h):
+        # Orthometric heights from ellipsoid heights (meters), nan outside the grid
+        return np.asarray(h, dtype=np.float64) - self.undulation(lon, lat)
+
+    def ellipsoid(self, lon, lat, H):
+        # Ellipsoid heights from orthometric heights (meters), nan outside the grid
+        return np.asarray(H, dtype=np.float64) + self.undulation(lon, lat)
+
+
+def open_geoid(path):
+    # Shared GeoidGrid for a grid file, the tile cache is kept between calls
+    key = os.path.normcase(os.path.abspath(path))
+    with _geoids_lock:
+        geoid = _geoids.get(key)
+        if geoid is None:
+            geoid = _geoids[key] = GeoidGrid(path)
+    return geoid
@@ -0,0 +1,466 @@
+import re
+import sqlite3
+import struct
+import numpy as np
+
+from tools.feature_store import FeatureStore, POINT_FIELDS, POINT_FIELD_NAMES, TRACK_FIELDS, TRACK_FIELD_NAMES
+
+
+#
+# GeoPackageStore - feature store backed by a GeoPackage (sqlite3) file
+#
+# Features are written with executemany inside a single transaction. The R-tree
+# spatial index is loaded after the features in the same transaction. Index
+# maintenance triggers are not created since they depend on the ST_* SQL
+# functions, every load through this store updates the index directly.
+#
+
+GPKG_APPLICATION_ID = 0x47504B47
+GPKG_USER_VERSION = 10200
+
+GEOMETRY_COLUMN = 'geom'
+
+SQL_TYPES = {'DOUBLE': 'DOUBLE', 'TEXT': 'TEXT', 'LONG': 'INTEGER'}
+
+# GeoPackage binary point, little-endian, no envelope -
+#   magic, version, flags, srs_id, wkb byte order, wkb type, x, y
+GP_POINT = struct.Struct('<2sBBiBIdd')
+
+# GeoPackage binary header with an xy envelope followed by a WKB LineString header -
+#   magic, version, flags, srs_id, minx, maxx, miny, maxy, wkb byte order, wkb type, num points
+GP_LINESTRING = struct.Struct('<2sBBi4dBII')
+
+# GeoPackage binary header without an envelope followed by an empty WKB LineString
+GP_EMPTY_LINESTRING = struct.Struct('<2sBBiBII')
+
+GP_FLAGS_LE = 0x01
+GP_FLAGS_ENVELOPE_XY = 0x02
+GP_FLAGS_EMPTY = 0x10
+GP_ENVELOPE_SIZE = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}
+
+WKB_POINT = 1
+WKB_LINESTRING = 2
+
+WGS84_WKT = (
+    'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563]],'
+    'PRIMEM["Greenwich",0],UNIT["degree",0.0174532925199433]]'
+)
+
+CORE_TABLES = (
+    '''CREATE TABLE IF NOT EXISTS gpkg_spatial_ref_sys (
+        srs_name TEXT NOT NULL,
+        srs_id INTEGER NOT NULL PRIMARY KEY,
+        organization TEXT NOT NULL,
+        organization_coordsys_id INTEGER NOT NULL,
+        definition TEXT NOT NULL,
+        description TEXT)''',
+    '''CREATE TABLE IF NOT EXISTS gpkg_contents (
+        table_name TEXT NOT NULL PRIMARY KEY,
+        data_type TEXT NOT NULL,
+        identifier TEXT UNIQUE,
+        description TEXT DEFAULT '',
+        last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+        min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE,
+        srs_id INTEGER,
+        CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id))''',
+    '''CREATE TABLE IF NOT EXISTS gpkg_geometry_columns (
+        table_name TEXT NOT NULL,
+        column_name TEXT NOT NULL,
+        geometry_type_name TEXT NOT NULL,
+        srs_id INTEGER NOT NULL,
+        z TINYINT NOT NULL,
+        m TINYINT NOT NULL,
+        CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name),
+        CONSTRAINT fk_gc_tn FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name),
+        CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys (srs_id))''',
+    '''CREATE TABLE IF NOT EXISTS gpkg_extensions (
+        table_name TEXT,
+        column_name TEXT,
+        extension_name TEXT NOT NULL,
+        definition TEXT NOT NULL,
+        scope TEXT NOT NULL,
+        CONSTRAINT ge_tce UNIQUE (table_name, column_name, extension_name))''',
+)
+
+DEFAULT_SRS = (
+    ('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', 'undefined cartesian coordinate reference system'),
+    ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', 'undefined geographic coordinate reference system'),
+    ('WGS 84 geodetic', 4326, 'EPSG', 4326, WGS84_WKT, 'longitude/latitude coordinates in decimal degrees'),
+)
+
+WKT_NAME = re.compile(r'\s*\w+\[\s*"([^"]*)"')
+
+# The last UNIT in a WKT definition is the linear unit for projected systems
+WKT_UNIT = re.compile(r'UNIT\[\s*"[^"]*"\s*,\s*([-+0-9.eE]+)')
+
+
+class SpatialReference(object):
+    """ Minimal spatial reference read from gpkg_spatial_ref_sys. """
+
+    def __init__(self, factoryCode, name, definition):
+        self.factoryCode = factoryCode
+        self.name = name
+        self.definition = definition
+        self.type = 'Projected' if definition.lstrip().upper().startswith('PROJ') else 'Geographic'
+
+        units = WKT_UNIT.findall(definition)
+        self.metersPerUnit = float(units[-1]) if units and self.type == 'Projected' else 1.0
+
+    def exportToString(self):
+        return self.definition
+
+    def matches(self, spatial_reference):
+        # Same coordinate system as an arcpy spatial reference, by EPSG code or by definition
+        if self.factoryCode > 0 and self.factoryCode == spatial_reference.factoryCode:
+            return True
+        return self.definition == spatial_reference.exportToString().split(';')[0]
+
+
+def encode_point(srs_id, x, y):
+    return GP_POINT.pack(b'GP', 0, GP_FLAGS_LE, srs_id, 1, WKB_POINT, x, y)
+
+
+def encode_linestring(srs_id, coords):
+    if not len(coords):
+        return GP_EMPTY_LINESTRING.pack(b'GP', 0, GP_FLAGS_LE | GP_FLAGS_EMPTY, srs_id, 1, WKB_LINESTRING, 0)
+    xs = [c[0] for c in coords]
+    ys = [c[1] for c in coords]
+    header = GP_LINESTRING.pack(b'GP', 0, GP_FLAGS_LE | GP_FLAGS_ENVELOPE_XY, srs_id,
+                                min(xs), max(xs), min(ys), max(ys), 1, WKB_LINESTRING, len(coords))
+    flat = [v for c in coords for v in c[0:2]]
+    return header + struct.pack('<%dd' % len(flat), *flat)
+
+
+def _wkb_offset(blob):
+    # Offset of the WKB geometry following the GeoPackage binary header
+    flags = blob[3]
+    return 8 + GP_ENVELOPE_SIZE[(flags >> 1) & 0x07]
+
+
+def decode_point(blob):
+    if blob is None:
+        return None
+    offset = _wkb_offset(blob)
+    order = '<' if blob[offset] == 1 else '>'
+    return struct.unpack_from(order + 'dd', blob, offset + 5)
+
+
+def decode_linestring(blob):
+    if blob is None:
+        return None
+    offset = _wkb_offset(blob)
+    order = '<' if blob[offset] == 1 else '>'
+    n, = struct.unpack_from(order + 'I', blob, offset + 5)
+    flat = struct.unpack_from(order + '%dd' % (2 * n), blob, offset + 9)
+    return list(zip(flat[0::2], flat[1::2]))
+
+
+class GeoPackageStore(FeatureStore):
+
+    def __init__(self, gpkg_file, table):
+        FeatureStore.__init__(self, '%s\\%s' % (gpkg_file, table))
+        self.gpkg_file = gpkg_file
+        self.table = table
+
+    def _connect(self):
+        con = sqlite3.connect(self.gpkg_file)
+        con.execute('PRAGMA synchronous = NORMAL')
+        if con.execute('PRAGMA application_id').fetchone()[0] != GPKG_APPLICATION_ID:
+            with con:
+                con.execute('PRAGMA application_id = %d' % GPKG_APPLICATION_ID)
+                con.execute('PRAGMA user_version = %d' % GPKG_USER_VERSION)
+                for sql in CORE_TABLES:
+                    con.execute(sql)
+                con.executemany('INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)', DEFAULT_SRS)
+        return con
+
+    def _srs_id(self, con):
+        row = con.execute('SELECT srs_id FROM gpkg_geometry_columns WHERE table_name = ?', (self.table,)).fetchone()
+        if row is None:
+            raise ValueError('GeoPackage feature class not found: %s' % self.path)
+        return row[0]
+
+    def _register_srs(self, con, sr):
+        # Add the spatial reference to gpkg_spatial_ref_sys and return the srs_id
+        if sr is None:
+            return -1
+        if isinstance(sr, str) and sr.strip().isdigit():
+            sr = int(sr)
+        if isinstance(sr, int):
+            srs_id, name, definition = sr, 'EPSG:%d' % sr, 'undefined'
+        elif isinstance(sr, str):
+            # Spatial reference as WKT text
+            definition = sr.split(';')[0]
+            m = WKT_NAME.match(definition)
+            srs_id, name = 0, m.group(1) if m else 'Custom'
+        else:
+            srs_id, name = sr.factoryCode, sr.name
+            definition = sr.exportToString().split(';')[0]
+
+        if not srs_id:
+            # Custom coordinate system, look for a matching definition or allocate a new id
+            row = con.execute('SELECT srs_id FROM gpkg_spatial_ref_sys WHERE definition = ?', (definition,)).fetchone()
+            if row is not None:
+                return row[0]
+            row = con.execute('SELECT max(srs_id) FROM gpkg_spatial_ref_sys').fetchone()
+            srs_id = max(100000, row[0] + 1)
+            organization = 'NONE'
+        else:
+            organization = 'EPSG'
+
+        con.execute('INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)',
+                    (name, srs_id, organization, srs_id, definition, None))
+        return srs_id
+
+    def _drop(self, con):
+        t = self.table
+        con.execute('DROP TABLE IF EXISTS "%s"' % t)
+        con.execute('DROP TABLE IF EXISTS "rtree_%s_%s"' % (t, GEOMETRY_COLUMN))
+        con.execute('DELETE FROM gpkg_geometry_columns WHERE table_name = ?', (t,))
+        con.execute('DELETE FROM gpkg_extensions WHERE table_name = ?', (t,))
+        con.execute('DELETE FROM gpkg_contents WHERE table_name = ?', (t,))
+
+    def _create(self, con, geometry_type, fields, sr):
+        t = self.table
+        self._drop(con)
+        srs_id = self._register_srs(con, sr)
+
+        columns = ['fid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL', '%s %s' % (GEOMETRY_COLUMN, geometry_type)]
+        for name, field_type, length in fields:
+            columns.append('%s %s' % (name, SQL_TYPES[field_type] + ('(%d)' % length if length else '')))
+        con.execute('CREATE TABLE "%s" (%s)' % (t, ', '.join(columns)))
+
+        con.execute('INSERT INTO gpkg_contents (table_name, data_type, identifier, srs_id) VALUES (?, ?, ?, ?)',
+                    (t, 'features', t, srs_id))
+        con.execute('INSERT INTO gpkg_geometry_columns VALUES (?, ?, ?, ?, 0, 0)',
+                    (t, GEOMETRY_COLUMN, geometry_type, srs_id))
+        con.execute('CREATE VIRTUAL TABLE "rtree_%s_%s" USING rtree(id, minx, maxx, miny, maxy)' % (t, GEOMETRY_COLUMN))
+        con.execute('INSERT INTO gpkg_extensions VALUES (?, ?, ?, ?, ?)',
+                    (t, GEOMETRY_COLUMN, 'gpkg_rtree_index', 'http://www.geopackage.org/spec120/#extension_rtree',
+                     'write-only'))
+
+    def _update_extent(self, con):
+        t = self.table
+        con.execute(
+            'UPDATE gpkg_contents SET '
+            'min_x = (SELECT min(minx) FROM "rtree_{0}_{1}"), max_x = (SELECT max(maxx) FROM "rtree_{0}_{1}"), '
+            'min_y = (SELECT min(miny) FROM "rtree_{0}_{1}"), max_y = (SELECT max(maxy) FROM "rtree_{0}_{1}"), '
+            'last_change = strftime(\'%Y-%m-%dT%H:%M:%fZ\', \'now\') '
+            'WHERE table_name = ?'.format(t, GEOMETRY_COLUMN), (t,))
+
+    def exists(self):
+        con = self._connect()
+        try:
+            row = con.execute('SELECT 1 FROM gpkg_contents WHERE table_name = ?', (self.table,)).fetchone()
+        finally:
+            con.close()
+        return row is not None
+
+    def spatial_reference(self):
+        con = self._connect()
+        try:
+            row = con.execute(
+                'SELECT s.srs_id, s.srs_name, s.definition FROM gpkg_geometry_columns g '
+                'JOIN gpkg_spatial_ref_sys s ON s.srs_id = g.srs_id WHERE g.table_name = ?',
+                (self.table,)).fetchone()
+        finally:
+            con.close()
+        return SpatialReference(*row) if row else None
+
+    def field_names(self):
+        con = self._connect()
+        try:
+            names = [row[1].upper() for row in con.execute('PRAGMA table_info("%s")' % self.table)]
+        finally:
+            con.close()
+        return ['SHAPE' if name == GEOMETRY_COLUMN.upper() else name for name in names]
+
+    def ensure_name_index(self):
+        con = self._connect()
+        try:
+            with con:
+                con.execute('CREATE INDEX IF NOT EXISTS "idx_{0}_NAME" ON "{0}" (NAME)'.format(self.table))
+        finally:
+            con.close()
+
+    def create_points(self, sr):
+        con = self._connect()
+        try:
+            with con:
+                self._create(con, 'POINT', POINT_FIELDS, sr)
+        finally:
+            con.close()
+        return self.path
+
+    def insert_points(self, rows):
+        t = self.table
+        con = self._connect()
+        try:
+            with con:
+                srs_id = self._srs_id(con)
+                last = con.execute('SELECT coalesce(max(fid), 0) FROM "%s"' % t).fetchone()[0]
+                coords = []
+
+                def records():
+                    # Encode the point geometry and collect the coordinates as the rows are written
+                    pack = GP_POINT.pack
+                    for row in rows:
+                        x, y = row[0]
+                        coords.append((x, x, y, y))
+                        yield (pack(b'GP', 0, GP_FLAGS_LE, srs_id, 1, WKB_POINT, x, y),) + tuple(row[1:])
+
+                columns = ', '.join((GEOMETRY_COLUMN,) + POINT_FIELD_NAMES)
+                values = ', '.join('?' * (1 + len(POINT_FIELD_NAMES)))
+                con.executemany('INSERT INTO "%s" (%s) VALUES (%s)' % (t, columns, values), records())
+
+                # SQLite assigns the fids, AUTOINCREMENT keeps them above every fid used before, so
+                # the new rows are those past the last fid, in insert order. Build the spatial index
+                # after the load.
+                fids = [row[0] for row in con.execute('SELECT fid FROM "%s" WHERE fid > ? ORDER BY fid' % t, (last,))]
+                con.executemany('INSERT INTO "rtree_%s_%s" VALUES (?, ?, ?, ?, ?)' % (t, GEOMETRY_COLUMN),
+                                ((fid,) + xy for fid, xy in zip(fids, coords)))
+                self._update_extent(con)
+        finally:
+            con.close()
+
+        return fids
+
+    def update_points(self, rows):
+        t = self.table
+        con = self._connect()
+        try:
+            with con:
+                srs_id = self._srs_id(con)
+                pack = GP_POINT.pack
+                records, index = [], []
+                for fid, row in rows:
+                    x, y = row[0]
+                    records.append((pack(b'GP', 0, GP_FLAGS_LE, srs_id, 1, WKB_POINT, x, y),) + tuple(row[1:]) + (fid,))
+                    index.append((x, x, y, y, fid))
+
+                assignments = ', '.join('%s = ?' % c for c in (GEOMETRY_COLUMN,) + POINT_FIELD_NAMES)
+                cur = con.executemany('UPDATE "%s" SET %s WHERE fid = ?' % (t, assignments), records)
+                count = cur.rowcount
+                con.executemany('UPDATE "rtree_%s_%s" SET minx = ?, maxx = ?, miny = ?, maxy = ? WHERE id = ?'
+                                % (t, GEOMETRY_COLUMN), index)
+                self._update_extent(con)
+        finally:
+            con.close()
+
+        return count
+
+    def delete_points(self, oids):
+        t = self.table
+        con = self._connect()
+        try:
+            with con:
+                fids = [(fid,) for fid in oids]
+                count = con.executemany('DELETE FROM "%s" WHERE fid = ?' % t, fids).rowcount
+                con.executemany('DELETE FROM "rtree_%s_%s" WHERE id = ?' % (t, GEOMETRY_COLUMN), fids)
+                self._update_extent(con)
+        finally:
+            con.close()
+
+        return count
+
+    def read_points(self, fields, spatial_reference=None, order_by=None, where=None):
+        columns = []
+        for field in fields:
+            if field.upper() in ('SHAPE@XY', 'SHAPE@', 'SHAPE'):
+                columns.append(GEOMETRY_COLUMN)
+            else:
+                columns.append('"%s"' % field)
+        sql = 'SELECT %s FROM "%s"' % (', '.join(columns), self.table)
+        if where:
+            sql += ' WHERE %s' % where
+        if order_by:
+            sql += ' ORDER BY %s' % order_by
+
+        shape = [c == GEOMETRY_COLUMN for c in columns]
+
+        project = None
+        if spatial_reference is not None:
+            sr = self.spatial_reference()
+            if sr is None:
+                raise ValueError('GeoPackage feature class has no spatial reference: %s' % self.path)
+            if not sr.matches(spatial_reference):
+                # Projection is delegated to arcpy
+                from tools.backend import arcpy
+                if sr.factoryCode > 0:
+                    source_sr = arcpy.SpatialReference(sr.factoryCode)
+                elif sr.definition != 'undefined':
+                    source_sr = arcpy.SpatialReference()
+                    source_sr.loadFromString(sr.definition)
+                else:
+                    source_sr = None
+
+                def project(xy):
+                    geom = arcpy.PointGeometry(arcpy.Point(*xy), source_sr).projectAs(spatial_reference)
+                    return geom.firstPoint.X, geom.firstPoint.Y
+
+        con = self._connect()
+        try:
+            for row in con.execute(sql):
+                row = list(row)
+                for i, is_shape in enumerate(shape):
+                    if is_shape:
+                        row[i] = decode_point(row[i])
+                        if project and row[i] is not None:
+                            row[i] = project(row[i])
+                yield tuple(row)
+        finally:
+            con.close()
+
+    def set_point_fields(self, fields, compute):
+        t = self.table
+        con = self._connect()
+        try:
+            with con:
+                existing = [row[1].upper() for row in con.execute('PRAGMA table_info("%s")' % t)]
+                for name, field_type, length in fields:
+                    if name.upper() not in existing:
+                        con.execute('ALTER TABLE "%s" ADD COLUMN %s %s' % (
+                            t, name, SQL_TYPES[field_type] + ('(%d)' % length if length else '')))
+
+                rows = [(fid, decode_point(blob)) for fid, blob in
+                        con.execute('SELECT fid, %s FROM "%s"' % (GEOMETRY_COLUMN, t))]
+                rows = [(fid, xy) for fid, xy in rows if xy is not None]
+                if rows:
+                    fids, coords = zip(*rows)
+                    values = [np.asarray(v).tolist() for v in compute(list(coords))]
+                    assignments = ', '.join('%s = ?' % f[0] for f in fields)
+                    con.executemany('UPDATE "%s" SET %s WHERE fid = ?' % (t, assignments),
+                                    zip(*values, fids))
+        finally:
+            con.close()
+
+        return len(rows)
+
+    def write_tracks(self, rows, sr):
+        t = self.table
+        con = self._connect()
+        try:
+            with con:
+                self._create(con, 'LINESTRING', TRACK_FIELDS, sr)
+                srs_id = self._srs_id(con)
+                fids, index = [], []
+
+                def records():
+                    # Empty tracks are written as empty geometries, which are left out of the R-tree
+                    for fid, (coords, *values) in enumerate(rows, start=1):
+                        fids.append(fid)
+                        if len(coords):
+                            xs = [c[0] for c in coords]
+                            ys = [c[1] for c in coords]
+                            index.append((fid, min(xs), max(xs), min(ys), max(ys)))
+                        yield (fid, encode_linestring(srs_id, coords)) + tuple(values)
+
+                columns = ', '.join(('fid', GEOMETRY_COLUMN) + TRACK_FIELD_NAMES)
+                values = ', '.join('?' * (2 + len(TRACK_FIELD_NAMES)))
+                con.executemany('INSERT INTO "%s" (%s) VALUES (%s)' % (t, columns, values), records())
+                con.executemany('INSERT INTO "rtree_%s_%s" VALUES (?, ?, ?, ?, ?)' % (t, GEOMETRY_COLUMN), index)
+                self._update_extent(con)
+        finally:
+            con.close()
+
+        return fids
@@ -0,0 +1,109 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+#
+# TiledGrid - bilinear interpolation from a memory mapped geographic grid
+#
+# Grid files (datum shifts, geoid heights) can be hundreds of MB. The node
+# values are left in a numpy.memmap and decoded to float64 one tile at a time,
+# only for the tiles that query points fall in. Decoded tiles are kept in a
+# small LRU cache. Each tile carries one extra row and column of nodes so every
+# grid cell, and therefore every bilinear lookup, lies within a single tile.
+#
+
+# Nodes along each side of a tile
+TILE_SIZE = 64
+
+# Decoded tiles kept per grid
+TILE_CACHE_SIZE = 256
+
+
+class TiledGrid(object):
+    """ Regular latitude/longitude grid of node values.
+        :param data: node values (shape: rows, cols) or (rows, cols, bands), row 0 is the
+            southern edge, typically a numpy.memmap
+        :param south: latitude of the first row (degrees)
+        :param west: longitude of the western column (degrees, east positive)
+        :param dlat: row spacing (degrees)
+        :param dlon: column spacing (degrees)
+        :param flip: True when column 0 of data is the eastern edge
+        :param scale: factor applied to the decoded values
+
+    """
+
+    def __init__(self, data, south, west, dlat, dlon, flip=False, scale=1.0):
+        self.data = data if data.ndim == 3 else data[:, :, None]
+        self.rows, self.cols, self.bands = self.data.shape
+        self.south, self.west = float(south), float(west)
+        self.dlat, self.dlon = float(dlat), float(dlon)
+        self.north = self.south + self.dlat * (self.rows - 1)
+        self.east = self.west + self.dlon * (self.cols - 1)
+        self.flip = flip
+        self.scale = scale
+
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def contains(self, lon, lat):
+        return (lon >= self.west) & (lon <= self.east) & (lat >= self.south) & (lat <= self.north)
+
+    def tile(self, tile_row, tile_col):
+        # Decoded float64 node values for a tile, from the cache when possible
+        key = (tile_row, tile_col)
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+                return tile
+
+        r0, c0 = tile_row * TILE_SIZE, tile_col * TILE_SIZE
+        r1, c1 = min(r0 + TILE_SIZE + 1, self.rows), min(c0 + TILE_SIZE + 1, self.cols)
+        if self.flip:
+            tile = self.data[r0:r1, self.cols - c1:self.cols - c0][:, ::-1]
+        else:
+            tile = self.data[r0:r1, c0:c1]
+        tile = np.array(tile, dtype=np.float64) * self.scale
+
+        with self._lock:
+            self._tiles[key] = tile
+            while len(self._tiles) > TILE_CACHE_SIZE:
+                self._tiles.popitem(last=False)
+        return tile
+
+    def interpolate(self, lon, lat):
+        """ Bilinear interpolation at arrays of points.
+            :return: values (shape: n, bands), nan outside the grid
+
+        """
+        lon = np.asarray(lon, dtype=np.float64).reshape(-1)
+        lat = np.asarray(lat, dtype=np.float64).reshape(-1)
+        values = np.full((len(lon), self.bands), np.nan)
+
+        inside = np.flatnonzero(self.contains(lon, lat))
+        if not len(inside):
+            return values
+
+        # Lower left node of each cell, cells on the north and east edges are moved in by one
+        u = (lon[inside] - self.west) / self.dlon
+        v = (lat[inside] - self.south) / self.dlat
+        col = np.minimum(np.floor(u).astype(np.int64), self.cols - 2)
+        row = np.minimum(np.floor(v).astype(np.int64), self.rows - 2)
+        fx = (u - col)[:, None]
+        fy = (v - row)[:, None]
+
+        # Points are grouped by tile, each tile is one vectorized pass
+        tiles = (row // TILE_SIZE) * (self.cols // TILE_SIZE + 1) + col // TILE_SIZE
+        order = np.argsort(tiles, kind='stable')
+        _, start = np.unique(tiles[order], return_index=True)
+        for s, e in zip(start, np.append(start[1:], len(order))):
+            i = order[s:e]
+            tile_row, tile_col = row[i[0]] // TILE_SIZE, col[i[0]] // TILE_SIZE
+            t = self.tile(tile_row, tile_col)
+            r, c = row[i] - tile_row * TILE_SIZE, col[i] - tile_col * TILE_SIZE
+            values[inside[i]] = ((t[r, c] * (1 - fx[i]) + t[r, c + 1] * fx[i]) * (1 - fy[i]) +
+                                 (t[r + 1, c] * (1 - fx[i]) + t[r + 1, c + 1] * fx[i]) * fy[i])
+
+        return values
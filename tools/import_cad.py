@@ -1,17 +1,21 @@
-import arcpy
-import arcpy.management as mgmt
+from tools.backend import arcpy, mgmt
+import tools.registry as registry
 
+import tools.timing as timing
 from tools.transform import Transform
+from tools.transform_features import correct_features
 
 
 #
 # ImportCAD - import CAD features transforming the output feature class
 #
 
+@timing.timed('Import CAD')
 def import_cad(input_fc, param_file, output_fc):
 
     # Copy the cad features
-    mgmt.CopyFeatures(input_fc, output_fc)
+    with timing.span('copy features'):
+        mgmt.CopyFeatures(input_fc, output_fc)
 
     if param_file:
 
@@ -27,22 +31,29 @@ def import_cad(input_fc, param_file, output_fc):
         src_ul = arcpy.Point(ctr_x - LINK_OFFSET, ctr_y + LINK_OFFSET)
         src_lr = arcpy.Point(ctr_x + LINK_OFFSET, ctr_y - LINK_OFFSET)
 
+        # Links from the similarity alone, the residual correction varies from place to place
+        similarity = xfm.similarity()
         links = []
         sr = desc.spatialReference
         for src in (src_ul, src_lr):
-            dst = arcpy.Point(*xfm.forward((src.X, src.Y)))
+            dst = arcpy.Point(*similarity.forward((src.X, src.Y)))
             links.append(arcpy.Polyline(arcpy.Array([src, dst]), sr))
 
-        arcpy.edit.TransformFeatures(output_fc, links, method='SIMILARITY')
-        mgmt.RecalculateFeatureClassExtent(output_fc)
+        with timing.span('similarity transform'):
+            arcpy.edit.TransformFeatures(output_fc, links, method='SIMILARITY')
+
+        # The residual correction is added after the similarity transform
+        if xfm.correction is not None:
+            correct_features(output_fc, xfm.correction.apply)
+        with timing.span('extent'):
+            mgmt.RecalculateFeatureClassExtent(output_fc)
 
     return
 
 
 class ImportCAD(object):
     def __init__(self):
-        self.label = "Import CAD"
-        self.description = "Import CAD features optionally applying a transform."
+        registry.describe(self)
         self.category = None
         self.canRunInBackground = False
 
@@ -1,174 +1,464 @@
-import arcpy
-import arcpy.management as mgmt
-import os.path
-from dateutil import parser, tz, utils
+from tools.backend import arcpy
+from concurrent.futures import ProcessPoolExecutor
+from dateutil import tz
+from datetime import datetime
+import glob
+import multiprocessing
+import numpy as np
+import os
+import pickle
+import sys
+import time
 import xml.etree.ElementTree as etree
 
+import tools.dwell as dwell
+import tools.geodesic as geodesic
+from tools.datum_grid import open_datum_grid
+from tools.feature_store import canonical_name, open_store
+from tools.geoid import open_geoid
+from tools.incremental import Manifest, sync_points, untracked_rows
+from tools.point_qa import check_points
+from tools.points import PointSet
+import tools.registry as registry
+import tools.timing as timing
 from tools.utils import create_points_feature_class
 
 
 #
-# ImportGPX - Create waypoint, route point and track features from a GPX file
+# ImportGPX - Create waypoint, route point and track features from GPX files
 #
+# A directory or glob pattern imports many files at once. Each file is parsed,
+# timed and projected in a worker process, the results are merged in file
+# name order and written once to each output feature class.
+#
+
+# Waypoint fields and the GPX element paths they are read from
+WPT_FIELDS = [
+    ('ELEVATION', 'gpx:ele'),
+    ('TIME', 'gpx:time'),
+    ('NAME', 'gpx:name'),
+    ('DESCRIPTION', 'gpx:desc'),
+    ('SYMBOL', 'gpx:sym'),
+    ('TYPE', 'gpx:type'),
+    ('SAMPLES', 'gpx:extensions/wptx1:WaypointExtension/wptx1:Samples')
+]
+
+GPX_NS = {
+    'gpx': 'http://www.topografix.com/GPX/1/1',
+    'gpxx': 'http://www.garmin.com/xmlschemas/GpxExtensions/v3',
+    'wptx1': 'http://www.garmin.com/xmlschemas/WaypointExtension/v1',
+    'ctx': 'http://www.garmin.com/xmlschemas/CreationTimeExtension/v1',
+}
+
+GCS_TRANSFORMS = 'WGS_1984_(ITRF08)_To_NAD_1983_2011; NAD_1927_To_NAD_1983_NADCON'
+
+# idle time between trkpts to start a new track segment
+TRKSEG_IDLE_SECS = 600
+
+
+def _expand(tag):
+    # Expanded {namespace}name form of the last step of a GPX element path
+    prefix, name = tag.split('/')[-1].split(':')
+    return '{%s}%s' % (GPX_NS[prefix], name)
+
+
+# Waypoint field columns keyed by expanded element tag, matched in a single pass over
+# each waypoint's elements rather than one path search per field
+WPT_TAGS = dict((_expand(tag), i) for i, (field, tag) in enumerate(WPT_FIELDS))
+
+
+def gpx_files(paths):
+    # Expand a list of GPX files, folders and glob patterns, folders contribute their *.gpx files
+    files = []
+    for path in paths:
+        path = path.strip().strip("'")
+        if os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(path, '*.gpx')))
+        elif glob.has_magic(path):
+            files += sorted(glob.glob(path))
+        elif path:
+            files.append(path)
+    return files
+
+
+def read_waypoints(gpx):
+    # Waypoints from a GPX file or root element as a PointSet of (lon, lat) coordinates
+    if not isinstance(gpx, etree.Element):
+        gpx = etree.parse(gpx).getroot()
+
+    lonlat, columns = [], []
+    for wpt in gpx.iterfind('gpx:wpt', GPX_NS):
+        values = [None] * len(WPT_FIELDS)
+        for elem in wpt.iter():
+            i = WPT_TAGS.get(elem.tag)
+            if i is not None and elem.text is not None:
+                values[i] = elem.text
+        values[2] = canonical_name(values[2])
+
+        lonlat.append((float(wpt.get('lon')), float(wpt.get('lat'))))
+        columns.append(values)
+
+    return PointSet.from_columns(lonlat, dict(zip((f for f, _ in WPT_FIELDS), zip(*columns))))
+
+
+def read_tracks(gpx, project, notes, heights=None):
+    # Track segments as ([track_pts, segment_name, len(track_pts), length], (segment_name, track_obs)) from a GPX
+    # root element. Lengths are WGS 1984 ellipsoid distances in meters.
+    # project(lon, lat) takes coordinate arrays and returns a list of (x, y), called once per track,
+    # heights(lon, lat, ele) optionally converts an elevation array.
+    tracks = []
+    segments = []
+    for track_num, trk in enumerate(gpx.iterfind('gpx:trk', GPX_NS), 1):
+        elem = trk.find('gpx:name', GPX_NS)
+        if elem is None:
+            track_name = 'track-%04d' % track_num
+        else:
+            track_name = elem.text
+
+        # Time and elevation for segment breaks and dwell detection
+        trkpts = trk.findall('./gpx:trkseg/gpx:trkpt', GPX_NS)
+        lon = np.array([trkpt.get('lon') for trkpt in trkpts], dtype=np.float64)
+        lat = np.array([trkpt.get('lat') for trkpt in trkpts], dtype=np.float64)
+        times, ele = [], np.full(len(trkpts), np.nan)
+        for i, trkpt in enumerate(trkpts):
+            elem = trkpt.find('gpx:time', GPX_NS)
+            times.append(None if elem is None else elem.text)
+            elem = trkpt.find('gpx:ele', GPX_NS)
+            if elem is not None:
+                ele[i] = float(elem.text)
+        if heights is not None:
+            ele = heights(lon, lat, ele)
+        track_obs = [(t, None if np.isnan(z) else z) for t, z in zip(times, ele.tolist())]
+
+        # Start a new segment where the time between timed trkpts exceeds the idle time
+        t = dwell.track_times([obs[0] for obs in track_obs])
+        with np.errstate(invalid='ignore'):
+            breaks = (np.flatnonzero(np.diff(t) > TRKSEG_IDLE_SECS) + 1).tolist()
+
+        # Geodesic length of each step between track points
+        legs = geodesic.leg_lengths(lon, lat) if len(trkpts) > 1 else np.zeros(0)
+
+        xy = project(lon, lat) if len(trkpts) > 1 else []
+        segment_num = 0
+        track_length = 0.0
+        for start, stop in zip([0] + breaks, breaks + [len(trkpts)]):
+            if stop - start > 1:
+                segment_num += 1
+                if segment_num > 1:
+                    segment_name = '%s SEG-%04d' % (track_name, segment_num)
+                else:
+                    segment_name = track_name
+                track_pts = xy[start:stop]
+                length = float(legs[start:stop - 1].sum())
+                track_length += length
+                tracks.append([track_pts, segment_name, len(track_pts), length])
+                segments.append((segment_name, track_obs[start:stop]))
+            else:
+                notes.append('Skipping track "%s": track_pts=%d' % (track_name, stop - start))
+
+        if segment_num:
+            notes.append('Track "%s": segments=%d length=%.1f m' % (track_name, segment_num, track_length))
+
+    return tracks, segments
+
+
+def portable_spatial_reference(sr):
+    # A spatial reference that can be passed to a worker process
+    try:
+        pickle.dumps(sr)
+        return sr
+    except Exception:
+        return sr.factoryCode or sr.exportToString()
+
+
+def _spatial_reference(sr):
+    if isinstance(sr, int):
+        return arcpy.SpatialReference(sr)
+    if isinstance(sr, str):
+        spatial_reference = arcpy.SpatialReference()
+        spatial_reference.loadFromString(sr)
+        return spatial_reference
+    return sr
+
+
+def read_gpx(gpx_file, sr, transformations, wpt, trk, datum_grid=None, geoid_grid=None):
+    """ Read and project the waypoints and tracks in a GPX file.
+        Runs in a worker process, so all the arguments and results can be pickled.
+        :param datum_grid: optional NTv2 grid file from the GPX datum to the datum of sr,
+            used in place of the geographic transformations
+        :param geoid_grid: optional NGS geoid grid file, GPX ellipsoid heights are
+            converted to orthometric heights
+        :return: (waypoint PointSet, track rows, track segments, notes, seconds, stages) where stages
+            are the (stage, seconds, rows) of the parse for timing.add_stages
+
+    """
+    started = time.perf_counter()
+
+    sr = _spatial_reference(sr)
+    arcpy.env.geographicTransformations = transformations
+    gcs = arcpy.SpatialReference(4326)
+    notes = []
+    stages = []
+
+    grid = None
+    if datum_grid:
+        # Shift to the datum of sr with the grid, the projection then needs no transformation
+        grid = open_datum_grid(datum_grid)
+        gcs = sr.GCS
+
+    def project(lon, lat):
+        if grid is not None:
+            lon, lat, inside = grid.forward(lon, lat)
+            if not inside.all():
+                notes.append('%s: %d points outside the datum grid not shifted' % (
+                    os.path.basename(gpx_file), np.count_nonzero(~inside)))
+        projecting = time.perf_counter()
+        # One multipoint projected for all the points
+        points = arcpy.Array([arcpy.Point(x, y) for x, y in zip(lon.tolist(), lat.tolist())])
+        pts = [(pt.X, pt.Y) for pt in arcpy.Multipoint(points, gcs).projectAs(sr).getPart()]
+        stages.append(('project', time.perf_counter() - projecting, len(pts)))
+        return pts
+
+    heights = None
+    if geoid_grid:
+        geoid = open_geoid(geoid_grid)
+
+        def heights(lon, lat, ele):
+            # Orthometric heights, elevations outside the geoid grid are dropped
+            H = geoid.orthometric(lon, lat, ele)
+            outside = np.count_nonzero(np.isnan(H) & ~np.isnan(ele))
+            if outside:
+                notes.append('%s: %d elevations outside the geoid grid dropped' % (os.path.basename(gpx_file), outside))
+            return H
+
+    mark = time.perf_counter()
+    gpx = etree.parse(gpx_file).getroot()
+    stages.append(('XML parse', time.perf_counter() - mark, None))
 
-def import_gpx(gpx_file, wpt_fc, trk_fc):
+    waypoints = PointSet()
+    if wpt:
+        mark = time.perf_counter()
+        waypoints = read_waypoints(gpx)
+        stages.append(('read waypoints', time.perf_counter() - mark, len(waypoints)))
+        lon, lat = waypoints.xy.T.copy()
+        ele = waypoints.column('ELEVATION')
+        if heights is not None:
+            ele = heights(lon, lat, ele)
+        waypoints.data['ELEVATION'] = np.round(ele / sr.metersPerUnit, 4)
+        if len(waypoints):
+            waypoints.xy = project(lon, lat)
 
-    GCS_WGS_84 = arcpy.SpatialReference(4326)
-    GCS_TRANSFORMS = 'WGS_1984_(ITRF08)_To_NAD_1983_2011; NAD_1927_To_NAD_1983_NADCON'
+    tracks, segments = [], []
+    if trk:
+        mark, projected = time.perf_counter(), len(stages)
+        tracks, segments = read_tracks(gpx, project, notes, heights)
+        seconds = time.perf_counter() - mark - sum(s[1] for s in stages[projected:])
+        stages.append(('read tracks', seconds, sum(t[2] for t in tracks)))
+
+    return waypoints, tracks, segments, notes, time.perf_counter() - started, stages
+
+
+def _read_gpx_job(args):
+    return read_gpx(*args)
+
+
+@timing.timed('Import GPX')
+def import_gpx(gpx_file, wpt_fc, trk_fc, dwell_fc=None, workers=None, incremental=False, datum_grid=None,
+               geoid_grid=None, qa_tolerance=None):
 
     arcpy.env.geographicTransformations = arcpy.env.geographicTransformations or GCS_TRANSFORMS
-    arcpy.AddMessage('Geographic Transformations: %s' % arcpy.env.geographicTransformations)
+    if datum_grid:
+        arcpy.AddMessage('Datum Grid: %s' % datum_grid)
+    else:
+        arcpy.AddMessage('Geographic Transformations: %s' % arcpy.env.geographicTransformations)
+    if geoid_grid:
+        arcpy.AddMessage('Geoid Grid: %s' % geoid_grid)
 
-    scratch = arcpy.env.scratchWorkspace
     arcpy.env.addOutputsToMap = False
 
-    WPT_FIELDS = [
-        ('ELEVATION', 'gpx:ele'),
-        ('TIME', 'gpx:time'),
-        ('NAME', 'gpx:name'),
-        ('DESCRIPTION', 'gpx:desc'),
-        ('SYMBOL', 'gpx:sym'),
-        ('TYPE', 'gpx:type'),
-        ('SAMPLES', 'gpx:extensions/wptx1:WaypointExtension/wptx1:Samples')
-    ]
-
-    ns = {
-        'gpx': 'http://www.topografix.com/GPX/1/1',
-        'gpxx': 'http://www.garmin.com/xmlschemas/GpxExtensions/v3',
-        'wptx1': 'http://www.garmin.com/xmlschemas/WaypointExtension/v1',
-        'ctx': 'http://www.garmin.com/xmlschemas/CreationTimeExtension/v1',
-    }
-
     etree.register_namespace('', 'http://www.topografix.com/GPX/1/1')
     etree.register_namespace('gpxx', 'http://www.garmin.com/xmlschemas/GpxExtensions/v3')
     etree.register_namespace('wptx1', 'http://www.garmin.com/xmlschemas/WaypointExtension/v1')
     etree.register_namespace('ctx', 'http://www.garmin.com/xmlschemas/CreationTimeExtension/v1')
 
-    gpx = etree.parse(gpx_file).getroot()
+    files = gpx_files(gpx_file.split(';'))
+    if not files:
+        arcpy.AddError('No GPX files found: %s' % gpx_file)
+        return None
 
     sr = arcpy.env.outputCoordinateSystem
-
-    if wpt_fc:
+    if sr is None:
+        arcpy.AddError('Geoprocessing environment not set: outputCoordinateSystem')
+        return None
+
+    wpt, trk = bool(wpt_fc), bool(trk_fc or dwell_fc)
+    parse = files
+
+    if incremental:
+        # Waypoints are synced from the changed files, tracks and dwells are rewritten when any file changed
+        grids = [g for g in (datum_grid, geoid_grid) if g]
+        sources = dict((f, [f] + grids) for f in files)
+        if wpt_fc:
+            wpt_manifest = Manifest(wpt_fc)
+            wpt_store = open_store(wpt_fc)
+            if untracked_rows(wpt_store, wpt_manifest):
+                arcpy.AddError('%s was not written by an incremental import, choose a new output or run a full '
+                               'import.' % wpt_fc)
+                return None
+            if not wpt_store.exists():
+                create_points_feature_class(wpt_fc, sr)
+                wpt_manifest.reset()
+            wpt_changed, wpt_removed = wpt_manifest.changes(sources)
+            wpt = bool(wpt_changed)
+
+        if trk:
+            outputs = [fc for fc in (trk_fc, dwell_fc) if fc]
+            trk_manifest = Manifest(outputs[0])
+            if not all(open_store(fc).exists() for fc in outputs):
+                trk_manifest.reset()
+            trk_changed, trk_removed = trk_manifest.changes(sources)
+            trk = bool(trk_changed or trk_removed)
+
+        if not trk:
+            parse = [f for f in files if wpt and f in wpt_changed]
+
+    jobs = [(f, portable_spatial_reference(sr), arcpy.env.geographicTransformations, wpt, trk, datum_grid,
+             geoid_grid) for f in parse]
+
+    # Parse the files in worker processes, map returns the results in file order
+    started = time.perf_counter()
+    with timing.span('parse files', len(jobs)):
+        workers = max(1, min(workers or os.cpu_count() or 1, len(jobs)))
+        if workers > 1:
+            if sys.platform == 'win32':
+                # Inside ArcGIS Pro sys.executable is the application, workers need the python interpreter
+                multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'python.exe'))
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(_read_gpx_job, jobs))
+        else:
+            results = [read_gpx(*job) for job in jobs]
+        timing.add_stages(s for result in results for s in result[5])
+
+    waypoints, tracks, segments = [], [], []
+    file_rows = {}
+    for f, (file_waypoints, file_tracks, file_segments, notes, secs, _) in zip(parse, results):
+        for note in notes:
+            arcpy.AddMessage(note)
+        arcpy.AddMessage('%s: waypoints=%d tracks=%d track_pts=%d length=%.1f m (%.2f s)' % (
+            os.path.basename(f), len(file_waypoints), len(file_tracks), sum(t[2] for t in file_tracks),
+            sum(t[3] for t in file_tracks), secs))
+        waypoints.append(file_waypoints)
+        tracks += file_tracks
+        segments += file_segments
+        file_rows[f] = file_waypoints
+    waypoints = PointSet.concatenate(waypoints)
+
+    if qa_tolerance and len(waypoints):
+        # Duplicates, name collisions and elevation outliers in the parsed waypoints
+        check_points(waypoints, float(qa_tolerance))
+
+    if wpt_fc and incremental:
+        if wpt_changed or wpt_removed:
+            rows = dict((f, file_rows[f]) for f in wpt_changed)
+            with timing.span('sync', sum(len(r) for r in rows.values())):
+                counts = sync_points(open_store(wpt_fc), wpt_manifest, wpt_changed, rows, wpt_removed)
+            arcpy.AddMessage('Waypoints inserted: %d  updated: %d  deleted: %d' % counts)
+        else:
+            arcpy.AddMessage('No waypoint changes')
+        wpt_manifest.save()
+    elif wpt_fc:
         create_points_feature_class(wpt_fc, sr)
+        if waypoints:
+            with timing.span('insert waypoints', len(waypoints)):
+                open_store(wpt_fc).insert_points(waypoints)
+        Manifest(wpt_fc).discard()
+
+    if incremental and (trk_fc or dwell_fc) and not trk:
+        arcpy.AddMessage('No track changes')
+    else:
+        if tracks and trk_fc:
+            with timing.span('insert tracks', len(tracks)):
+                open_store(trk_fc).write_tracks(tracks, sr)
+
+        if dwell_fc:
+            import_dwells(tracks, segments, dwell_fc, sr)
+
+        if incremental and trk:
+            trk_manifest.record(trk_changed, trk_removed)
+            trk_manifest.save()
+        elif not incremental and (trk_fc or dwell_fc):
+            Manifest(trk_fc or dwell_fc).discard()
+
+    elapsed = time.perf_counter() - started
+    points = len(waypoints) + sum(t[2] for t in tracks)
+    arcpy.AddMessage('Files: %d  Parsed: %d  Points: %d  Workers: %d  Elapsed: %.2f s  Throughput: %.0f points/s' % (
+        len(files), len(parse), points, workers, elapsed, points / elapsed if elapsed else 0.0))
+
+
+@timing.timed('dwells')
+def import_dwells(tracks, segments, dwell_fc, sr):
+    # Create averaged station points from the stationary intervals of the track segments
+    if create_points_feature_class(dwell_fc, sr) is None or not tracks:
+        return
 
-        waypoints = []
-        for wpt in gpx.findall('gpx:wpt', ns):
-            x, y = wpt.get('lon'), wpt.get('lat')
-            row = [arcpy.PointGeometry(arcpy.Point(x, y), GCS_WGS_84).projectAs(sr)]
-            for field, tag in WPT_FIELDS:
-                elem = wpt.find(tag, ns)
-
-                if elem is None:
-                    row.append(None)
-                elif field == 'ELEVATION':
-                    row.append('%0.4f' % (float(elem.text) / sr.metersPerUnit))
-                elif field == 'NAME' and elem.text.isdigit():
-                    row.append('%d' % int(elem.text))
-                else:
-                    row.append(elem.text)
-            waypoints.append(row)
+    xy = np.concatenate([np.array(trk[0], dtype=np.float64) for trk in tracks])
+    obs = [o for _, track_obs in segments for o in track_obs]
+    t = dwell.track_times([o[0] for o in obs])
+    z = np.array([np.nan if o[1] is None else o[1] for o in obs], dtype=np.float64)
+    segment = np.repeat(np.arange(len(tracks)), [trk[2] for trk in tracks])
+
+    # Thresholds in output units
+    units = sr.metersPerUnit or 1.0
+    station, keep = dwell.detect_dwells(xy, t, segment, dwell.DWELL_MAX_SPEED / units, dwell.DWELL_RADIUS / units)
+    if not keep.any():
+        arcpy.AddMessage('No dwells found')
+        return
 
-        if waypoints:
-            fields = ['SHAPE@'] + [f[0] for f in WPT_FIELDS]
-            cur = arcpy.da.InsertCursor(wpt_fc, fields)
-            for row in waypoints:
-                cur.insertRow(row)
-            del cur
-
-    if trk_fc:
-
-        # idle time between trkpts to start a new track segment
-        TRKSEG_IDLE_SECS = 600
-
-        tracks = []
-        track_num = 0
-        for trk in gpx.findall('gpx:trk', ns):
-            track_num += 1
-            elem = trk.find('gpx:name', ns)
-            if elem is None:
-                track_name = 'track-%04d' % track_num
-            else:
-                track_name = elem.text
-
-            track_pts = []
-            dt_last = None
-            segment_num = 0
-            for trkpt in trk.findall('./gpx:trkseg/gpx:trkpt', ns):
-                x, y = trkpt.get('lon'), trkpt.get('lat')
-                pt = arcpy.PointGeometry(arcpy.Point(x, y), GCS_WGS_84).projectAs(sr).firstPoint
-
-                # See if there's a track point time
-                elem = trkpt.find('gpx:time', ns)
-                if elem is None:
-                    dt_last = None
-                else:
-                    dt = utils.default_tzinfo(parser.parse(elem.text), tz.UTC)
-                    if dt_last and (dt - dt_last).seconds > TRKSEG_IDLE_SECS:
-                        # start a new segment
-                        if len(track_pts) > 1:
-                            segment_num += 1
-                            if segment_num > 1:
-                                segment_name = '%s SEG-%04d' % (track_name, segment_num)
-                            else:
-                                segment_name = track_name
-                            geom = arcpy.Polyline(arcpy.Array(track_pts), sr)
-                            tracks.append([geom , segment_name, len(track_pts)])
-                        else:
-                            arcpy.AddMessage('Skipping track "%s": track_pts=%d' % (track_name, len(track_pts)))
-                        track_pts = []
-                    dt_last = dt
-
-                track_pts.append(pt)
-
-            if len(track_pts) > 1:
-                segment_num += 1
-                if segment_num > 1:
-                    segment_name = '%s SEG-%04d' % (track_name, segment_num)
-                else:
-                    segment_name = track_name
-                geom = arcpy.Polyline(arcpy.Array(track_pts), sr)
-                tracks.append([geom, segment_name, len(track_pts)])
-            else:
-                arcpy.AddMessage('Skipping track "%s": track_pts=%d' % (track_name, len(track_pts)))
+    stations = dwell.dwell_stations(xy, z, t, station, keep)
 
-        if tracks:
-            temp_fc = os.path.join(scratch, os.path.basename(trk_fc) + '_Temp')
-            if sr is None:
-                arcpy.AddError('Geoprocessing environment not set: outputCoordinateSystem')
-                return None
+    # Station names follow the segment they were found in
+    first = np.flatnonzero(keep)[np.unique(station[keep], return_index=True)[1]]
+    numbers = {}
 
-            fc = mgmt.CreateFeatureclass(*os.path.split(temp_fc), geometry_type='POLYLINE', spatial_reference=sr)
-            mgmt.AddField(fc, 'NAME', 'TEXT', field_length=64)
-            mgmt.AddField(fc, 'POINTS', 'LONG')
+    names, descriptions = [], []
+    for i, p in enumerate(first.tolist()):
+        segment_name = segments[segment[p]][0]
+        numbers[segment_name] = numbers.get(segment_name, 0) + 1
+        secs = stations['end'][i] - stations['start'][i]
+        names.append('%s DWELL-%04d' % (segment_name, numbers[segment_name]))
+        descriptions.append('DWELL %d s %.3f RMS' % (secs, stations['spread'][i]))
+        arcpy.AddMessage('%s: %s' % (names[-1], descriptions[-1]))
 
-            cur = arcpy.da.InsertCursor(fc, ('SHAPE@', 'NAME', 'POINTS'))
-            for row in tracks:
-                cur.insertRow(row)
-            del cur
+    points = PointSet.from_columns(np.column_stack((stations['x'], stations['y'])), {
+        'TIME': [datetime.fromtimestamp(t, tz.UTC).strftime('%Y-%m-%dT%H:%M:%SZ') for t in stations['start'].tolist()],
+        'NAME': names,
+        'DESCRIPTION': descriptions,
+        'TYPE': 'DWELL',
+        'SAMPLES': stations['count'].tolist(),
+    })
+    points.data['ELEVATION'] = np.round(stations['z'] / units, 4)
 
-            mgmt.CopyFeatures(temp_fc, trk_fc)
-            del fc
+    open_store(dwell_fc).insert_points(points)
+    arcpy.AddMessage('Dwell stations: %d' % len(points))
 
 
 class ImportGPX(object):
     def __init__(self):
-        self.label = "Import GPX"
-        self.description = "Create waypoint, route point and track features from a GPX file."
+        registry.describe(self)
         self.category = None
         self.canRunInBackground = False
 
     def getParameterInfo(self):
         params = []
 
-        # Input GPX File
+        # Input GPX file, folder or glob pattern
         param = arcpy.Parameter(
-            displayName='Input GPX File',
+            displayName='Input GPX File or Folder',
             name='gpx_file',
-            datatype='DEFile',
+            datatype=['DEFile', 'DEFolder', 'GPString'],
             parameterType='Required',
             direction='Input'
         )
-        param.filter.list = ['gpx']
         params.append(param)
 
         # Output waypoint feature class
@@ -191,14 +481,73 @@ class ImportGPX(object):
         )
         params.append(param)
 
+        # Output dwell station feature class
+        param = arcpy.Parameter(
+            displayName='Output Dwell Station Feature Class',
+            name='dwell_fc',
+            datatype='GPFeatureLayer',
+            parameterType='Optional',
+            direction='Output'
+        )
+        params.append(param)
+
+        # Incremental import
+        param = arcpy.Parameter(
+            displayName='Incremental (only import changed files)',
+            name='incremental',
+            datatype='GPBoolean',
+            parameterType='Optional',
+            direction='Input'
+        )
+        param.value = False
+        params.append(param)
+
+        # Datum shift grid (optional)
+        param = arcpy.Parameter(
+            displayName='Datum Grid File (Optional)',
+            name='datum_grid',
+            datatype='DEFile',
+            parameterType='Optional',
+            direction='Input'
+        )
+        param.filter.list = ['gsb']
+        params.append(param)
+
+        # Geoid grid (optional)
+        param = arcpy.Parameter(
+            displayName='Geoid Grid File (Optional)',
+            name='geoid_grid',
+            datatype='DEFile',
+            parameterType='Optional',
+            direction='Input'
+        )
+        param.filter.list = ['bin']
+        params.append(param)
+
+        # Point QA tolerance (optional)
+        param = arcpy.Parameter(
+            displayName='QA Duplicate Tolerance (Optional)',
+            name='qa_tolerance',
+            datatype='GPDouble',
+            parameterType='Optional',
+            direction='Input'
+        )
+        params.append(param)
+
         return params
 
     def execute(self, params, messages):
         gpx_file = params[0].valueAsText
         wpt_fc = params[1].valueAsText
         trk_fc = params[2].valueAsText
+        dwell_fc = params[3].valueAsText
+        incremental = params[4].value
+        datum_grid = params[5].valueAsText
+        geoid_grid = params[6].valueAsText
+        qa_tolerance = params[7].valueAsText
 
-        import_gpx(gpx_file, wpt_fc, trk_fc)
+        import_gpx(gpx_file, wpt_fc, trk_fc, dwell_fc, incremental=incremental, datum_grid=datum_grid,
+                   geoid_grid=geoid_grid, qa_tolerance=qa_tolerance)
 
         return
 
@@ -209,5 +558,11 @@ if __name__ == '__main__':
 
     wpt_fc = arcpy.GetParameterAsText(1)
     trk_fc = arcpy.GetParameterAsText(2)
-
-    import_gpx(gpx_file, wpt_fc, trk_fc)
+    dwell_fc = arcpy.GetParameterAsText(3)
+    incremental = arcpy.GetParameterAsText(4).lower() == 'true'
+    datum_grid = arcpy.GetParameterAsText(5)
+    geoid_grid = arcpy.GetParameterAsText(6)
+    qa_tolerance = arcpy.GetParameterAsText(7)
+
+    import_gpx(gpx_file, wpt_fc, trk_fc, dwell_fc, incremental=incremental, datum_grid=datum_grid,
+               geoid_grid=geoid_grid, qa_tolerance=qa_tolerance)
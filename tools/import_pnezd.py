@@ -1,10 +1,18 @@
-import arcpy
-import arcpy.management as mgmt
+from tools.backend import arcpy
 from datetime import datetime
 from dateutil import tz
-import os.path
+import numpy as np
 
+from tools.columnar import ColumnarError, is_columnar, read_columns
+from tools.feature_store import open_store
+from tools.incremental import Manifest, sync_points, untracked_rows
+from tools.point_qa import check_points
+from tools.points import PointSet
+import tools.registry as registry
+from tools.scale_factor import GRID, GROUND, GridProjection, ScaleFactorError, ground_to_grid
+import tools.timing as timing
 from tools.transform import Transform
+from tools.transform_features import write_error_ellipses
 from tools.utils import create_points_feature_class
 
 
@@ -12,13 +20,8 @@ from tools.utils import create_points_feature_class
 # ImportPNEZD - import a PNEZD points file into a points feature class
 #
 
-def import_pnezd(pnezd_file, param_file, output_fc):
-
-    POINTS_SYMBOL = 'Flag, Red'
-    POINTS_TYPE = 'CAD'
-
-    arcpy.env.addOutputsToMap = False
-
+def read_pnezd(pnezd_file):
+    # Coordinates (x, y) and NAME, ELEVATION and DESCRIPTION columns of a PNEZD text file
     pts = []
     with open(pnezd_file) as f:
         for line in f:
@@ -32,36 +35,140 @@ def import_pnezd(pnezd_file, param_file, output_fc):
             else:
                 raise ValueError('Bad source point data: %s' % line)
 
-    if pts:
-        if not arcpy.Exists(output_fc):
+    if not pts:
+        return np.zeros((0, 2)), {}
+    names, north, east, elevation, descriptions = zip(*pts)
+    xy = np.column_stack((np.array(east, dtype=np.float64), np.array(north, dtype=np.float64)))
+    return xy, {'ELEVATION': np.array(elevation, dtype=np.float64), 'NAME': names, 'DESCRIPTION': descriptions}
+
+
+def read_pnezd_columns(pnezd_file):
+    # Coordinates and columns of a Parquet or Arrow points file as written by Export PNEZD. The
+    # N and E columns of a memory mapped Arrow file are views, only copied to stack the pairs.
+    columns = read_columns(pnezd_file)
+    missing = [c for c in ('N', 'E') if c not in columns]
+    if missing:
+        raise ColumnarError('Missing columns %s in %s' % (', '.join(missing), pnezd_file))
+
+    xy = np.column_stack((columns['E'], columns['N'])).astype(np.float64, copy=False)
+    values = dict((c, columns[c]) for c in ('NAME', 'DESCRIPTION') if c in columns)
+    if 'Z' in columns:
+        values['ELEVATION'] = columns['Z'].astype(np.float64, copy=False)
+    return xy, values
+
+
+@timing.timed('Import PNEZD')
+def import_pnezd(pnezd_file, param_file, output_fc, incremental=False, coordinates=GRID, elevation=None,
+                 geoid_height=None, ellipses=False, qa_tolerance=None):
+
+    POINTS_SYMBOL = 'Flag, Red'
+    POINTS_TYPE = 'CAD'
+
+    arcpy.env.addOutputsToMap = False
+
+    ground = (coordinates or GRID).upper() == GROUND
+    if ground and not param_file:
+        arcpy.AddError('Ground coordinates need transform parameters.')
+        raise arcpy.ExecuteError
+    if ground and elevation in (None, ''):
+        # The combined factor at the origin is taken at this elevation, no default fits every project
+        arcpy.AddError('Ground coordinates need the Project Elevation the transform was fitted at.')
+        raise arcpy.ExecuteError
+    if ellipses and not param_file:
+        arcpy.AddWarning('Error ellipses need transform parameters, none written.')
+        ellipses = False
+
+    if incremental:
+        # Skip the import when neither the points nor the transform changed
+        manifest = Manifest(output_fc)
+        store = open_store(output_fc)
+        if untracked_rows(store, manifest):
+            arcpy.AddError('%s was not written by an incremental import, choose a new output or run a full import.'
+                           % output_fc)
+            raise arcpy.ExecuteError
+        if not store.exists():
+            create_points_feature_class(output_fc)
+            manifest.reset()
+        sources = {pnezd_file: [pnezd_file] + ([param_file] if param_file else [])}
+        changed, removed = manifest.changes(sources)
+        if not changed and not removed:
+            arcpy.AddMessage('No changes: %s' % pnezd_file)
+            manifest.save()
+            return
+
+    with timing.span('parse') as stage:
+        if is_columnar(pnezd_file):
+            try:
+                xy, columns = read_pnezd_columns(pnezd_file)
+            except ColumnarError as e:
+                arcpy.AddError(str(e))
+                raise arcpy.ExecuteError
+        else:
+            xy, columns = read_pnezd(pnezd_file)
+        stage.rows = len(xy)
+
+    if len(xy) or incremental:
+        store = open_store(output_fc)
+        if not store.exists():
             create_points_feature_class(output_fc)
-        sr = arcpy.Describe(output_fc).spatialReference
 
         if param_file:
             xfm = Transform()
             xfm.load(param_file)
+            if ground and xfm.origin is None:
+                arcpy.AddError('Transform parameters have no project origin, recalculate the transform: %s' % param_file)
+                raise arcpy.ExecuteError
 
         pt_time = datetime.now().astimezone(tz.UTC).strftime('%Y-%m-%dT%H:%M:%SZ')
-        pt_symbol = POINTS_SYMBOL
-        pt_type = POINTS_TYPE
-        pt_samples = None
-
-        fields = ('SHAPE@XY', 'ELEVATION', 'TIME', 'NAME', 'DESCRIPTION', 'SYMBOL', 'TYPE', 'SAMPLES')
-        cur = arcpy.da.InsertCursor(output_fc, fields)
-        for name, n, e, z, desc in pts:
-            n, e, z = (float(n) for n in (n, e, z))
-            coords = (e, n)
+
+        with timing.span('point set', len(xy)):
+            points = PointSet.from_columns(xy, dict(columns, TIME=pt_time, SYMBOL=POINTS_SYMBOL, TYPE=POINTS_TYPE))
             if param_file:
-                coords = xfm.forward(coords)
-                z *= xfm.scale()
-            cur.insertRow((coords, z, pt_time, name, desc, pt_symbol, pt_type, pt_samples))
-        del cur
+                points.data['ELEVATION'] *= xfm.scale()
+
+        # Transform all points at once, the residual correction is vectorized
+        if param_file and len(points):
+            with timing.span('transform', len(points)):
+                if ground:
+                    # Ground distances scaled to grid by each point's combined factor
+                    try:
+                        projection = GridProjection.from_spatial_reference(store.spatial_reference())
+                    except ScaleFactorError as e:
+                        arcpy.AddError(str(e))
+                        raise arcpy.ExecuteError
+                    coords = ground_to_grid(xfm.similarity().forward_points(points.xy), points.column('ELEVATION'),
+                                            xfm.origin, projection, float(elevation),
+                                            float(geoid_height or 0.0))
+                    points.xy = coords if xfm.correction is None else xfm.correction.apply(coords)
+                else:
+                    points.xy = xfm.forward_points(points.xy)
+
+        if qa_tolerance:
+            # Duplicates, name collisions and elevation outliers in the imported points
+            check_points(points, float(qa_tolerance))
+
+        if incremental:
+            with timing.span('sync', len(points)):
+                counts = sync_points(store, manifest, changed, {pnezd_file: points}, removed)
+                manifest.save()
+            arcpy.AddMessage('Inserted: %d  Updated: %d  Deleted: %d' % counts)
+        else:
+            with timing.span('insert', len(points)):
+                store.insert_points(points)
+            Manifest(output_fc).discard()
+
+        if ellipses:
+            # Ellipses from the similarity parameter covariance for every point in the output
+            if xfm.covariance is None:
+                arcpy.AddWarning('No parameter covariance in %s, recalculate the transform for error ellipses.'
+                                 % param_file)
+            else:
+                write_error_ellipses(output_fc, xfm)
 
 
 class ImportPNEZD(object):
     def __init__(self):
-        self.label = "Import PNEZD"
-        self.description = "Import PNEZD points into a Points feature class."
+        registry.describe(self)
         self.category = None
         self.canRunInBackground = False
 
@@ -76,7 +183,7 @@ class ImportPNEZD(object):
             parameterType='Required',
             direction='Input'
         )
-        param.filter.list = ['txt']
+        param.filter.list = ['txt', 'parquet', 'arrow']
         params.append(param)
 
         # Transform Parameters (optional)
@@ -100,14 +207,86 @@ class ImportPNEZD(object):
         )
         params.append(param)
 
+        # Incremental import
+        param = arcpy.Parameter(
+            displayName='Incremental (only import changed points)',
+            name='incremental',
+            datatype='GPBoolean',
+            parameterType='Optional',
+            direction='Input'
+        )
+        param.value = False
+        params.append(param)
+
+        # Grid or ground source coordinates
+        param = arcpy.Parameter(
+            displayName='PNEZD Coordinates',
+            name='coordinates',
+            datatype='GPString',
+            parameterType='Optional',
+            direction='Input'
+        )
+        param.filter.type = 'ValueList'
+        param.filter.list = [GRID, GROUND]
+        param.value = GRID
+        params.append(param)
+
+        # Elevation the transform scale was fitted at (required for ground coordinates)
+        param = arcpy.Parameter(
+            displayName='Project Elevation',
+            name='elevation',
+            datatype='GPDouble',
+            parameterType='Optional',
+            direction='Input'
+        )
+        params.append(param)
+
+        # Geoid height in meters (ground coordinates)
+        param = arcpy.Parameter(
+            displayName='Geoid Height (meters)',
+            name='geoid_height',
+            datatype='GPDouble',
+            parameterType='Optional',
+            direction='Input'
+        )
+        params.append(param)
+
+        # Standard error ellipses from the transform parameter covariance
+        param = arcpy.Parameter(
+            displayName='Error Ellipses',
+            name='ellipses',
+            datatype='GPBoolean',
+            parameterType='Optional',
+            direction='Input'
+        )
+        param.value = False
+        params.append(param)
+
+        # Point QA tolerance (optional)
+        param = arcpy.Parameter(
+            displayName='QA Duplicate Tolerance (Optional)',
+            name='qa_tolerance',
+            datatype='GPDouble',
+            parameterType='Optional',
+            direction='Input'
+        )
+        params.append(param)
+
         return params
 
     def execute(self, params, messages):
         pnezd_file = params[0].valueAsText
         param_file = params[1].valueAsText
         output_fc = params[2].valueAsText
+        incremental = params[3].value
+        coordinates = params[4].valueAsText
+        elevation = params[5].valueAsText
+        geoid_height = params[6].valueAsText
+        ellipses = params[7].value
+        qa_tolerance = params[8].valueAsText
 
-        import_pnezd(pnezd_file, param_file, output_fc)
+        import_pnezd(pnezd_file, param_file, output_fc, incremental, coordinates, elevation, geoid_height,
+                     ellipses, qa_tolerance)
 
         return
 
@@ -117,5 +296,12 @@ if __name__ == '__main__':
     pnezd_file = arcpy.GetParameterAsText(0)
     param_file = arcpy.GetParameterAsText(1)
     output_fc = arcpy.GetParameterAsText(2)
+    incremental = arcpy.GetParameterAsText(3).lower() == 'true'
+    coordinates = arcpy.GetParameterAsText(4)
+    elevation = arcpy.GetParameterAsText(5)
+    geoid_height = arcpy.GetParameterAsText(6)
+    ellipses = arcpy.GetParameterAsText(7).lower() == 'true'
+    qa_tolerance = arcpy.GetParameterAsText(8)
 
-    import_pnezd(pnezd_file, param_file, output_fc)
\ No newline at end of file
+    import_pnezd(pnezd_file, param_file, output_fc, incremental, coordinates, elevation, geoid_height,
+                 ellipses, qa_tolerance)
\ No newline at end of file
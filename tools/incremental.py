@@ -0,0 +1,234 @@
+import hashlib
+import json
+import os
+import os.path
+
+from tools.feature_store import geopackage_path
+
+
+#
+# Incremental import - re-import only the points that changed since the last run
+#
+# A manifest kept beside the output workspace records each imported source file
+# by size, mtime and content digest, together with a (NAME, hash) key and object
+# id for every row it produced. Unchanged files are skipped from their size and
+# mtime alone. For a changed file the new row keys are compared with the recorded
+# ones: matching rows are left alone, changed rows are updated in place and the
+# rest are inserted or deleted. Rows from source files that no longer exist are
+# deleted.
+#
+
+MANIFEST_SUFFIX = '.import.json'
+
+# Read size for file digests
+DIGEST_BLOCK_SIZE = 1 << 20
+
+# Manifests for outputs that have no workspace on disk (in-memory feature classes)
+_manifests = {}
+
+
+def manifest_path(fc):
+    # Manifest file for an output feature class, None for in-memory outputs
+    gpkg = geopackage_path(fc)
+    if gpkg is not None:
+        return gpkg[0] + MANIFEST_SUFFIX
+
+    parts = fc.replace('\\', '/').split('/')
+    for i, part in enumerate(parts):
+        if os.path.splitext(part)[1].lower() in ('.gdb', '.sde'):
+            return os.path.join(*parts[:i + 1]) + MANIFEST_SUFFIX
+    if parts[0].lower() in ('memory', 'in_memory'):
+        return None
+    return os.path.join(os.path.dirname(fc), os.path.basename(fc) + MANIFEST_SUFFIX)
+
+
+def file_signature(paths):
+    # Size and mtime of the source file and the files it depends on
+    return [[os.path.getsize(p), os.path.getmtime(p)] for p in paths]
+
+
+def file_digest(paths):
+    # Content digest of the source file and the files it depends on
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(DIGEST_BLOCK_SIZE), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def row_key(row):
+    """ (NAME, hash) key for a point row.
+        :param row: point row (SHAPE@XY, ELEVATION, TIME, NAME, DESCRIPTION, SYMBOL, TYPE, SAMPLES)
+
+        The hash covers the coordinates and attributes. TIME is left out, it records when a
+        point was imported or collected rather than what was measured.
+
+    """
+    (x, y), ele, _, name, desc, symbol, point_type, samples = row
+    values = [
+        '%.6f' % x,
+        '%.6f' % y,
+        '' if ele is None else '%.4f' % float(ele),
+        desc or '',
+        symbol or '',
+        point_type or '',
+        '' if samples is None else str(int(samples)),
+    ]
+    return name, hashlib.sha1('\x1f'.join(values).encode('utf-8')).hexdigest()[:16]
+
+
+class Manifest(object):
+    """ Processed source files for an output feature class.
+
+        Sources are keyed by absolute path -
+        {source: {'signature': [[size, mtime], ...], 'digest': sha1, 'rows': [[NAME, hash, oid], ...]}}
+
+    """
+
+    def __init__(self, fc):
+        self.fc = fc
+        self.path = manifest_path(fc)
+        self.key = os.path.normcase(fc.replace('\\', '/'))
+
+        if self.path is None:
+            manifest = _manifests
+        elif os.path.isfile(self.path):
+            with open(self.path) as f:
+                manifest = json.load(f)
+        else:
+            manifest = {}
+        self.sources = manifest.setdefault(self.key, {})
+
+    def reset(self):
+        # Forget all sources, for a new or recreated output
+        self.sources.clear()
+
+    def discard(self):
+        # Forget the output, for an output written by a full import. The next incremental
+        # import can't tell its rows apart from the full import's and refuses the output.
+        self.sources.clear()
+        if self.path is not None and os.path.isfile(self.path):
+            self.save()
+
+    def changes(self, sources):
+        """ Split the sources into changed and unchanged files.
+            :param sources: dict of source file -> list of files it depends on (including itself)
+            :return: (changed, removed) - changed is a dict of source -> (signature, digest) and
+                removed the recorded sources that no longer exist
+
+        """
+        changed = {}
+        for source, paths in sources.items():
+            entry = self.sources.get(_source_key(source))
+            signature = file_signature(paths)
+            if entry is not None and entry['signature'] == signature:
+                continue
+            digest = file_digest(paths)
+            if entry is not None and entry['digest'] == digest:
+                # Touched but not changed
+                entry['signature'] = signature
+                continue
+            changed[source] = (signature, digest)
+
+        removed = [source for source in self.sources if not os.path.exists(source)]
+        return changed, removed
+
+    def record(self, changed, removed=()):
+        # Record processed sources for an output that is rewritten rather than synced
+        for source in removed:
+            self.sources.pop(_source_key(source), None)
+        for source, (signature, digest) in changed.items():
+            self.sources[_source_key(source)] = {'signature': signature, 'digest': digest, 'rows': []}
+
+    def save(self):
+        if self.path is None:
+            return
+
+        # Other outputs in the same workspace share the file, only this output is replaced
+        manifest = {}
+        if os.path.isfile(self.path):
+            with open(self.path) as f:
+                manifest = json.load(f)
+        manifest[self.key] = self.sources
+        if not self.sources:
+            del manifest[self.key]
+
+        temp = self.path + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(temp, self.path)
+
+
+def untracked_rows(store, manifest):
+    # True when the output has rows but no manifest, such as an output written by a full import.
+    # Its rows can't be matched to the sources, an incremental import would duplicate them.
+    return store.exists() and not manifest.sources and any(True for _ in store.read_points(('NAME',)))
+
+
+def _source_key(source):
+    return os.path.normcase(os.path.abspath(source))
+
+
+def sync_points(store, manifest, changed, rows, removed=()):
+    """ Apply the changed source rows to a points store.
+        :param store: FeatureStore for the output points
+        :param manifest: Manifest for the output
+        :param changed: dict of source -> (signature, digest) from Manifest.changes
+        :param rows: dict of source -> list of point rows for the changed sources
+        :param removed: sources whose rows are deleted
+        :return: number of rows (inserted, updated, deleted)
+
+    """
+    inserts, updates, deletes = [], [], []
+    entries = {}
+
+    for source in removed:
+        entry = manifest.sources.pop(_source_key(source), None)
+        if entry:
+            deletes += [oid for _, _, oid in entry['rows']]
+
+    for source, (signature, digest) in changed.items():
+        entry = manifest.sources.get(_source_key(source))
+
+        # Recorded object ids by row key, duplicate keys keep a list
+        old = {}
+        for name, h, oid in (entry['rows'] if entry else []):
+            old.setdefault((name, h), []).append(oid)
+
+        kept, added = [], []
+        for row in rows[source]:
+            key = row_key(row)
+            if old.get(key):
+                kept.append([key[0], key[1], old[key].pop()])
+            else:
+                added.append((key, row))
+
+        # Rows that no longer match are updated in place when their NAME is reused
+        stale = {}
+        for (name, _), oids in old.items():
+            stale.setdefault(name, []).extend(oids)
+
+        entries[source] = (signature, digest, kept)
+        for key, row in added:
+            if stale.get(key[0]):
+                oid = stale[key[0]].pop()
+                updates.append((oid, row))
+                kept.append([key[0], key[1], oid])
+            else:
+                inserts.append((source, key, row))
+        deletes += [oid for oids in stale.values() for oid in oids]
+
+    if deletes:
+        store.delete_points(deletes)
+    if updates:
+        store.update_points(updates)
+    if inserts:
+        oids = store.insert_points([row for _, _, row in inserts])
+        for (source, key, _), oid in zip(inserts, oids):
+            entries[source][2].append([key[0], key[1], oid])
+
+    for source, (signature, digest, kept) in entries.items():
+        manifest.sources[_source_key(source)] = {'signature': signature, 'digest': digest, 'rows': kept}
+
+    return len(inserts), len(updates), len(deletes)
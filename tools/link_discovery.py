@@ -0,0 +1,312 @@
+from tools.backend import arcpy
+import os.path
+import numpy as np
+import xml.etree.ElementTree as etree
+
+import tools.transform as transform
+from tools.defaults import defaults_path
+from tools.feature_store import canonical_name, open_store
+import tools.registry as registry
+from tools.spatial_index import GridIndex
+import tools.utils as utils
+
+
+#
+# DiscoverLinks - match source points to target points and write the Calculate Transform links
+#
+
+# Iteration limit for the match and refit loop
+MAX_ITERATIONS = 20
+
+# Number of links listed in the tool messages
+MAX_LISTED_LINKS = 100
+
+
+def read_points(fc):
+    # Point names and coordinates (shape: n, 2) from a points feature class
+    names, coords = [], []
+    for name, xy in open_store(fc).read_points(('NAME', 'SHAPE@XY')):
+        if xy is not None and xy[0] is not None:
+            names.append(canonical_name(name))
+            coords.append(xy)
+    return names, np.array(coords, dtype=np.float64).reshape(-1, 2)
+
+
+def match_points(xfm, source_xy, index, tolerance):
+    # Match transformed source points to the nearest target within tolerance, one source per target.
+    # Returns arrays of source and target indices and the match distances.
+    nearest, dist = index.nearest(xfm.forward_points(source_xy), tolerance)
+    src = np.flatnonzero(nearest >= 0)
+    dst, dist = nearest[src], dist[src]
+
+    # Keep the closest source for targets matched more than once, the first of equally close ones
+    closest = np.full(len(index), np.inf)
+    np.minimum.at(closest, dst, dist)
+    keep = dist == closest[dst]
+    src, dst, dist = src[keep], dst[keep], dist[keep]
+
+    first = np.full(len(index), len(source_xy))
+    np.minimum.at(first, dst, src)
+    keep = src == first[dst]
+
+    return src[keep], dst[keep], dist[keep]
+
+
+def discover_links(source_names, source_xy, target_names, target_xy, xfm, tolerance,
+                   rotate=None, scale=None, max_iterations=MAX_ITERATIONS):
+    """ Find source-target links starting from a rough transform.
+        :param xfm: initial Transform
+        :param tolerance: match distance in target units
+        :param rotate: optional fixed rotation in degrees for the refit
+        :param scale: optional fixed scale for the refit
+        :return: list of links (source name, target name, distance), final Transform, iterations
+            and whether the matches converged within max_iterations
+
+        Source points are transformed and matched to the nearest target within tolerance.
+        The transform is refit from the matched links and the process repeats until the
+        set of matches stops changing. The refits use fit_points, the covariance of the
+        parameters is left to Calculate Transform.
+
+    """
+    index = GridIndex(target_xy, tolerance)
+
+    matches = None
+    iterations = 0
+    converged = False
+    while iterations < max_iterations:
+        iterations += 1
+        src, dst, dist = match_points(xfm, source_xy, index, tolerance)
+        if not src.size or (matches is not None and np.array_equal(src, matches[0])
+                            and np.array_equal(dst, matches[1])):
+            converged = True
+            break
+        matches = src, dst
+
+        if len(src) == 1 and rotate is None:
+            # A single link only fixes the translation
+            xfm = transform.fit_points(source_xy[src], target_xy[dst], rotate=xfm.rotation(), scale=xfm.scale())
+        else:
+            xfm = transform.fit_points(source_xy[src], target_xy[dst], rotate=rotate, scale=scale)
+
+    links = [(source_names[i], target_names[j], d) for i, j, d in zip(src.tolist(), dst.tolist(), dist.tolist())]
+    return links, xfm, iterations, converged
+
+
+def write_links(links_file, links, source_fc=None, target_fc=None):
+    # Replace the root link table in a Transform.xml parameter file and select it
+    if os.path.isfile(links_file):
+        root = etree.parse(links_file).getroot()
+    else:
+        root = etree.Element('transform')
+
+    for tag, value in (('source', source_fc), ('target', target_fc)):
+        if value and root.find(tag) is None:
+            etree.SubElement(root, tag).text = value
+
+    for link in root.findall('link'):
+        root.remove(link)
+
+    # Calculate Transform opens on the set named in linkset, the root links hold the new table.
+    # Named link sets are kept for later use.
+    for linkset in root.findall('linkset'):
+        root.remove(linkset)
+
+    for source, target, _ in links:
+        link = etree.SubElement(root, 'link')
+        etree.SubElement(link, 'name').text = source
+        etree.SubElement(link, 'source').text = source
+        etree.SubElement(link, 'target').text = target
+        etree.SubElement(link, 'weight').text = '1.0'
+
+    for elem in root.iter():
+        elem.tail = None
+        if len(elem):
+            elem.text = None
+    etree.indent(root, space='    ')
+
+    with open(links_file, 'wb') as f:
+        etree.ElementTree(root).write(f, encoding='utf-8', xml_declaration=True)
+
+
+def discover_links_tool(source_fc, target_fc, param_file, seed_source, seed_target, rotate, tolerance, links_file):
+
+    source_names, source_xy = read_points(source_fc)
+    target_names, target_xy = read_points(target_fc)
+
+    if rotate:
+        try:
+            rotate = utils.parse_rotation(rotate)
+        except ValueError:
+            arcpy.AddError('Bad rotation value: %s' % rotate)
+            raise arcpy.ExecuteError
+    else:
+        rotate = None
+
+    tolerance = float(tolerance)
+
+    # Initial transform from a parameter file or a single seed link
+    if param_file:
+        xfm = transform.Transform()
+        xfm.load(param_file)
+    elif seed_source and seed_target:
+        seed_source, seed_target = canonical_name(seed_source), canonical_name(seed_target)
+        if seed_source not in source_names:
+            arcpy.AddError('Seed source point not found: %s' % seed_source)
+            raise arcpy.ExecuteError
+        if seed_target not in target_names:
+            arcpy.AddError('Seed target point not found: %s' % seed_target)
+            raise arcpy.ExecuteError
+        seed = [(seed_source, source_xy[source_names.index(seed_source)], target_xy[target_names.index(seed_target)])]
+        xfm = transform.calculate_transform(seed, rotate=rotate or 0.0, scale=1.0)
+    else:
+        arcpy.AddError('A transform parameter file or seed link is required.')
+        raise arcpy.ExecuteError
+
+    links, xfm, iterations, converged = discover_links(source_names, source_xy, target_names, target_xy,
+                                                       xfm, tolerance, rotate=rotate)
+
+    arcpy.AddMessage('Source points: %d  Target points: %d' % (len(source_names), len(target_names)))
+    arcpy.AddMessage('Iterations: %d' % iterations)
+    arcpy.AddMessage('Links found: %d' % len(links))
+    for source, target, dist in links[:MAX_LISTED_LINKS]:
+        arcpy.AddMessage('link %s -> %s: dist=%.4f' % (source, target, dist))
+    if len(links) > MAX_LISTED_LINKS:
+        arcpy.AddMessage('... %d more links' % (len(links) - MAX_LISTED_LINKS))
+    if links:
+        arcpy.AddMessage('RMS distance: %.4f' % np.sqrt(np.mean(np.square([link[2] for link in links]))))
+
+    if not converged:
+        # Matches still changing are most likely wrong, keep the existing links
+        arcpy.AddWarning('Matches did not settle in %d iterations, links not written. Check the initial '
+                         'transform or seed link and the match tolerance.' % iterations)
+    elif links:
+        write_links(links_file, links, source_fc, target_fc)
+
+    return links
+
+
+class DiscoverLinks(object):
+    def __init__(self):
+        registry.describe(self)
+        self.category = None
+        self.canRunInBackground = False
+
+    def getParameterInfo(self):
+        params = []
+
+        # Source points feature layer
+        param = arcpy.Parameter(
+            displayName='Source Points',
+            name='source_fc',
+            datatype='GPFeatureLayer',
+            parameterType='Required',
+            direction='Input'
+        )
+        param.filter.list = ['POINT']
+        params.append(param)
+
+        # Target points feature layer
+        param = arcpy.Parameter(
+            displayName='Target Points',
+            name='target_fc',
+            datatype='GPFeatureLayer',
+            parameterType='Required',
+            direction='Input'
+        )
+        param.filter.list = ['POINT']
+        params.append(param)
+
+        # Initial transform parameters (optional)
+        param = arcpy.Parameter(
+            displayName='Initial Transform Parameters (Optional)',
+            name='param_file',
+            datatype='DEFile',
+            parameterType='Optional',
+            direction='Input'
+        )
+        param.filter.list = ['txt']
+        params.append(param)
+
+        # Seed link source point (optional)
+        param = arcpy.Parameter(
+            displayName='Seed Source Point (Optional)',
+            name='seed_source',
+            datatype='GPString',
+            parameterType='Optional',
+            direction='Input'
+        )
+        params.append(param)
+
+        # Seed link target point (optional)
+        param = arcpy.Parameter(
+            displayName='Seed Target Point (Optional)',
+            name='seed_target',
+            datatype='GPString',
+            parameterType='Optional',
+            direction='Input'
+        )
+        params.append(param)
+
+        # Optional rotation
+        param = arcpy.Parameter(
+            displayName='Rotation',
+            name='rotate',
+            datatype='GPString',
+            parameterType='Optional',
+            direction='Input'
+        )
+        params.append(param)
+
+        # Match tolerance
+        param = arcpy.Parameter(
+            displayName='Match Tolerance',
+            name='tolerance',
+            datatype='GPDouble',
+            parameterType='Required',
+            direction='Input'
+        )
+        param.value = 10.0
+        params.append(param)
+
+        # Output links file
+        param = arcpy.Parameter(
+            displayName='Links File',
+            name='links_file',
+            datatype='DEFile',
+            parameterType='Required',
+            direction='Output'
+        )
+        param.filter.list = ['xml']
+        if defaults_path():
+            param.value = defaults_path()
+        params.append(param)
+
+        return params
+
+    def execute(self, params, messages):
+        source_fc = params[0].valueAsText
+        target_fc = params[1].valueAsText
+        param_file = params[2].valueAsText
+        seed_source = params[3].valueAsText
+        seed_target = params[4].valueAsText
+        rotate = params[5].valueAsText
+        tolerance = params[6].valueAsText
+        links_file = params[7].valueAsText
+
+        discover_links_tool(source_fc, target_fc, param_file, seed_source, seed_target, rotate, tolerance, links_file)
+
+        return
+
+
+if __name__ == '__main__':
+
+    source_fc = arcpy.GetParameterAsText(0)
+    target_fc = arcpy.GetParameterAsText(1)
+    param_file = arcpy.GetParameterAsText(2)
+    seed_source = arcpy.GetParameterAsText(3)
+    seed_target = arcpy.GetParameterAsText(4)
+    rotate = arcpy.GetParameterAsText(5)
+    tolerance = arcpy.GetParameterAsText(6)
+    links_file = arcpy.GetParameterAsText(7)
+
+    discover_links_tool(source_fc, target_fc, param_file, seed_source, seed_target, rotate, tolerance, links_file)
@@ -0,0 +1,936 @@
+import re
+import sys
+
+import numpy as np
+import numpy.linalg as npla
+
+#
+# Memory - an in-memory implementation of the arcpy subset used by the tools
+#
+# Feature classes are held in column-oriented NumPy arrays keyed on their path,
+# so the tools run end to end without ArcGIS for headless runs, regression
+# checks and benchmarks. Projection between spatial references is pluggable,
+# see register_projection.
+#
+
+FIELD_DTYPES = {
+    'OID': np.int64,
+    'DOUBLE': np.float64,
+    'FLOAT': np.float64,
+    'LONG': np.int64,
+    'SHORT': np.int64,
+    'TEXT': object,
+    'DATE': object,
+}
+
+# Field types as reported by ListFields
+FIELD_TYPE_NAMES = {
+    'OID': 'OID', 'DOUBLE': 'Double', 'FLOAT': 'Single', 'LONG': 'Integer',
+    'SHORT': 'SmallInteger', 'TEXT': 'String', 'DATE': 'Date', 'GEOMETRY': 'Geometry',
+}
+
+ORDER_BY = re.compile(r'^\s*ORDER\s+BY\s+(\w+)(\s+DESC)?\s*$', re.IGNORECASE)
+
+# Where clauses of the form FIELD IN (values), FIELD = value or FIELD LIKE 'prefix%'
+WHERE_IN = re.compile(r'^\s*["\[]?(\w+)["\]]?\s+IN\s*\((.*)\)\s*$', re.IGNORECASE | re.DOTALL)
+WHERE_EQ = re.compile(r'^\s*["\[]?(\w+)["\]]?\s*=\s*(.+?)\s*$', re.DOTALL)
+WHERE_LIKE = re.compile(r"^\s*[\"\[]?(\w+)[\"\]]?\s+LIKE\s+'((?:[^'%_]|'')*)%'\s*$", re.IGNORECASE)
+WHERE_VALUE = re.compile(r"\s*('(?:[^']|'')*'|[-+0-9.eE]+)\s*(?:,|$)")
+
+
+class ExecuteError(Exception):
+    pass
+
+
+#
+# Geoprocessing environment and messages
+#
+
+class _Environment(object):
+
+    def __init__(self):
+        self.workspace = None
+        self.scratchWorkspace = 'memory'
+        self.outputCoordinateSystem = None
+        self.geographicTransformations = None
+        self.addOutputsToMap = False
+        self.overwriteOutput = True
+
+
+env = _Environment()
+
+messages = []
+
+
+def AddMessage(message):
+    messages.append(('message', message))
+    print(message)
+
+
+def AddWarning(message):
+    messages.append(('warning', message))
+    print('WARNING: %s' % message)
+
+
+def AddError(message):
+    messages.append(('error', message))
+    print('ERROR: %s' % message, file=sys.stderr)
+
+
+def GetParameterAsText(index):
+    return sys.argv[index + 1] if index + 1 < len(sys.argv) else ''
+
+
+def GetParameter(index):
+    return GetParameterAsText(index)
+
+
+def SetParameterAsText(index, text):
+    pass
+
+
+class _Filter(object):
+
+    def __init__(self):
+        self.type = None
+        self.list = []
+
+
+class _Schema(object):
+
+    def __init__(self):
+        self.clone = False
+
+
+class Parameter(object):
+
+    def __init__(self, name=None, displayName=None, direction=None, datatype=None,
+                 parameterType=None, enabled=True, category=None, symbology=None, multiValue=False):
+        self.name = name
+        self.displayName = displayName
+        self.direction = direction
+        self.datatype = datatype
+        self.parameterType = parameterType
+        self.enabled = enabled
+        self.category = category
+        self.multiValue = multiValue
+        self.value = None
+        self.columns = []
+        self.parameterDependencies = []
+        self.filter = _Filter()
+        self.schema = _Schema()
+
+    @property
+    def valueAsText(self):
+        if self.value is None:
+            return None
+        if self.multiValue and isinstance(self.value, (list, tuple)):
+            return ';'.join(str(v) for v in self.value)
+        return str(self.value)
+
+    @property
+    def values(self):
+        return self.value
+
+
+#
+# Spatial references and projection
+#
+
+class SpatialReference(object):
+    """ Spatial reference identified by a factory code.
+
+        Additional properties (name, metersPerUnit, projectionName, ...) can be
+        passed as keyword arguments. Geographic codes 4000-4999 default to degrees.
+
+    """
+
+    def __init__(self, item=None, **properties):
+        if isinstance(item, str):
+            item = int(item) if item.strip().isdigit() else item
+        if isinstance(item, int):
+            self.factoryCode = item
+            self.name = 'EPSG:%d' % item
+        else:
+            self.factoryCode = 0
+            self.name = item or 'Unknown'
+
+        geographic = 4000 <= self.factoryCode < 5000
+        self.type = 'Geographic' if geographic else 'Projected'
+        self.metersPerUnit = 1.0
+        self.GCS = None
+        if geographic:
+            # WGS 1984 ellipsoid
+            self.semiMajorAxis = 6378137.0
+            self.flattening = 1 / 298.257223563
+        self.__dict__.update(properties)
+        if self.GCS is None:
+            self.GCS = self if geographic else SpatialReference(4326)
+
+    def __eq__(self, other):
+        if not isinstance(other, SpatialReference):
+            return False
+        if self.factoryCode or other.factoryCode:
+            return self.factoryCode == other.factoryCode
+        return self.name == other.name
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.factoryCode or self.name)
+
+    def exportToString(self):
+        return self.name
+
+
+# Registered projections keyed on (source, target) factory code or name
+_projections = {}
+
+
+def _sr_key(sr):
+    return sr.factoryCode or sr.name
+
+
+def register_projection(source_sr, target_sr, forward, inverse=None):
+    # Register vectorized projection functions f(x, y) -> (x, y) between two spatial references
+    _projections[(_sr_key(source_sr), _sr_key(target_sr))] = forward
+    if inverse is not None:
+        _projections[(_sr_key(target_sr), _sr_key(source_sr))] = inverse
+
+
+def project(x, y, source_sr, target_sr):
+    # Project coordinate arrays between spatial references
+    if source_sr is None or target_sr is None or source_sr == target_sr:
+        return x, y
+    key = (_sr_key(source_sr), _sr_key(target_sr))
+    if key not in _projections:
+        raise ExecuteError('No projection registered from %s to %s' % (source_sr.name, target_sr.name))
+    x, y = _projections[key](np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+    return x, y
+
+
+#
+# Geometry
+#
+
+class Point(object):
+
+    def __init__(self, X=None, Y=None, Z=None, M=None, ID=None):
+        self.X = float(X) if X is not None else None
+        self.Y = float(Y) if Y is not None else None
+        self.Z = float(Z) if Z is not None else None
+        self.M = M
+        self.ID = ID
+
+    def __repr__(self):
+        return '%s %s %s %s' % (self.X, self.Y, self.Z if self.Z is not None else 'NaN', 'NaN')
+
+
+class Array(list):
+
+    def __init__(self, items=None):
+        list.__init__(self, items or [])
+
+    @property
+    def count(self):
+        return len(self)
+
+    def add(self, item):
+        self.append(item)
+
+
+class Extent(object):
+
+    def __init__(self, XMin=None, YMin=None, XMax=None, YMax=None):
+        self.XMin, self.YMin, self.XMax, self.YMax = XMin, YMin, XMax, YMax
+
+    @property
+    def width(self):
+        return self.XMax - self.XMin
+
+    @property
+    def height(self):
+        return self.YMax - self.YMin
+
+
+class Geometry(object):
+    """ Geometry held as a list of (n, 2) coordinate arrays, one per part. """
+
+    type = None
+
+    def __init__(self, parts, sr=None):
+        self.parts = parts
+        self.spatialReference = sr
+
+    @property
+    def firstPoint(self):
+        x, y = self.parts[0][0]
+        return Point(x, y)
+
+    @property
+    def lastPoint(self):
+        x, y = self.parts[-1][-1]
+        return Point(x, y)
+
+    @property
+    def centroid(self):
+        xy = np.concatenate(self.parts).mean(axis=0)
+        return Point(*xy)
+
+    @property
+    def partCount(self):
+        return len(self.parts)
+
+    @property
+    def pointCount(self):
+        return sum(len(p) for p in self.parts)
+
+    @property
+    def extent(self):
+        xy = np.concatenate(self.parts)
+        (xmin, ymin), (xmax, ymax) = xy.min(axis=0), xy.max(axis=0)
+        return Extent(xmin, ymin, xmax, ymax)
+
+    def getPart(self, index=None):
+        if index is None:
+            return Array([self.getPart(i) for i in range(len(self.parts))])
+        return Array([Point(x, y) for x, y in self.parts[index]])
+
+    def projectAs(self, spatial_reference, transformation_name=None):
+        parts = []
+        for xy in self.parts:
+            x, y = project(xy[:, 0], xy[:, 1], self.spatialReference, spatial_reference)
+            parts.append(np.column_stack((x, y)))
+        return self.__class__._from_parts(parts, spatial_reference)
+
+    @classmethod
+    def _from_parts(cls, parts, sr):
+        geom = cls.__new__(cls)
+        Geometry.__init__(geom, parts, sr)
+        return geom
+
+
+def _points_array(points):
+    return np.array([(p.X, p.Y) for p in points], dtype=np.float64).reshape(-1, 2)
+
+
+class PointGeometry(Geometry):
+
+    type = 'point'
+
+    def __init__(self, point, sr=None):
+        Geometry.__init__(self, [np.array([[point.X, point.Y]], dtype=np.float64)], sr)
+
+
+class Multipoint(Geometry):
+
+    type = 'multipoint'
+
+    def __init__(self, array, sr=None, has_z=False, has_m=False):
+        Geometry.__init__(self, [_points_array(array)], sr)
+
+    def getPart(self, index=None):
+        # The points, or the point at index
+        if index is None:
+            return Array([Point(x, y) for x, y in self.parts[0]])
+        return Point(*self.parts[0][index])
+
+
+class Polyline(Geometry):
+
+    type = 'polyline'
+
+    def __init__(self, array, sr=None, has_z=False, has_m=False):
+        if array and isinstance(array[0], (Array, list)):
+            parts = [_points_array(a) for a in array]
+        else:
+            parts = [_points_array(array)]
+        Geometry.__init__(self, parts, sr)
+
+    @property
+    def length(self):
+        return float(sum(np.hypot(*np.diff(xy, axis=0).T).sum() for xy in self.parts))
+
+
+#
+# Feature classes
+#
+
+class Field(object):
+
+    def __init__(self, name, field_type, length=None):
+        self.name = name
+        self.baseName = name
+        self.type = FIELD_TYPE_NAMES.get(field_type, field_type)
+        self.field_type = field_type
+        self.length = length
+
+
+class _Column(object):
+    # A growable column with a null mask for numeric types
+
+    def __init__(self, field_type):
+        self.dtype = FIELD_DTYPES[field_type]
+        self.values = np.empty(0, dtype=self.dtype)
+        self.null = np.zeros(0, dtype=bool)
+
+    def extend(self, values):
+        null = np.fromiter((v is None for v in values), dtype=bool, count=len(values))
+        if self.dtype is object:
+            data = np.empty(len(values), dtype=object)
+            data[:] = values
+        else:
+            cast = float if self.dtype is np.float64 else int
+            data = np.array([0 if v is None else cast(v) for v in values], dtype=self.dtype)
+        self.values = np.concatenate((self.values, data))
+        self.null = np.concatenate((self.null, null))
+
+    def set(self, i, value):
+        self.null[i] = value is None
+        if self.dtype is object:
+            self.values[i] = value
+        else:
+            cast = float if self.dtype is np.float64 else int
+            self.values[i] = 0 if value is None else cast(value)
+
+    def take(self, index):
+        values = self.values[index].tolist()
+        null = self.null[index]
+        if null.any():
+            for i in np.flatnonzero(null):
+                values[i] = None
+        return values
+
+    def copy(self):
+        column = _Column.__new__(_Column)
+        column.dtype, column.values, column.null = self.dtype, self.values.copy(), self.null.copy()
+        return column
+
+
+class FeatureClass(object):
+    """ Column-oriented feature class.
+
+        Point shapes are held in the x and y arrays. Polyline vertices are held in the
+        x and y arrays with part_offsets giving the first vertex of each part and
+        feature_offsets giving the first part of each feature.
+
+    """
+
+    def __init__(self, path, shape_type, sr=None, has_z=False):
+        self.path = path
+        self.shape_type = shape_type
+        self.spatial_reference = sr
+        self.has_z = has_z
+        self.fields = [Field('OBJECTID', 'OID'), Field('SHAPE', 'GEOMETRY')]
+        self.columns = {'OBJECTID': _Column('OID')}
+        self.indexes = []
+        self.x = np.empty(0, dtype=np.float64)
+        self.y = np.empty(0, dtype=np.float64)
+        self.z = np.empty(0, dtype=np.float64)
+        self.part_offsets = np.zeros(1, dtype=np.int64)
+        self.feature_offsets = np.zeros(1, dtype=np.int64)
+        self.next_oid = 1
+
+    def __len__(self):
+        return len(self.columns['OBJECTID'].values)
+
+    def add_field(self, name, field_type, length=None):
+        field_type = field_type.upper()
+        if self.field(name) is None:
+            self.fields.append(Field(name, field_type, length))
+            column = _Column(field_type)
+            column.extend([None] * len(self))
+            self.columns[name.upper()] = column
+
+    def field(self, name):
+        for field in self.fields:
+            if field.name.upper() == name.upper():
+                return field
+        return None
+
+    def copy(self, path):
+        fc = FeatureClass(path, self.shape_type, self.spatial_reference, self.has_z)
+        fc.fields = list(self.fields)
+        fc.columns = dict((k, c.copy()) for k, c in self.columns.items())
+        fc.indexes = list(self.indexes)
+        fc.x, fc.y, fc.z = self.x.copy(), self.y.copy(), self.z.copy()
+        fc.part_offsets = self.part_offsets.copy()
+        fc.feature_offsets = self.feature_offsets.copy()
+        fc.next_oid = self.next_oid
+        return fc
+
+    def append(self, shapes, attributes):
+        # Append a batch of features, shapes are lists of (n, 2) part arrays
+        n = len(shapes)
+        oids = list(range(self.next_oid, self.next_oid + n))
+        self.next_oid += n
+        self.columns['OBJECTID'].extend(oids)
+
+        for name, column in self.columns.items():
+            if name != 'OBJECTID':
+                column.extend(attributes.get(name, [None] * n))
+
+        if self.shape_type == 'Point':
+            xy = np.array([s[0][0] if s else (np.nan, np.nan) for s in shapes], dtype=np.float64).reshape(-1, 2)
+            self.x = np.concatenate((self.x, xy[:, 0]))
+            self.y = np.concatenate((self.y, xy[:, 1]))
+        else:
+            parts = [p for s in shapes for p in s]
+            counts = np.array([len(p) for p in parts], dtype=np.int64)
+            xy = np.concatenate(parts) if parts else np.empty((0, 2))
+            self.x = np.concatenate((self.x, xy[:, 0]))
+            self.y = np.concatenate((self.y, xy[:, 1]))
+            self.part_offsets = np.concatenate((self.part_offsets, self.part_offsets[-1] + np.cumsum(counts)))
+            part_counts = np.array([len(s) for s in shapes], dtype=np.int64)
+            self.feature_offsets = np.concatenate(
+                (self.feature_offsets, self.feature_offsets[-1] + np.cumsum(part_counts)))
+
+        return oids
+
+    def set_shape(self, i, parts):
+        # Replace the shape of feature i
+        if self.shape_type == 'Point':
+            self.x[i], self.y[i] = parts[0][0] if parts else (np.nan, np.nan)
+        else:
+            shapes = [self.shape_parts(j) for j in range(len(self))]
+            shapes[i] = parts
+            self._set_shapes(shapes)
+
+    def delete(self, index):
+        # Delete the features at the row index
+        keep = np.ones(len(self), dtype=bool)
+        keep[index] = False
+        shapes = None if self.shape_type == 'Point' else [self.shape_parts(j) for j in np.flatnonzero(keep)]
+        for column in self.columns.values():
+            column.values, column.null = column.values[keep], column.null[keep]
+        if shapes is None:
+            self.x, self.y = self.x[keep], self.y[keep]
+        else:
+            self._set_shapes(shapes)
+
+    def _set_shapes(self, shapes):
+        # Rebuild the polyline vertex arrays and offsets
+        parts = [p for s in shapes for p in s]
+        counts = np.array([len(p) for p in parts], dtype=np.int64)
+        xy = np.concatenate(parts) if parts else np.empty((0, 2))
+        self.x, self.y = xy[:, 0].copy(), xy[:, 1].copy()
+        self.part_offsets = np.concatenate(([0], np.cumsum(counts)))
+        self.feature_offsets = np.concatenate(([0], np.cumsum([len(s) for s in shapes]))).astype(np.int64)
+
+    def shape_parts(self, i):
+        # Part coordinate arrays for feature i
+        if self.shape_type == 'Point':
+            return [np.array([[self.x[i], self.y[i]]])]
+        parts = []
+        for p in range(self.feature_offsets[i], self.feature_offsets[i + 1]):
+            start, end = self.part_offsets[p], self.part_offsets[p + 1]
+            parts.append(np.column_stack((self.x[start:end], self.y[start:end])))
+        return parts
+
+    def extent(self):
+        if len(self.x) == 0:
+            return Extent()
+        return Extent(np.nanmin(self.x), np.nanmin(self.y), np.nanmax(self.x), np.nanmax(self.y))
+
+
+_feature_classes = {}
+
+
+def _key(path):
+    return str(path).replace('\\', '/').rstrip('/').lower()
+
+
+def _get(path):
+    fc = _feature_classes.get(_key(path))
+    if fc is None:
+        raise ExecuteError('Dataset %s does not exist or is not supported' % path)
+    return fc
+
+
+def feature_class(path):
+    # The FeatureClass object for a path
+    return _get(path)
+
+
+def clear():
+    # Delete all in-memory feature classes
+    _feature_classes.clear()
+    del messages[:]
+
+
+def Exists(path):
+    return _key(path) in _feature_classes
+
+
+class _Describe(object):
+
+    def __init__(self, fc):
+        self.catalogPath = fc.path
+        self.name = fc.path.replace('\\', '/').rsplit('/', 1)[-1]
+        self.baseName = self.name
+        self.dataType = 'FeatureClass'
+        self.shapeType = fc.shape_type
+        self.shapeFieldName = 'SHAPE'
+        self.OIDFieldName = 'OBJECTID'
+        self.hasZ = fc.has_z
+        self.hasM = False
+        self.spatialReference = fc.spatial_reference
+        self.extent = fc.extent()
+        self.fields = list(fc.fields)
+
+
+def Describe(path):
+    return _Describe(_get(path))
+
+
+def ListFields(path, wild_card=None, field_type=None):
+    return list(_get(path).fields)
+
+
+class Index(object):
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.isAscending = True
+        self.isUnique = False
+
+
+def ListIndexes(path, wild_card=None):
+    return list(_get(path).indexes)
+
+
+def AddFieldDelimiters(datasource, field):
+    return field
+
+
+#
+# Cursors
+#
+
+def _shape_values(fc, token, index, sr):
+    # Shape values for a cursor token at the selected rows
+    if fc.shape_type == 'Point':
+        x, y = project(fc.x[index], fc.y[index], fc.spatial_reference, sr)
+        if token in ('SHAPE@XY', 'SHAPE'):
+            return list(zip(x.tolist(), y.tolist()))
+        if token == 'SHAPE@X':
+            return x.tolist()
+        if token == 'SHAPE@Y':
+            return y.tolist()
+        if token == 'SHAPE@Z':
+            return [None] * len(index)
+        if token == 'SHAPE@':
+            return [PointGeometry(Point(*xy), sr or fc.spatial_reference) for xy in zip(x, y)]
+    else:
+        geoms = [Polyline._from_parts(fc.shape_parts(i), fc.spatial_reference) for i in index]
+        if sr is not None and sr != fc.spatial_reference:
+            geoms = [g.projectAs(sr) for g in geoms]
+        if token == 'SHAPE@':
+            return geoms
+        if token == 'SHAPE@LENGTH':
+            return [g.length for g in geoms]
+        if token in ('SHAPE@XY', 'SHAPE'):
+            return [(c.X, c.Y) for c in (g.centroid for g in geoms)]
+    raise ExecuteError('Unsupported shape token: %s' % token)
+
+
+def _expand_fields(fc, field_names):
+    if isinstance(field_names, str):
+        field_names = [field_names] if field_names != '*' else [f.name for f in fc.fields]
+    return [f.upper() for f in field_names]
+
+
+def _where_values(text):
+    values = []
+    pos = 0
+    while pos < len(text):
+        m = WHERE_VALUE.match(text, pos)
+        if m is None:
+            raise ExecuteError('Unsupported where clause values: %s' % text)
+        value = m.group(1)
+        values.append(value[1:-1].replace("''", "'") if value.startswith("'") else float(value))
+        pos = m.end()
+    return values
+
+
+def _where_index(fc, where_clause):
+    # Row index selected by a simple where clause
+    m = WHERE_LIKE.match(where_clause) or WHERE_IN.match(where_clause) or WHERE_EQ.match(where_clause)
+    if m is None:
+        raise ExecuteError('Unsupported where clause: %s' % where_clause)
+    field, values = m.group(1).upper(), m.group(2)
+    if field not in fc.columns:
+        raise ExecuteError('Cannot find field %s' % field)
+    if m.re is WHERE_LIKE:
+        column = fc.columns[field]
+        prefix = values.replace("''", "'")
+        return np.flatnonzero([not null and str(value).startswith(prefix)
+                               for value, null in zip(column.values, column.null)])
+    values = _where_values(values) if m.re is WHERE_IN else _where_values(values + ',')[0:1]
+    column = fc.columns[field]
+    mask = np.isin(column.values, np.array(values, dtype=column.dtype)) & ~column.null
+    return np.flatnonzero(mask)
+
+
+class SearchCursor(object):
+
+    def __init__(self, in_table, field_names, where_clause=None, spatial_reference=None,
+                 explode_to_points=False, sql_clause=(None, None)):
+        self._fc = fc = _get(in_table)
+        self.fields = tuple(_expand_fields(fc, field_names))
+
+        index = np.arange(len(fc))
+        if where_clause:
+            index = _where_index(fc, where_clause)
+
+        if sql_clause and sql_clause[1]:
+            m = ORDER_BY.match(sql_clause[1])
+            if m is None:
+                raise ExecuteError('Unsupported sql clause: %s' % sql_clause[1])
+            column = fc.columns[m.group(1).upper()]
+            keys = ['' if v is None else v for v in column.take(index)]
+            order = sorted(range(len(keys)), key=keys.__getitem__, reverse=bool(m.group(2)))
+            index = index[order]
+
+        self._index = index
+        self._pos = -1
+
+        values = []
+        for field in self.fields:
+            if field.startswith('SHAPE'):
+                values.append(_shape_values(fc, field, index, spatial_reference))
+            elif field == 'OID@':
+                values.append(fc.columns['OBJECTID'].take(index))
+            else:
+                values.append(fc.columns[field].take(index))
+        self._rows = iter(zip(*values)) if values else iter(())
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = next(self._rows)
+        self._pos += 1
+        return row
+
+    def next(self):
+        return self.__next__()
+
+    def reset(self):
+        raise ExecuteError('reset is not supported')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._rows = iter(())
+
+
+def _shape_parts(fc, token, value, sr):
+    # Convert an inserted shape value to a list of part coordinate arrays
+    if value is None:
+        return []
+    if isinstance(value, Geometry):
+        if sr is not None and value.spatialReference is not None and value.spatialReference != sr:
+            value = value.projectAs(sr)
+        return value.parts
+    if isinstance(value, Point):
+        return [np.array([[value.X, value.Y]])]
+    if token in ('SHAPE@XY', 'SHAPE@'):
+        return [np.array([value[0:2]], dtype=np.float64)]
+    raise ExecuteError('Unsupported shape value for %s: %r' % (token, value))
+
+
+class InsertCursor(object):
+    """ Insert cursor, rows are buffered and appended to the columns in a single batch. """
+
+    def __init__(self, in_table, field_names):
+        self._fc = fc = _get(in_table)
+        self.fields = tuple(_expand_fields(fc, field_names))
+        for field in self.fields:
+            if not field.startswith('SHAPE') and field not in fc.columns:
+                raise ExecuteError('Cannot find field %s' % field)
+        self._rows = []
+
+    def insertRow(self, row):
+        if len(row) != len(self.fields):
+            raise ExecuteError('Sequence size must match size of the row')
+        self._rows.append(row)
+        return self._fc.next_oid + len(self._rows) - 1
+
+    def _flush(self):
+        if not self._rows:
+            return
+        fc = self._fc
+        rows, self._rows = self._rows, []
+        columns = list(zip(*rows))
+        shapes = [[] for _ in rows]
+        attributes = {}
+        for field, values in zip(self.fields, columns):
+            if field.startswith('SHAPE'):
+                shapes = [_shape_parts(fc, field, v, fc.spatial_reference) for v in values]
+            else:
+                attributes[field] = list(values)
+        fc.append(shapes, attributes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._flush()
+
+    def __del__(self):
+        self._flush()
+
+
+class UpdateCursor(SearchCursor):
+    """ Update cursor, updated and deleted rows are applied when the cursor is closed. """
+
+    def __init__(self, in_table, field_names, where_clause=None, spatial_reference=None,
+                 explode_to_points=False, sql_clause=(None, None)):
+        SearchCursor.__init__(self, in_table, field_names, where_clause, spatial_reference,
+                              explode_to_points, sql_clause)
+        self._updates = {}
+        self._deletes = []
+
+    def updateRow(self, row):
+        if len(row) != len(self.fields):
+            raise ExecuteError('Sequence size must match size of the row')
+        self._updates[int(self._index[self._pos])] = row
+
+    def deleteRow(self):
+        self._deletes.append(int(self._index[self._pos]))
+
+    def _flush(self):
+        fc = self._fc
+        updates, self._updates = self._updates, {}
+        deletes, self._deletes = self._deletes, []
+        for i, row in updates.items():
+            for field, value in zip(self.fields, row):
+                if field.startswith('SHAPE'):
+                    fc.set_shape(i, _shape_parts(fc, field, value, fc.spatial_reference))
+                elif field not in ('OID@', 'OBJECTID'):
+                    fc.columns[field].set(i, value)
+        if deletes:
+            fc.delete(deletes)
+
+    def __exit__(self, *args):
+        SearchCursor.__exit__(self, *args)
+        self._flush()
+
+    def __del__(self):
+        self._flush()
+
+
+class _DataAccess(object):
+    SearchCursor = SearchCursor
+    InsertCursor = InsertCursor
+    UpdateCursor = UpdateCursor
+
+
+da = _DataAccess()
+
+
+#
+# Data management
+#
+
+def _spatial_reference(sr):
+    if sr is None or isinstance(sr, SpatialReference):
+        return sr
+    return SpatialReference(sr)
+
+
+def CreateFeatureclass(out_path, out_name, geometry_type='POLYGON', template=None, has_m='DISABLED',
+                       has_z='DISABLED', spatial_reference=None, *args, **kwargs):
+    path = out_path.rstrip('\\/') + '\\' + out_name
+    shape_type = geometry_type.capitalize()
+    if shape_type not in ('Point', 'Polyline'):
+        raise ExecuteError('Unsupported geometry type: %s' % geometry_type)
+    fc = FeatureClass(path, shape_type, _spatial_reference(spatial_reference), has_z == 'ENABLED')
+    _feature_classes[_key(path)] = fc
+    return path
+
+
+def AddField(in_table, field_name, field_type, field_precision=None, field_scale=None,
+             field_length=None, *args, **kwargs):
+    _get(in_table).add_field(field_name, field_type, field_length)
+    return in_table
+
+
+def Copy(in_data, out_data, *args, **kwargs):
+    _feature_classes[_key(out_data)] = _get(in_data).copy(out_data)
+    return out_data
+
+
+def CopyFeatures(in_features, out_feature_class, *args, **kwargs):
+    return Copy(in_features, out_feature_class)
+
+
+def Delete(in_data, *args, **kwargs):
+    _feature_classes.pop(_key(in_data), None)
+    return in_data
+
+
+def RecalculateFeatureClassExtent(in_features, *args, **kwargs):
+    return in_features
+
+
+def AddIndex(in_table, fields, index_name=None, *args, **kwargs):
+    fc = _get(in_table)
+    fields = [fields] if isinstance(fields, str) else list(fields)
+    fc.indexes.append(Index(index_name or '_'.join(fields), [fc.field(f) for f in fields]))
+    return in_table
+
+
+class _Management(object):
+    CreateFeatureclass = staticmethod(CreateFeatureclass)
+    AddField = staticmethod(AddField)
+    Copy = staticmethod(Copy)
+    CopyFeatures = staticmethod(CopyFeatures)
+    Delete = staticmethod(Delete)
+    RecalculateFeatureClassExtent = staticmethod(RecalculateFeatureClassExtent)
+    AddIndex = staticmethod(AddIndex)
+
+
+management = _Management()
+
+
+#
+# Editing
+#
+
+def TransformFeatures(in_features, in_link_features, method='AFFINE', out_link_table=None):
+    # Similarity transform of all feature coordinates from displacement links
+    if method != 'SIMILARITY':
+        raise ExecuteError('Unsupported transform method: %s' % method)
+
+    src = np.array([link.parts[0][0] for link in in_link_features], dtype=np.float64)
+    dst = np.array([link.parts[0][-1] for link in in_link_features], dtype=np.float64)
+
+    # x1 = a0 + a1*x0 - b1*y0, y1 = b0 + b1*x0 + a1*y0
+    # fitted about the link centroids, large projected coordinates otherwise
+    # leave the least squares system badly conditioned
+    c0, c1 = src.mean(axis=0), dst.mean(axis=0)
+    src, dst = src - c0, dst - c1
+    n = len(src)
+    A = np.zeros((2 * n, 4))
+    A[0::2, 0] = 1
+    A[1::2, 1] = 1
+    A[0::2, 2], A[0::2, 3] = src[:, 0], -src[:, 1]
+    A[1::2, 2], A[1::2, 3] = src[:, 1], src[:, 0]
+    a0, b0, a1, b1 = npla.lstsq(A, dst.reshape(2 * n), rcond=None)[0]
+
+    fc = _get(in_features)
+    x, y = fc.x - c0[0], fc.y - c0[1]
+    fc.x, fc.y = c1[0] + a0 + a1 * x - b1 * y, c1[1] + b0 + b1 * x + a1 * y
+    return in_features
+
+
+class _Editing(object):
+    TransformFeatures = staticmethod(TransformFeatures)
+
+
+edit = _Editing()
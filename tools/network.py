@@ -0,0 +1,575 @@
+from tools.backend import arcpy
+from datetime import datetime
+from dateutil import tz
+import math
+import numpy as np
+
+from tools.cogo import parse_bearings
+from tools.feature_store import canonical_name, open_store
+from tools.points import PointSet
+import tools.registry as registry
+from tools.utils import create_points_feature_class
+
+try:
+    import scipy.sparse as sparse
+    import scipy.sparse.linalg as sparse_linalg
+except ImportError:
+    sparse = None
+
+try:
+    from sksparse.cholmod import cholesky as cholmod_cholesky
+except ImportError:
+    cholmod_cholesky = None
+
+
+#
+# AdjustNetwork - least squares adjustment of a horizontal survey network
+#
+# Observation files are plain text, one record per line, comma separated, with
+# # comments. Coordinates are northing, easting as in PNEZD files -
+#
+#   CONTROL,name,northing,easting[,sigma_n,sigma_e]       fixed, or weighted with standard deviations
+#   POINT,name,northing,easting                           approximate coordinates
+#   VECTOR,from,to,dn,de,sigma_n,sigma_e[,correlation]    GPS baseline components
+#   DIST,from,to,distance,sigma                           horizontal distance
+#   BEARING,from,to,bearing,sigma_seconds                 bearing or azimuth
+#   ANGLE,at,backsight,foresight,angle,sigma_seconds      angle right, clockwise from the backsight
+#
+# Stations without a POINT line get approximate coordinates from the control
+# through the vectors and distance/bearing pairs.
+#
+# Each Gauss-Newton pass assembles the whitened design matrix for every
+# observation type as numpy arrays, in coordinate (row, column, value) form.
+# The normal equations are solved with a sparse Cholesky factorization
+# (scikit-sparse CHOLMOD) or a symmetric sparse LU factorization (scipy),
+# falling back to dense numpy for small networks or where scipy is not
+# installed. Only the 2x2 covariance block of each station is needed. With
+# the LU factors these are taken from the selected inverse, the inverse on
+# the sparsity pattern of the factor (Takahashi et al., 1973), computed a
+# supernode at a time, so the cost stays close to the factorization itself.
+#
+
+ITERATIONS = 10
+
+# Largest coordinate correction at convergence (coordinate units)
+TOLERANCE = 1e-6
+
+# Networks up to this many unknowns are solved dense
+DENSE_UNKNOWNS = 400
+
+# Largest network solved dense when scipy is not installed
+DENSE_MAX_UNKNOWNS = 6000
+
+# Stations per covariance solve without the selected inverse
+COVARIANCE_BLOCK = 256
+
+NETWORK_SYMBOL = 'Flag, Blue'
+NETWORK_TYPE = 'NETWORK'
+
+
+class NetworkError(Exception):
+    pass
+
+
+def _wrap(angle):
+    # Angles (radians) to [-pi, pi)
+    return (angle + np.pi) % (2 * np.pi) - np.pi
+
+
+def selected_inverse(L, d):
+    """ Entries of the inverse of L D L' on the sparsity pattern of L.
+        :param L: unit lower triangular factor, scipy CSC matrix with sorted indices
+        :param d: diagonal of D
+        :return: (keys, values) - column * n + row of each lower entry, sorted, and the inverse values
+
+    """
+    n = L.shape[0]
+    indptr, indices, data = L.indptr, L.indices, L.data
+    counts = np.diff(indptr)
+    keys = np.repeat(np.arange(n, dtype=np.int64), counts) * n + indices
+
+    # Supernodes, runs of columns where each column's structure is the next column plus its structure
+    first = np.full(n, -1)
+    first[counts > 1] = indices[indptr[:-1][counts > 1] + 1]
+    joined = np.zeros(n, dtype=bool)
+    joined[1:] = (first[:-1] == np.arange(1, n)) & (counts[1:] == counts[:-1] - 1)
+    starts = np.flatnonzero(~joined)
+    ends = np.append(starts[1:], n)
+
+    Z = np.zeros(len(data))
+    for f, e in zip(starts[::-1].tolist(), ends[::-1].tolist()):
+        w = e - f
+        rows = indices[indptr[f]:indptr[f + 1]]
+        T = rows[w:]
+        block = np.zeros((len(rows), w))
+        for c in range(w):
+            block[c:, c] = data[indptr[f + c]:indptr[f + c + 1]]
+        LJJinv = np.linalg.inv(block[:w])
+        ZJJ = (LJJinv.T / d[f:e]).dot(LJJinv)
+        if len(T):
+            # Z_TJ = -Z_TT L_TJ L_JJ^-1, the rows of T are all later supernodes, already computed
+            lo, hi = np.minimum.outer(T, T), np.maximum.outer(T, T)
+            ZTT = Z[np.searchsorted(keys, lo.astype(np.int64) * n + hi)]
+            ZTJ = -ZTT.dot(block[w:]).dot(LJJinv)
+            ZJJ -= LJJinv.T.dot(block[w:].T.dot(ZTJ))
+        for c in range(w):
+            s = indptr[f + c]
+            Z[s:s + w - c] = ZJJ[c:, c]
+            if len(T):
+                Z[s + w - c:indptr[f + c + 1]] = ZTJ[:, c]
+    return keys, Z
+
+
+class _DenseFactor(object):
+    # Inverse of a small normal matrix
+
+    name = 'dense'
+
+    def __init__(self, N):
+        try:
+            self.Ninv = np.linalg.inv(N)
+        except np.linalg.LinAlgError:
+            raise NetworkError('Network is singular, check the control and that every station is connected')
+
+    def solve(self, b):
+        return self.Ninv.dot(b)
+
+    def blocks(self, columns):
+        # 2x2 blocks of the inverse for (stations, 2) unknown columns
+        return self.Ninv[columns[:, :, None], columns[:, None, :]]
+
+
+class _SparseFactor(object):
+    # CHOLMOD or SuperLU factorization of a sparse normal matrix
+
+    def __init__(self, N):
+        self.count = N.shape[0]
+        self.lu = None
+        if cholmod_cholesky is not None:
+            self.name = 'CHOLMOD'
+            self.solve = cholmod_cholesky(N)
+        else:
+            self.name = 'SuperLU'
+            try:
+                self.lu = sparse_linalg.splu(N, permc_spec='MMD_AT_PLUS_A', diag_pivot_thresh=0.0,
+                                             options=dict(SymmetricMode=True))
+            except RuntimeError:
+                raise NetworkError('Network is singular, check the control and that every station is connected')
+            self.solve = self.lu.solve
+
+    def blocks(self, columns):
+        # 2x2 blocks of the inverse for (stations, 2) unknown columns
+        lu = self.lu
+        if lu is not None and (lu.perm_r == lu.perm_c).all():
+            # Symmetric pivoting, P N P' = L U with U = D L'
+            L = lu.L.tocsc()
+            L.sort_indices()
+            keys, Z = selected_inverse(L, lu.U.diagonal())
+            n = L.shape[0]
+            p = lu.perm_c[columns].astype(np.int64)
+            lo, hi = np.minimum(p[:, :, None], p[:, None, :]), np.maximum(p[:, :, None], p[:, None, :])
+            return Z[np.searchsorted(keys, lo * n + hi)]
+
+        result = np.zeros((len(columns), 2, 2))
+        for start in range(0, len(columns), COVARIANCE_BLOCK):
+            block = columns[start:start + COVARIANCE_BLOCK]
+            rhs = np.zeros((self.count, block.size))
+            rhs[block.reshape(-1), np.arange(block.size)] = 1.0
+            inverse = np.asarray(self.solve(rhs))[block.reshape(-1)].reshape(len(block), 2, len(block), 2)
+            index = np.arange(len(block))
+            result[start:start + len(block)] = inverse[index, :, index, :]
+        return result
+
+
+class Network(object):
+    """ Stations and observations of a horizontal network.
+        Station coordinates are held as (x, y) = (easting, northing).
+
+    """
+
+    def __init__(self):
+        self.names = []
+        self.index = {}
+        self.control = []
+        self.approx = {}
+        self.vectors = []
+        self.distances = []
+        self.bearings = []
+        self.angles = []
+
+        # Results
+        self.xy = None
+        self.covariance = None
+        self.sigma0 = None
+        self.dof = None
+        self.iterations = 0
+        self.converged = False
+        self.solver = None
+        self.residuals = None
+
+    def station(self, name):
+        if name not in self.index:
+            self.index[name] = len(self.names)
+            self.names.append(name)
+        return self.index[name]
+
+    def observation_count(self):
+        return 2 * len(self.vectors) + len(self.distances) + len(self.bearings) + len(self.angles) + \
+            2 * sum(1 for c in self.control if c[2] is not None)
+
+    def _approximate(self):
+        # Approximate coordinates (n, 2) from the control, POINT lines, vectors and distance/bearing pairs
+        xy = np.full((len(self.names), 2), np.nan)
+        for s, pt in self.approx.items():
+            xy[s] = pt
+        for s, pt, _ in self.control:
+            xy[s] = pt
+
+        legs = [(f, t, np.array(d)) for f, t, d, _ in self.vectors]
+        bearing = dict(((f, t), az) for f, t, az, _ in self.bearings)
+        for f, t, d, _ in self.distances:
+            az = bearing.get((f, t))
+            if az is None and (t, f) in bearing:
+                az = bearing[(t, f)] + math.pi
+            if az is not None:
+                legs.append((f, t, d * np.array([math.sin(az), math.cos(az)])))
+
+        changed = True
+        while changed:
+            changed = False
+            for f, t, d in legs:
+                if np.isnan(xy[t, 0]) and not np.isnan(xy[f, 0]):
+                    xy[t] = xy[f] + d
+                    changed = True
+                elif np.isnan(xy[f, 0]) and not np.isnan(xy[t, 0]):
+                    xy[f] = xy[t] - d
+                    changed = True
+
+        missing = np.flatnonzero(np.isnan(xy[:, 0]))
+        if len(missing):
+            raise NetworkError('No approximate coordinates for station %s, add a POINT line' % self.names[missing[0]])
+        return xy
+
+    def _unknowns(self):
+        # Unknown index of each station coordinate (n, 2), -1 for fixed control
+        fixed = np.zeros(len(self.names), dtype=bool)
+        for s, _, sigma in self.control:
+            if sigma is None:
+                fixed[s] = True
+        unknown = np.full((len(self.names), 2), -1, dtype=np.int64)
+        free = np.flatnonzero(~fixed)
+        unknown[free] = np.arange(2 * len(free)).reshape(-1, 2)
+        return unknown
+
+    def _design(self, xy, unknown):
+        # Whitened design matrix blocks [(columns (m, k), values (m, k), misclosures (m,), labels)]
+        blocks = []
+
+        if self.vectors:
+            f, t = (np.array(v) for v in zip(*[(v[0], v[1]) for v in self.vectors]))
+            obs = np.array([v[2] for v in self.vectors])
+            cov = np.array([v[3] for v in self.vectors])
+            # Whitening with the inverse Cholesky factor of each 2x2 covariance
+            l11 = np.sqrt(cov[:, 0, 0])
+            l21 = cov[:, 1, 0] / l11
+            l22 = np.sqrt(cov[:, 1, 1] - l21 ** 2)
+            w = obs - (xy[t] - xy[f])
+            cols = np.column_stack((unknown[f, 0], unknown[t, 0], unknown[f, 1], unknown[t, 1]))
+            ones = np.ones(len(f))
+            row_x = np.column_stack((-ones, ones, 0 * ones, 0 * ones)) / l11[:, None]
+            row_y = (np.column_stack((0 * ones, 0 * ones, -ones, ones)) - l21[:, None] * row_x) / l22[:, None]
+            misc_x = w[:, 0] / l11
+            misc_y = (w[:, 1] - l21 * misc_x) / l22
+            blocks.append((cols, row_x, misc_x, [('VECTOR', v[0], v[1]) for v in self.vectors]))
+            blocks.append((cols, row_y, misc_y, [('VECTOR', v[0], v[1]) for v in self.vectors]))
+
+        if self.distances:
+            f, t, obs, sigma = (np.array(v) for v in zip(*self.distances))
+            dx, dy = (xy[t] - xy[f]).T
+            d = np.hypot(dx, dy)
+            cols = np.column_stack((unknown[f, 0], unknown[f, 1], unknown[t, 0], unknown[t, 1]))
+            vals = np.column_stack((-dx / d, -dy / d, dx / d, dy / d)) / sigma[:, None]
+            blocks.append((cols, vals, (obs - d) / sigma, [('DIST', v[0], v[1]) for v in self.distances]))
+
+        if self.bearings:
+            f, t, obs, sigma = (np.array(v) for v in zip(*self.bearings))
+            dx, dy = (xy[t] - xy[f]).T
+            d2 = dx * dx + dy * dy
+            cols = np.column_stack((unknown[f, 0], unknown[f, 1], unknown[t, 0], unknown[t, 1]))
+            vals = np.column_stack((-dy / d2, dx / d2, dy / d2, -dx / d2)) / sigma[:, None]
+            blocks.append((cols, vals, _wrap(obs - np.arctan2(dx, dy)) / sigma,
+                           [('BEARING', v[0], v[1]) for v in self.bearings]))
+
+        if self.angles:
+            a, b, f, obs, sigma = (np.array(v) for v in zip(*self.angles))
+            bx, by = (xy[b] - xy[a]).T
+            fx, fy = (xy[f] - xy[a]).T
+            b2 = bx * bx + by * by
+            f2 = fx * fx + fy * fy
+            cols = np.column_stack((unknown[a, 0], unknown[a, 1], unknown[b, 0], unknown[b, 1],
+                                    unknown[f, 0], unknown[f, 1]))
+            vals = np.column_stack((-fy / f2 + by / b2, fx / f2 - bx / b2, -by / b2, bx / b2, fy / f2, -fx / f2))
+            computed = np.arctan2(fx, fy) - np.arctan2(bx, by)
+            blocks.append((cols, vals / sigma[:, None], _wrap(obs - computed) / sigma,
+                           [('ANGLE', v[1], v[2]) for v in self.angles]))
+
+        weighted = [c for c in self.control if c[2] is not None]
+        if weighted:
+            s = np.array([c[0] for c in weighted])
+            pt = np.array([c[1] for c in weighted])
+            sigma = np.array([c[2] for c in weighted])
+            for k in range(2):
+                blocks.append((unknown[s, k][:, None], (1.0 / sigma[:, k])[:, None], (pt[:, k] - xy[s, k]) / sigma[:, k],
+                               [('CONTROL', self.names[i], '') for i in s]))
+
+        return blocks
+
+    def _normal(self, blocks, count):
+        # Normal matrix and vector, sparse when scipy is available and the network is large
+        rows, cols, vals, misclosure = [], [], [], []
+        offset = 0
+        for c, v, w, _ in blocks:
+            m, k = c.shape
+            rows.append(np.repeat(np.arange(offset, offset + m), k))
+            cols.append(c.reshape(-1))
+            vals.append(v.reshape(-1))
+            misclosure.append(w)
+            offset += m
+        rows, cols, vals = np.concatenate(rows), np.concatenate(cols), np.concatenate(vals)
+        misclosure = np.concatenate(misclosure)
+
+        # Fixed stations have no column
+        keep = cols >= 0
+        rows, cols, vals = rows[keep], cols[keep], vals[keep]
+
+        if sparse is not None and count > DENSE_UNKNOWNS:
+            A = sparse.csr_matrix((vals, (rows, cols)), shape=(offset, count))
+            return (A.T @ A).tocsc(), A.T @ misclosure, misclosure
+
+        if count > DENSE_MAX_UNKNOWNS:
+            raise NetworkError('%d unknowns, scipy is needed for networks this size' % count)
+        A = np.zeros((offset, count))
+        np.add.at(A, (rows, cols), vals)
+        return A.T.dot(A), A.T.dot(misclosure), misclosure
+
+    def adjust(self):
+        """ Adjust the network, setting xy, covariance (n, 2, 2), sigma0, dof and residuals.
+            Covariances are scaled by the a posteriori variance of unit weight.
+
+        """
+        xy = self._approximate()
+        unknown = self._unknowns()
+        count = int(unknown.max()) + 1 if unknown.size else 0
+        if count == 0:
+            raise NetworkError('Every station is fixed')
+
+        self.converged = False
+        for self.iterations in range(1, ITERATIONS + 1):
+            blocks = self._design(xy, unknown)
+            N, b, _ = self._normal(blocks, count)
+            factor = _DenseFactor(N) if isinstance(N, np.ndarray) else _SparseFactor(N)
+            dx = np.asarray(factor.solve(b)).reshape(-1)
+            if not np.isfinite(dx).all():
+                raise NetworkError('Network is singular, check the control and that every station is connected')
+            free = unknown[:, 0] >= 0
+            xy[free] += dx[unknown[free]]
+            if np.abs(dx).max() < TOLERANCE:
+                self.converged = True
+                break
+
+        # Residuals and variance factor at the adjusted coordinates
+        blocks = self._design(xy, unknown)
+        misclosure = np.concatenate([w for _, _, w, _ in blocks])
+        self.solver = factor.name
+        self.dof = len(misclosure) - count
+        self.sigma0 = math.sqrt(misclosure.dot(misclosure) / self.dof) if self.dof > 0 else 1.0
+        self.residuals = [(label, float(w)) for (_, _, ws, labels) in blocks for label, w in zip(labels, ws)]
+
+        # Station covariances from the 2x2 blocks of the inverse normal matrix of the last pass
+        self.covariance = np.zeros((len(self.names), 2, 2))
+        free = np.flatnonzero(unknown[:, 0] >= 0)
+        self.covariance[free] = factor.blocks(unknown[free])
+        self.covariance *= self.sigma0 ** 2
+        self.xy = xy
+        return self
+
+
+def read_observations(observation_file):
+    # Network from an observation file
+    network = Network()
+    vectors, distances, bearings, angles = [], [], [], []
+    with open(observation_file, errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+            fields = [v.strip() for v in line.split(',')]
+            kind = fields[0].upper()
+            try:
+                if kind in ('CONTROL', 'POINT'):
+                    s = network.station(fields[1])
+                    pt = (float(fields[3]), float(fields[2]))
+                    if kind == 'POINT':
+                        network.approx[s] = pt
+                    elif len(fields) > 5 and fields[4] and fields[5]:
+                        network.control.append((s, pt, (float(fields[5]), float(fields[4]))))
+                    else:
+                        network.control.append((s, pt, None))
+                elif kind == 'VECTOR':
+                    sn, se = float(fields[5]), float(fields[6])
+                    r = float(fields[7]) if len(fields) > 7 and fields[7] else 0.0
+                    cov = [[se * se, r * sn * se], [r * sn * se, sn * sn]]
+                    vectors.append((network.station(fields[1]), network.station(fields[2]),
+                                    (float(fields[4]), float(fields[3])), cov))
+                elif kind == 'DIST':
+                    distances.append((network.station(fields[1]), network.station(fields[2]),
+                                      float(fields[3]), float(fields[4])))
+                elif kind == 'BEARING':
+                    bearings.append((network.station(fields[1]), network.station(fields[2]),
+                                     fields[3], math.radians(float(fields[4]) / 3600.0)))
+                elif kind == 'ANGLE':
+                    angles.append((network.station(fields[1]), network.station(fields[2]),
+                                   network.station(fields[3]), fields[4], math.radians(float(fields[5]) / 3600.0)))
+                else:
+                    raise ValueError
+            except (IndexError, ValueError):
+                raise NetworkError('Bad observation: %s' % line)
+
+    # Bearings and angles are parsed together, angles are azimuth style DMS
+    try:
+        values = np.radians(parse_bearings([b[2] for b in bearings] + [a[3] for a in angles]))
+    except ValueError as e:
+        raise NetworkError(str(e))
+    network.vectors = vectors
+    network.distances = distances
+    network.bearings = [(f, t, az, sigma) for (f, t, _, sigma), az in zip(bearings, values[:len(bearings)])]
+    network.angles = [(a, b, f, angle, sigma) for (a, b, f, _, sigma), angle in zip(angles, values[len(bearings):])]
+
+    if not network.control:
+        raise NetworkError('No CONTROL stations: %s' % observation_file)
+    return network
+
+
+def write_covariances(cov_file, names, xy, covariance):
+    # Adjusted coordinates and covariances, one station per line
+    with open(cov_file, 'w') as f:
+        f.write('# name, x, y, sxx, sxy, syy\n')
+        for name, (x, y), c in zip(names, xy.tolist(), covariance.tolist()):
+            f.write('%s,%.4f,%.4f,%.6e,%.6e,%.6e\n' % (name, x, y, c[0][0], c[0][1], c[1][1]))
+
+
+def read_covariances(cov_file):
+    # Dict of canonical station name -> ((x, y), 2x2 covariance array) from a covariance file
+    covariances = {}
+    with open(cov_file) as f:
+        for line in f:
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+            name, x, y, sxx, sxy, syy = line.split(',')[:6]
+            covariances[canonical_name(name)] = (
+                (float(x), float(y)), np.array([[float(sxx), float(sxy)], [float(sxy), float(syy)]]))
+    return covariances
+
+
+def adjust_network(observation_file, output_fc, cov_file):
+
+    arcpy.env.addOutputsToMap = False
+
+    try:
+        network = read_observations(observation_file)
+        network.adjust()
+    except NetworkError as e:
+        arcpy.AddError(str(e))
+        raise arcpy.ExecuteError
+
+    arcpy.AddMessage('Stations: %d  Observations: %d  Degrees of freedom: %d' % (
+        len(network.names), network.observation_count(), network.dof))
+    arcpy.AddMessage('Solver: %s  Iterations: %d  Standard error of unit weight: %.3f' % (
+        network.solver, network.iterations, network.sigma0))
+    if not network.converged:
+        arcpy.AddWarning('Adjustment did not converge in %d iterations' % ITERATIONS)
+
+    if network.residuals:
+        (kind, start, end), w = max(network.residuals, key=lambda r: abs(r[1]))
+        arcpy.AddMessage('Largest standardized residual: %s %s-%s %.2f' % (kind, start, end, abs(w)))
+
+    if cov_file:
+        write_covariances(cov_file, network.names, network.xy, network.covariance)
+
+    if output_fc:
+        create_points_feature_class(output_fc)
+        pt_time = datetime.now().astimezone(tz.UTC).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+        points = PointSet.from_columns(network.xy, {
+            'TIME': pt_time,
+            'NAME': network.names,
+            'DESCRIPTION': ['SN %.4f SE %.4f' % (math.sqrt(c[1, 1]), math.sqrt(c[0, 0])) for c in network.covariance],
+            'SYMBOL': NETWORK_SYMBOL,
+            'TYPE': NETWORK_TYPE,
+        })
+        open_store(output_fc).insert_points(points)
+
+    return
+
+
+class AdjustNetwork(object):
+    def __init__(self):
+        registry.describe(self)
+        self.category = None
+        self.canRunInBackground = False
+
+    def getParameterInfo(self):
+        params = []
+
+        # Input observation file
+        param = arcpy.Parameter(
+            displayName='Observations File',
+            name='observation_file',
+            datatype='DEFile',
+            parameterType='Required',
+            direction='Input'
+        )
+        param.filter.list = ['txt', 'csv']
+        params.append(param)
+
+        # Output Feature Class
+        param = arcpy.Parameter(
+            displayName='Output Points Feature Class',
+            name='output_fc',
+            datatype='GPFeatureLayer',
+            parameterType='Optional',
+            direction='Output'
+        )
+        params.append(param)
+
+        # Output covariance file
+        param = arcpy.Parameter(
+            displayName='Output Covariance File',
+            name='cov_file',
+            datatype='DEFile',
+            parameterType='Optional',
+            direction='Output'
+        )
+        param.filter.list = ['txt']
+        params.append(param)
+
+        return params
+
+    def execute(self, params, messages):
+        observation_file = params[0].valueAsText
+        output_fc = params[1].valueAsText
+        cov_file = params[2].valueAsText
+
+        adjust_network(observation_file, output_fc, cov_file)
+
+        return
+
+
+if __name__ == '__main__':
+
+    observation_file = arcpy.GetParameterAsText(0)
+    output_fc = arcpy.GetParameterAsText(1)
+    cov_file = arcpy.GetParameterAsText(2)
+
+    adjust_network(observation_file, output_fc, cov_file)
@@ -0,0 +1,348 @@
+from tools.backend import arcpy
+import numpy as np
+
+from tools.feature_store import canonical_name, open_store
+from tools.points import PointSet
+import tools.registry as registry
+from tools.spatial_index import GridIndex
+import tools.timing as timing
+
+
+#
+# CheckPoints - duplicate, name collision and elevation outlier checks for point sets
+#
+# Duplicates are pairs of points within the tolerance of each other, found with a
+# GridIndex using the tolerance as the cell size. Name collisions are points with
+# the same canonical name more than the tolerance apart. Elevation outliers differ
+# from a plane fitted through their neighbours within the radius by more than the
+# threshold times the robust spread of the neighbours about the plane (1.4826 times
+# their median absolute residual), so sloping ground is not flagged. The spread is
+# corrected for the three plane parameters taken from the neighbours' degrees of
+# freedom, held to at least the median spreads of the checked points in nearby grid
+# cells and of all checked points, pooled from points too far away for their planes
+# to take in the point, since the spread of a few residuals is often far too small,
+# and widened by the standard error of the plane at the point, which grows when the
+# plane is extrapolated past lopsided neighbours.
+# Neighbour queries run in chunks so million point sets stay within memory.
+#
+
+# Default duplicate and name collision tolerance (feature class units)
+DUPLICATE_TOLERANCE = 0.1
+
+# Default neighbour radius for the elevation check (feature class units)
+NEIGHBOUR_RADIUS = 100.0
+
+# Default outlier threshold in robust standard deviations
+OUTLIER_THRESHOLD = 5.0
+
+# Neighbours needed for an elevation check, with fewer the plane fitted through the
+# neighbours leaves too few residuals for a spread
+MIN_NEIGHBOURS = 6
+
+# Lower limit on the neighbour spread, so points on flat ground are not flagged for
+# differences in the last digit (feature class units)
+MIN_ELEVATION_SPREAD = 0.1
+
+# Query points per neighbour search
+QA_CHUNK_SIZE = 100000
+
+# Number of issues of each kind listed in the tool messages
+MAX_LISTED_ISSUES = 100
+
+# Median absolute deviation to standard deviation for normal errors
+MAD_SCALE = 1.4826
+
+# Ridge on the local plane slopes, relative to the neighbour radius
+PLANE_RIDGE = 1e-3
+
+
+def find_duplicates(xy, tolerance):
+    # Pairs of points (i < j) within tolerance of each other, with their distances
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    valid = np.flatnonzero(np.isfinite(xy).all(axis=1))
+    i, j, d = GridIndex(xy[valid], tolerance).pairs(tolerance)
+    return valid[i], valid[j], d
+
+
+def find_name_collisions(names, xy, tolerance):
+    """ Points sharing a canonical name that are more than tolerance apart.
+        :return: list of (name, point indices, distance) where distance is the largest
+            distance of a point from the first point with the name
+
+    """
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    groups = {}
+    labels = np.full(len(xy), -1, dtype=np.int64)
+    for i, name in enumerate(names):
+        name = canonical_name(name)
+        if name:
+            labels[i] = groups.setdefault(name, len(groups))
+
+    named = np.flatnonzero(labels >= 0)
+    if not len(named):
+        return []
+    labels = labels[named]
+    _, first, counts = np.unique(labels, return_index=True, return_counts=True)
+
+    d = np.hypot(*(xy[named] - xy[named[first[labels]]]).T)
+    spread = np.zeros(len(groups))
+    np.maximum.at(spread, labels, np.nan_to_num(d, nan=np.inf))
+
+    names = list(groups)
+    members = named[np.argsort(labels, kind='stable')]
+    end = np.cumsum(counts)
+    collisions = []
+    for g in np.flatnonzero((counts > 1) & (spread > tolerance)).tolist():
+        collisions.append((names[g], members[end[g] - counts[g]:end[g]], float(spread[g])))
+    return collisions
+
+
+def _group_median(groups, values, count):
+    # Median of the values in each group, NaN for empty groups
+    order = np.lexsort((values, groups))
+    values = values[order]
+    counts = np.bincount(groups, minlength=count)
+    start = np.cumsum(counts) - counts
+    median = np.full(count, np.nan)
+    has = counts > 0
+    lo, hi = start[has] + (counts[has] - 1) // 2, start[has] + counts[has] // 2
+    median[has] = (values[lo] + values[hi]) / 2.0
+    return median
+
+
+def _local_planes(query, dxy, z, count, radius):
+    # Least squares plane z = a + b*dx + c*dy through the neighbours of each query point, with
+    # (dx, dy) the offsets from the query point. Returns the (count, 3) coefficients, a is the
+    # plane elevation at the query point, and the variance of a per unit residual variance.
+    # A small ridge on the slopes levels degenerate fits.
+    dx, dy = dxy.T
+    terms = (np.ones_like(dx), dx, dy)
+    N = np.empty((count, 3, 3))
+    u = np.empty((count, 3))
+    for r in range(3):
+        u[:, r] = np.bincount(query, terms[r] * z, minlength=count)
+        for c in range(r, 3):
+            N[:, r, c] = N[:, c, r] = np.bincount(query, terms[r] * terms[c], minlength=count)
+    N[:, 0, 0] += N[:, 0, 0] == 0
+    ridge = N[:, 0, 0] * (radius * PLANE_RIDGE) ** 2
+    N[:, 1, 1] += ridge
+    N[:, 2, 2] += ridge
+    inverse = np.linalg.inv(N)
+    return np.einsum('nij,nj->ni', inverse, u), inverse[:, 0, 0]
+
+
+def find_elevation_outliers(xy, z, radius, threshold=OUTLIER_THRESHOLD, min_neighbours=MIN_NEIGHBOURS):
+    """ Points whose elevation departs from the local plane through their neighbours within radius.
+        :return: (point indices, elevation minus the plane elevation, plane elevation)
+
+    """
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    z = np.asarray(z, dtype=np.float64)
+    valid = np.flatnonzero(np.isfinite(xy).all(axis=1) & np.isfinite(z))
+    xy, z = xy[valid], z[valid]
+    index = GridIndex(xy, radius)
+
+    # Neighbour counts, plane elevations, plane variances and spreads of every point
+    counts, planes, variances, spreads = [], [], [], []
+    for start in range(0, len(xy), QA_CHUNK_SIZE):
+        chunk = xy[start:start + QA_CHUNK_SIZE]
+        query, point, _ = index.within(chunk, radius)
+        keep = point != query + start
+        query, point = query[keep], point[keep]
+        count = np.bincount(query, minlength=len(chunk))
+
+        # Neighbour residuals from the plane, their median absolute value is the spread. The
+        # residuals are short of the errors by the three plane parameters.
+        dxy = xy[point] - chunk[query]
+        coef, variance = _local_planes(query, dxy, z[point], len(chunk), radius)
+        fit = coef[query, 0] + (coef[query, 1:] * dxy).sum(axis=1)
+        spread = _group_median(query, np.abs(z[point] - fit), len(chunk))
+        counts.append(count)
+        planes.append(coef[:, 0])
+        variances.append(variance)
+        spreads.append(spread * np.sqrt(count / np.maximum(count - 3, 1)))
+
+    if not counts:
+        return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0)
+    counts, planes = np.concatenate(counts), np.concatenate(planes)
+    variances, spreads = np.concatenate(variances), np.concatenate(spreads)
+
+    # The spread of a few residuals is often far too small. The points are pooled by grid cells the
+    # size of the radius, the least spread used in a cell is the larger median spread of the checked
+    # points in the cells two away and of all checked points outside the block of nine cells around
+    # it, whose planes leave out the points of the cell. The medians drop as many of the largest
+    # spreads as there are checked points in the block, and medians of fewer than min_neighbours
+    # spreads are not used.
+    checked = counts >= min_neighbours
+    pooled = np.full(len(xy), np.nan)
+    order = np.flatnonzero(checked)
+    if len(order):
+        # The checked points in order of their spreads, so an index point is its spread's rank
+        order = order[np.argsort(spreads[order], kind='stable')]
+        ranked, pool = spreads[order], GridIndex(xy[order], radius)
+        ranked_cells = np.floor((pool.xy - pool.origin) / radius).astype(np.int64)
+        cells, cell = np.unique(np.floor((xy - pool.origin) / radius).astype(np.int64), axis=0, return_inverse=True)
+        cell_pooled = np.empty(len(cells))
+        for start in range(0, len(cells), QA_CHUNK_SIZE):
+            chunk = cells[start:start + QA_CHUNK_SIZE]
+            query, rank = pool.candidates(pool.origin + (chunk + 0.5) * radius, 2.0 * radius)
+            ring = np.abs(ranked_cells[rank] - chunk[query]).max(axis=1) == 2
+            local = np.bincount(query[ring], minlength=len(chunk)) >= min_neighbours
+            left = len(ranked) - np.bincount(query[~ring], minlength=len(chunk))
+            far = (ranked[np.maximum(left - 1, 0) // 2] + ranked[left // 2]) / 2.0
+            far[left < min_neighbours] = np.nan
+            near = _group_median(query[ring], ranked[rank[ring]], len(chunk))
+            cell_pooled[start:start + len(chunk)] = np.fmax(np.where(local, near, np.nan), far)
+        pooled = cell_pooled[cell.reshape(-1)]
+    spreads = np.fmax(spreads, pooled)
+    scale = np.maximum(MAD_SCALE * spreads, MIN_ELEVATION_SPREAD) * np.sqrt(1.0 + variances)
+
+    residual = z - planes
+    with np.errstate(invalid='ignore'):
+        flag = np.flatnonzero(checked & (np.abs(residual) > threshold * scale))
+    return valid[flag], residual[flag], planes[flag]
+
+
+@timing.timed('point QA')
+def check_points(points, tolerance=DUPLICATE_TOLERANCE, radius=NEIGHBOUR_RADIUS, threshold=OUTLIER_THRESHOLD,
+                 qa_file=None):
+    """ Report duplicates, name collisions and elevation outliers in a PointSet.
+        :param qa_file: optional CSV file listing every issue
+        :return: number of (duplicates, name collisions, elevation outliers)
+
+    """
+    tolerance, radius = float(tolerance), float(radius)
+    names = points.column('NAME').tolist()
+
+    i, j, d = find_duplicates(points.xy, tolerance)
+    collisions = find_name_collisions(names, points.xy, tolerance)
+    outliers, residuals, medians = find_elevation_outliers(points.xy, points.column('ELEVATION'), radius, threshold)
+
+    issues = []
+    for a, b, dist in zip(i.tolist(), j.tolist(), d.tolist()):
+        issues.append(('DUPLICATE', names[a], names[b], dist))
+    for name, members, dist in collisions:
+        issues.append(('NAME', name, '%d points' % len(members), dist))
+    for p, dz, z in zip(outliers.tolist(), residuals.tolist(), medians.tolist()):
+        issues.append(('ELEVATION', names[p], 'local %.4f' % z, dz))
+
+    counts = len(i), len(collisions), len(outliers)
+    arcpy.AddMessage('Point QA: %d points  duplicates: %d  name collisions: %d  elevation outliers: %d'
+                     % ((len(points),) + counts))
+
+    listed = {}
+    for issue, name, other, value in issues:
+        listed[issue] = listed.get(issue, 0) + 1
+        if listed[issue] <= MAX_LISTED_ISSUES:
+            arcpy.AddWarning('%s: %s %s %.4f' % (issue, name, other, value))
+    for issue, count in listed.items():
+        if count > MAX_LISTED_ISSUES:
+            arcpy.AddWarning('... %d more %s issues' % (count - MAX_LISTED_ISSUES, issue))
+
+    if qa_file:
+        with open(qa_file, 'w') as f:
+            f.write('ISSUE,NAME,OTHER,VALUE\n')
+            for issue, name, other, value in issues:
+                f.write('%s,%s,%s,%.4f\n' % (issue, name or '', other or '', value))
+
+    return counts
+
+
+def check_points_tool(input_fc, tolerance, radius, threshold, qa_file):
+
+    arcpy.env.addOutputsToMap = False
+
+    points = PointSet.read(open_store(input_fc))
+    check_points(points, float(tolerance or DUPLICATE_TOLERANCE), float(radius or NEIGHBOUR_RADIUS),
+                 float(threshold or OUTLIER_THRESHOLD), qa_file)
+
+    return
+
+
+class CheckPoints(object):
+    def __init__(self):
+        registry.describe(self)
+        self.category = None
+        self.canRunInBackground = False
+
+    def getParameterInfo(self):
+        params = []
+
+        # Input point feature class
+        param = arcpy.Parameter(
+            displayName='Input Point Feature Class',
+            name='input_fc',
+            datatype='GPFeatureLayer',
+            parameterType='Required',
+            direction='Input'
+        )
+        param.filter.list = ['Point']
+        params.append(param)
+
+        # Duplicate and name collision tolerance
+        param = arcpy.Parameter(
+            displayName='Duplicate Tolerance',
+            name='tolerance',
+            datatype='GPDouble',
+            parameterType='Optional',
+            direction='Input'
+        )
+        param.value = DUPLICATE_TOLERANCE
+        params.append(param)
+
+        # Neighbour radius for the elevation check
+        param = arcpy.Parameter(
+            displayName='Elevation Neighbour Radius',
+            name='radius',
+            datatype='GPDouble',
+            parameterType='Optional',
+            direction='Input'
+        )
+        param.value = NEIGHBOUR_RADIUS
+        params.append(param)
+
+        # Elevation outlier threshold
+        param = arcpy.Parameter(
+            displayName='Outlier Threshold (standard deviations)',
+            name='threshold',
+            datatype='GPDouble',
+            parameterType='Optional',
+            direction='Input'
+        )
+        param.value = OUTLIER_THRESHOLD
+        params.append(param)
+
+        # Output issues file (optional)
+        param = arcpy.Parameter(
+            displayName='QA Report File (Optional)',
+            name='qa_file',
+            datatype='DEFile',
+            parameterType='Optional',
+            direction='Output'
+        )
+        param.filter.list = ['csv', 'txt']
+        params.append(param)
+
+        return params
+
+    def execute(self, params, messages):
+        input_fc = params[0].valueAsText
+        tolerance = params[1].valueAsText
+        radius = params[2].valueAsText
+        threshold = params[3].valueAsText
+        qa_file = params[4].valueAsText
+
+        check_points_tool(input_fc, tolerance, radius, threshold, qa_file)
+
+        return
+
+
+if __name__ == '__main__':
+
+    input_fc = arcpy.GetParameterAsText(0)
+    tolerance = arcpy.GetParameterAsText(1)
+    radius = arcpy.GetParameterAsText(2)
+    threshold = arcpy.GetParameterAsText(3)
+    qa_file = arcpy.GetParameterAsText(4)
+
+    check_points_tool(input_fc, tolerance, radius, threshold, qa_file)
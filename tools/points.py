@@ -0,0 +1,190 @@
+import numpy as np
+
+from tools.feature_store import POINT_FIELD_NAMES
+
+
+#
+# PointSet - the standard points schema as a NumPy structured array
+#
+# Points move between the parsers, transforms and feature stores as one record
+# per point: the coordinate pair, ELEVATION, SAMPLES and int32 codes for the text
+# fields. The codes index a string table shared by every slice of the set, so a
+# SYMBOL or TYPE repeated on every point is stored once. A record is 48 bytes,
+# against several hundred for a cursor row tuple with its strings.
+#
+
+# Text fields held as codes into the string table, code 0 is None
+TEXT_FIELDS = ('TIME', 'NAME', 'DESCRIPTION', 'SYMBOL', 'TYPE')
+
+# SAMPLES value for a null count
+NO_SAMPLES = -1
+
+POINT_DTYPE = np.dtype([
+    ('xy', np.float64, (2,)),
+    ('ELEVATION', np.float64),
+    ('TIME', np.int32),
+    ('NAME', np.int32),
+    ('DESCRIPTION', np.int32),
+    ('SYMBOL', np.int32),
+    ('TYPE', np.int32),
+    ('SAMPLES', np.int32),
+])
+
+
+class PointSet(object):
+    """ Points with the standard points schema held in a structured array.
+
+        xy is an (n, 2) view of the coordinates, so a batch transform writes straight
+        back into the records. ELEVATION is NaN and SAMPLES is NO_SAMPLES where null.
+        Iterating yields insert cursor rows -
+        ('SHAPE@XY', 'ELEVATION', 'TIME', 'NAME', 'DESCRIPTION', 'SYMBOL', 'TYPE', 'SAMPLES')
+        so a PointSet can be passed to FeatureStore.insert_points as is.
+
+    """
+
+    def __init__(self, data=None, strings=None):
+        self.data = np.zeros(0, dtype=POINT_DTYPE) if data is None else data
+        self.strings = [None] if strings is None else strings
+        self._codes = None
+
+    @classmethod
+    def from_columns(cls, xy, columns=None):
+        """ Build a point set from column values.
+            :param xy: sequence or (n, 2) array of coordinates
+            :param columns: dict of field -> sequence of values, or a single value for every point
+
+        """
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        points = cls(np.zeros(len(xy), dtype=POINT_DTYPE))
+        points.data['xy'] = xy
+        points.data['ELEVATION'] = np.nan
+        points.data['SAMPLES'] = NO_SAMPLES
+
+        for field, values in (columns or {}).items():
+            if isinstance(values, (str, int, float)) or values is None:
+                values = [values] * len(xy)
+            if field == 'ELEVATION' and isinstance(values, np.ndarray) and values.dtype.kind in 'fiu':
+                points.data[field] = values
+            elif field == 'ELEVATION':
+                points.data[field] = [np.nan if v is None else float(v) for v in values]
+            elif field == 'SAMPLES':
+                points.data[field] = [NO_SAMPLES if v is None or v == '' else int(v) for v in values]
+            else:
+                points.data[field] = points.intern(values)
+
+        return points
+
+    @classmethod
+    def from_rows(cls, rows):
+        # Build a point set from insert cursor rows
+        rows = list(rows)
+        if not rows:
+            return cls()
+        columns = list(zip(*rows))
+        return cls.from_columns(columns[0], dict(zip(POINT_FIELD_NAMES, columns[1:])))
+
+    @classmethod
+    def read(cls, store, spatial_reference=None, order_by=None, where=None, elevation='ELEVATION'):
+        """ Read the standard point fields present in a feature store.
+            :param elevation: field read as ELEVATION, e.g. 'SHAPE@Z', None to leave it null
+
+        """
+        present = store.field_names()
+        names = [f for f in POINT_FIELD_NAMES if f != 'ELEVATION' and f in present]
+        if elevation and (elevation != 'ELEVATION' or elevation in present):
+            names = ['ELEVATION'] + names
+        fields = ['SHAPE@XY'] + [elevation if f == 'ELEVATION' else f for f in names]
+
+        rows = list(store.read_points(fields, spatial_reference=spatial_reference, order_by=order_by, where=where))
+        if not rows:
+            return cls()
+        columns = list(zip(*rows))
+        xy = [(np.nan, np.nan) if pt is None else pt for pt in columns[0]]
+        return cls.from_columns(xy, dict(zip(names, columns[1:])))
+
+    @staticmethod
+    def concatenate(sets):
+        # One point set from several, string tables are merged where they differ
+        sets = list(sets)
+        if not sets:
+            return PointSet()
+        strings = sets[0].strings
+        if all(s.strings is strings for s in sets):
+            return PointSet(np.concatenate([s.data for s in sets]), strings)
+
+        points = PointSet(np.concatenate([s.data for s in sets]))
+        start = 0
+        for s in sets:
+            remap = points.intern(s.strings)
+            block = points.data[start:start + len(s)]
+            for field in TEXT_FIELDS:
+                block[field] = remap[s.data[field]]
+            start += len(s)
+        return points
+
+    def intern(self, values):
+        # String table codes for a sequence of text values, new values are added to the table
+        if self._codes is None:
+            self._codes = dict((v, i) for i, v in enumerate(self.strings))
+        codes, strings = self._codes, self.strings
+
+        def code(value):
+            c = codes.get(value)
+            if c is None:
+                c = codes[value] = len(strings)
+                strings.append(value)
+            return c
+
+        return np.fromiter((code(v) for v in values), dtype=np.int32, count=len(values))
+
+    @property
+    def xy(self):
+        return self.data['xy']
+
+    @xy.setter
+    def xy(self, xy):
+        self.data['xy'] = xy
+
+    def column(self, field):
+        """ Values of one field.
+            :return: float array for ELEVATION, masked int array for SAMPLES and object
+                arrays of str/None for the text fields
+
+        """
+        if field == 'ELEVATION':
+            return self.data[field]
+        if field == 'SAMPLES':
+            samples = self.data[field]
+            return np.ma.masked_array(samples, mask=samples == NO_SAMPLES)
+        return np.asarray(self.strings, dtype=object)[self.data[field]]
+
+    def codes(self, field):
+        # String table codes of a text field with the table, (codes, strings), code 0 is None
+        return self.data[field], self.strings
+
+    def rows(self):
+        # Insert cursor rows
+        xy = map(tuple, self.data['xy'].tolist())
+        elevations = [None if z != z else z for z in self.data['ELEVATION'].tolist()]
+        text = [self.column(field).tolist() for field in TEXT_FIELDS]
+        samples = [None if c == NO_SAMPLES else c for c in self.data['SAMPLES'].tolist()]
+        return zip(xy, elevations, *text, samples)
+
+    def __iter__(self):
+        return self.rows()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        # A single row for an integer index, otherwise a point set sharing the string table
+        if isinstance(index, (int, np.integer)):
+            return next(PointSet(self.data[index:index + 1 or None], self.strings).rows())
+        return PointSet(self.data[index], self.strings)
+
+    def __getstate__(self):
+        # The code lookup is rebuilt on demand, worker results only carry the records and strings
+        return {'data': self.data, 'strings': self.strings}
+
+    def __setstate__(self, state):
+        self.data, self.strings, self._codes = state['data'], state['strings'], None
@@ -0,0 +1,117 @@
+import importlib
+import os
+
+
+#
+# Registry - lazily loaded tool classes for Transform_Tools.pyt
+#
+# ArcGIS Pro creates every tool in the toolbox to list it, and again each time the
+# toolbox is refreshed. The toolbox only imports this module. Each tool is a small
+# class holding its label and description, the tool module (and with it numpy,
+# arcpy.da and the rest) is imported the first time the tool is opened or run.
+#
+# Set TRANSFORM_TOOLS_RELOAD=1 while developing to reload a tool module every time
+# the tool is opened, so changes show up without restarting ArcGIS Pro.
+#
+
+RELOAD_VARIABLE = 'TRANSFORM_TOOLS_RELOAD'
+
+# (class, module, label, description) in toolbox order, the tool classes take their
+# label and description from here
+TOOLS = [
+    ('CalculateTransform', 'tools.calculate_transform', 'Calculate Transform',
+     'Calculate parameters for a similarity transform.'),
+    ('DiscoverLinks', 'tools.link_discovery', 'Discover Links',
+     'Match source points to target points and write the Calculate Transform links.'),
+    ('TransformFeatures', 'tools.transform_features', 'Transform Features',
+     'Apply transform to a feature class.'),
+    ('ImportPNEZD', 'tools.import_pnezd', 'Import PNEZD',
+     'Import PNEZD points into a Points feature class.'),
+    ('ExportPNEZD', 'tools.export_pnezd', 'Export PNEZD',
+     'Create a PNEZD file from a point feature class.'),
+    ('CheckPoints', 'tools.point_qa', 'Check Points',
+     'Find duplicate points, name collisions and elevation outliers.'),
+    ('CogoTraverse', 'tools.cogo', 'COGO Traverse',
+     'Compute PNEZD points from a file of traverse bearings and distances.'),
+    ('AdjustNetwork', 'tools.network', 'Adjust Network',
+     'Least squares adjustment of GPS vectors and total station observations.'),
+    ('ImportCAD', 'tools.import_cad', 'Import CAD',
+     'Import CAD features optionally applying a transform.'),
+    ('ImportGPX', 'tools.import_gpx', 'Import GPX',
+     'Create waypoint, route point and track features from GPX files.'),
+    ('ExportGPX', 'tools.export_gpx', 'Export GPX',
+     'Create a GPX file from waypoint and route point features.'),
+    ('AverageWaypoints', 'tools.waypoint_averaging', 'Average Waypoints',
+     'Average waypoints collected over several sessions and GPX files.'),
+    ('CreatePointsFC', 'tools.utils', 'Create Points Feature Class',
+     'Create an empty points feature class.'),
+]
+
+
+def describe(tool):
+    # Set the label and description of a tool instance from its entry in TOOLS
+    for name, _, label, description in TOOLS:
+        if name == type(tool).__name__:
+            tool.label = label
+            tool.description = description
+            return
+    raise KeyError(type(tool).__name__)
+
+
+def reload_enabled():
+    return os.environ.get(RELOAD_VARIABLE, '').lower() in ('1', 'true', 'yes')
+
+
+class LazyTool(object):
+    """ Toolbox entry that imports the tool module on first use.
+        Subclasses set module and tool_class, the tool methods are passed on to an
+        instance of the tool class.
+
+    """
+
+    module = None
+    tool_class = None
+    tool_label = None
+    tool_description = None
+
+    def __init__(self):
+        self.label = self.tool_label
+        self.description = self.tool_description
+        self.category = None
+        self.canRunInBackground = False
+        self._tool = None
+
+    def load(self):
+        # The tool instance, importing (or reloading) its module
+        if self._tool is None:
+            module = importlib.import_module(self.module)
+            if reload_enabled():
+                module = importlib.reload(module)
+            self._tool = getattr(module, self.tool_class)()
+        return self._tool
+
+    def getParameterInfo(self):
+        return self.load().getParameterInfo()
+
+    def isLicensed(self):
+        return True
+
+    def updateParameters(self, params):
+        tool = self.load()
+        if hasattr(tool, 'updateParameters'):
+            tool.updateParameters(params)
+
+    def updateMessages(self, params):
+        tool = self.load()
+        if hasattr(tool, 'updateMessages'):
+            tool.updateMessages(params)
+
+    def execute(self, params, messages):
+        return self.load().execute(params, messages)
+
+
+def tool_classes():
+    # A LazyTool subclass named after each tool class, in toolbox order
+    return [type(name, (LazyTool,), {'module': module, 'tool_class': name, 'tool_label': label,
+                                     'tool_description': description})
+            for name, module, label, description in TOOLS]
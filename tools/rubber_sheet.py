@@ -0,0 +1,335 @@
+import numpy as np
+
+
+#
+# Rubber sheeting - residual correction applied after the similarity transform
+#
+# A similarity fit over a large project leaves systematic residuals at the links,
+# target - forward(source). The correction interpolates those residuals over the
+# target coordinates so every link lands on its target and points in between move
+# with their neighbours. Two models are provided -
+#
+#   TIN  - Delaunay triangulation of the residuals with linear (barycentric)
+#          interpolation inside each triangle
+#   GRID - the TIN sampled at the nodes of a regular grid and interpolated
+#          bilinearly, smoother across triangle edges and quicker to evaluate
+#
+# Four anchor nodes with zero residual are placed around the links, one link
+# extent out, so the correction fades to nothing away from the project instead
+# of stopping at the edge of the triangulation. Points outside the anchors are
+# not corrected.
+#
+
+TIN = 'TIN'
+GRID = 'GRID'
+
+# Anchor distance from the links as a fraction of the link extent
+ANCHOR_MARGIN = 1.0
+
+# Iteration limit and tolerance (coordinate units) for the inverse correction
+INVERSE_ITERATIONS = 50
+INVERSE_TOLERANCE = 1e-6
+
+# Barycentric tolerance for points on triangle edges
+EDGE_TOLERANCE = 1e-9
+
+
+def delaunay(xy):
+    """ Delaunay triangulation by incremental (Bowyer-Watson) insertion.
+        :param xy: distinct node coordinates (shape: n, 2)
+        :return: counter-clockwise triangle vertex indices (shape: m, 3)
+
+        Each insertion tests the new point against the circumcircles of all
+        current triangles as one vectorized pass, O(n^2) overall, which is
+        plenty for link sets of a few thousand points.
+
+    """
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    n = len(xy)
+    if n < 3:
+        return np.zeros((0, 3), dtype=np.int64)
+
+    # Work in unit coordinates with a super triangle well outside the nodes
+    lo = xy.min(axis=0)
+    span = max((xy.max(axis=0) - lo).max(), 1e-12)
+    pts = np.vstack(((xy - lo) / span, [[-100.0, -100.0], [200.0, -100.0], [-100.0, 200.0]]))
+
+    tris = np.array([[n, n + 1, n + 2]], dtype=np.int64)
+    centers, radii = _circumcircles(pts, tris)
+
+    for i in range(n):
+        p = pts[i]
+        bad = ((centers - p) ** 2).sum(axis=1) < radii
+
+        # Boundary of the cavity, the edges of the bad triangles that are not shared
+        edges = tris[bad][:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2)
+        keys = np.sort(edges, axis=1)
+        keys = keys[:, 0] * (n + 3) + keys[:, 1]
+        _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        edges = edges[counts[inverse] == 1]
+
+        new = np.column_stack((edges, np.full(len(edges), i)))
+        new_centers, new_radii = _circumcircles(pts, new)
+        tris = np.vstack((tris[~bad], new))
+        centers = np.vstack((centers[~bad], new_centers))
+        radii = np.concatenate((radii[~bad], new_radii))
+
+    return tris[(tris < n).all(axis=1)]
+
+
+def _circumcircles(pts, tris):
+    # Circumcircle centers and squared radii for triangles (shape: m, 3)
+    a, b, c = pts[tris[:, 0]], pts[tris[:, 1]], pts[tris[:, 2]]
+    ab, ac = b - a, c - a
+    d = 2.0 * (ab[:, 0] * ac[:, 1] - ab[:, 1] * ac[:, 0])
+    ab2, ac2 = (ab ** 2).sum(axis=1), (ac ** 2).sum(axis=1)
+    ux = (ac[:, 1] * ab2 - ab[:, 1] * ac2) / d
+    uy = (ab[:, 0] * ac2 - ac[:, 0] * ab2) / d
+    return a + np.column_stack((ux, uy)), ux ** 2 + uy ** 2
+
+
+class TriangleIndex(object):
+    """ Uniform grid of buckets holding the triangles that overlap each cell.
+        locate() looks up the bucket for each query point and tests the bucket's
+        triangles with barycentric coordinates, vectorized over all points.
+
+    """
+
+    def __init__(self, xy, tris):
+        self.xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        self.tris = np.asarray(tris, dtype=np.int64).reshape(-1, 3)
+
+        # Affine map from each triangle to barycentric coordinates (l1, l2)
+        v0, v1, v2 = (self.xy[self.tris[:, k]] for k in range(3))
+        e1, e2 = v1 - v0, v2 - v0
+        det = e1[:, 0] * e2[:, 1] - e1[:, 1] * e2[:, 0]
+        self.origin_xy = v0
+        self.inv = np.stack((np.column_stack((e2[:, 1], -e2[:, 0])),
+                             np.column_stack((-e1[:, 1], e1[:, 0])))) / det[:, None]
+
+        # Bucket size from the median triangle bounding box, the large anchor triangles
+        # then cover many buckets rather than crowding every bucket
+        lo = np.minimum(np.minimum(v0, v1), v2)
+        hi = np.maximum(np.maximum(v0, v1), v2)
+        if len(self.tris):
+            self.origin = lo.min(axis=0)
+            self.cell_size = max(np.median(np.sqrt(((hi - lo) ** 2).sum(axis=1))) / 2.0, 1e-9)
+            c0, c1 = self._cells(lo), self._cells(hi)
+            self.shape = c1.max(axis=0) + 1
+        else:
+            self.origin = np.zeros(2)
+            self.cell_size = 1.0
+            c0 = c1 = np.zeros((0, 2), dtype=np.int64)
+            self.shape = np.ones(2, dtype=np.int64)
+
+        # Expand each triangle into the cells its bounding box covers
+        nx, ny = c1[:, 0] - c0[:, 0] + 1, c1[:, 1] - c0[:, 1] + 1
+        counts = nx * ny
+        tri = np.repeat(np.arange(len(self.tris)), counts)
+        k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cx = c0[tri, 0] + k // ny[tri]
+        cy = c0[tri, 1] + k % ny[tri]
+        keys = cx * self.shape[1] + cy
+        order = np.argsort(keys, kind='stable')
+        self.keys, self.bucket = keys[order], tri[order]
+
+    def _cells(self, xy):
+        return np.floor((xy - self.origin) / self.cell_size).astype(np.int64)
+
+    def locate(self, xy):
+        """ Triangle containing each point.
+            :return: (triangle, weights) - triangle index, -1 outside the triangulation,
+                and barycentric weights for the three triangle vertices (shape: n, 3)
+
+        """
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        triangle = np.full(len(xy), -1, dtype=np.int64)
+        weights = np.zeros((len(xy), 3))
+
+        cells = self._cells(xy)
+        q = np.flatnonzero((cells >= 0).all(axis=1) & (cells < self.shape).all(axis=1))
+        keys = cells[q, 0] * self.shape[1] + cells[q, 1]
+        start = np.searchsorted(self.keys, keys, side='left')
+        counts = np.searchsorted(self.keys, keys, side='right') - start
+
+        # Candidate (point, triangle) pairs from the buckets
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        query = np.repeat(q, counts)
+        tri = self.bucket[np.repeat(start, counts) + offsets]
+
+        d = xy[query] - self.origin_xy[tri]
+        l1 = self.inv[0, tri, 0] * d[:, 0] + self.inv[0, tri, 1] * d[:, 1]
+        l2 = self.inv[1, tri, 0] * d[:, 0] + self.inv[1, tri, 1] * d[:, 1]
+        l0 = 1.0 - l1 - l2
+        inside = np.flatnonzero((l0 >= -EDGE_TOLERANCE) & (l1 >= -EDGE_TOLERANCE) & (l2 >= -EDGE_TOLERANCE))
+
+        # Points on a shared edge take the first triangle found
+        found, first = np.unique(query[inside], return_index=True)
+        hit = inside[first]
+        triangle[found] = tri[hit]
+        weights[found] = np.column_stack((l0[hit], l1[hit], l2[hit]))
+
+        return triangle, weights
+
+
+class Correction(object):
+    """ Displacement field added to similarity transformed coordinates. """
+
+    method = None
+
+    def displacement(self, xy):
+        raise NotImplementedError
+
+    def apply(self, xy):
+        # Forward correction of an array of point coordinates (shape: n, 2)
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        return xy + self.displacement(xy)
+
+    def remove(self, xy):
+        # Inverse correction, solves p + displacement(p) = xy by fixed-point iteration.
+        # This converges while the displacement changes more slowly than the position.
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        p = xy - self.displacement(xy)
+        for _ in range(INVERSE_ITERATIONS):
+            update = xy - self.displacement(p)
+            step = np.abs(update - p).max() if len(p) else 0.0
+            p = update
+            if step < INVERSE_TOLERANCE:
+                break
+        return p
+
+    def lines(self):
+        # Text lines for the parameter file
+        raise NotImplementedError
+
+
+class TinCorrection(Correction):
+    """ Residuals interpolated linearly over a Delaunay triangulation.
+        :param nodes: node coordinates (shape: n, 2), including the anchors
+        :param residuals: displacement at each node (shape: n, 2)
+
+    """
+
+    method = TIN
+
+    def __init__(self, nodes, residuals):
+        self.nodes = np.asarray(nodes, dtype=np.float64).reshape(-1, 2)
+        self.residuals = np.asarray(residuals, dtype=np.float64).reshape(-1, 2)
+        self.tris = delaunay(self.nodes)
+        self.index = TriangleIndex(self.nodes, self.tris)
+
+    def displacement(self, xy):
+        triangle, weights = self.index.locate(xy)
+        inside = triangle >= 0
+        d = np.zeros((len(triangle), 2))
+        nodes = self.tris[triangle[inside]]
+        d[inside] = np.einsum('ij,ijk->ik', weights[inside], self.residuals[nodes])
+        return d
+
+    def lines(self):
+        lines = ['correction %s %d' % (TIN, len(self.nodes))]
+        lines += ['%.6f %.6f %.6f %.6f' % tuple(v) for v in np.hstack((self.nodes, self.residuals))]
+        return lines
+
+
+class GridCorrection(Correction):
+    """ Residuals interpolated bilinearly from a regular grid.
+        :param origin: coordinates of the lower left grid node
+        :param cell_size: grid node spacing
+        :param values: displacement at each grid node (shape: rows, columns, 2)
+
+    """
+
+    method = GRID
+
+    def __init__(self, origin, cell_size, values):
+        self.origin = np.asarray(origin, dtype=np.float64).reshape(2)
+        self.cell_size = float(cell_size)
+        self.values = np.asarray(values, dtype=np.float64)
+
+    def displacement(self, xy):
+        rows, cols = self.values.shape[:2]
+        u = (xy - self.origin) / self.cell_size
+        inside = (u[:, 0] >= 0) & (u[:, 0] <= cols - 1) & (u[:, 1] >= 0) & (u[:, 1] <= rows - 1)
+
+        c = np.clip(np.floor(u[:, 0]).astype(np.int64), 0, cols - 2)
+        r = np.clip(np.floor(u[:, 1]).astype(np.int64), 0, rows - 2)
+        fx = (u[:, 0] - c)[:, None]
+        fy = (u[:, 1] - r)[:, None]
+        v = self.values
+        d = ((v[r, c] * (1 - fx) + v[r, c + 1] * fx) * (1 - fy) +
+             (v[r + 1, c] * (1 - fx) + v[r + 1, c + 1] * fx) * fy)
+        d[~inside] = 0.0
+        return d
+
+    def lines(self):
+        rows, cols = self.values.shape[:2]
+        lines = ['correction %s %.6f %.6f %.6f %d %d' % (GRID, self.origin[0], self.origin[1],
+                                                         self.cell_size, cols, rows)]
+        lines += ['%.6f %.6f' % tuple(v) for v in self.values.reshape(-1, 2)]
+        return lines
+
+
+def build_correction(nodes, residuals, method=TIN, cell_size=None):
+    """ Residual correction from the link residuals.
+        :param nodes: similarity transformed source points of the links (shape: n, 2)
+        :param residuals: target - transformed source for each link (shape: n, 2)
+        :param method: TIN or GRID
+        :param cell_size: GRID node spacing, defaults to the mean link spacing
+        :return: a Correction, None with fewer than three links
+
+    """
+    nodes = np.asarray(nodes, dtype=np.float64).reshape(-1, 2)
+    residuals = np.asarray(residuals, dtype=np.float64).reshape(-1, 2)
+
+    # Links sharing a position are merged, their residuals averaged
+    nodes, inverse, counts = np.unique(nodes, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    residuals = np.column_stack([np.bincount(inverse, weights=residuals[:, k]) for k in range(2)]) / counts[:, None]
+    if len(nodes) < 3:
+        return None
+
+    lo, hi = nodes.min(axis=0), nodes.max(axis=0)
+    margin = ANCHOR_MARGIN * max((hi - lo).max(), 1.0)
+    lo, hi = lo - margin, hi + margin
+    anchors = np.array([[lo[0], lo[1]], [hi[0], lo[1]], [hi[0], hi[1]], [lo[0], hi[1]]])
+    tin = TinCorrection(np.vstack((nodes, anchors)), np.vstack((residuals, np.zeros((4, 2)))))
+
+    if (method or TIN).upper() == TIN:
+        return tin
+
+    if not cell_size:
+        width, height = (hi - lo) / (1.0 + 2.0 * ANCHOR_MARGIN)
+        cell_size = max(np.sqrt(width * height / len(nodes)), 1.0)
+    cell_size = float(cell_size)
+    cols = int(np.ceil((hi[0] - lo[0]) / cell_size)) + 1
+    rows = int(np.ceil((hi[1] - lo[1]) / cell_size)) + 1
+    gx, gy = np.meshgrid(lo[0] + cell_size * np.arange(cols), lo[1] + cell_size * np.arange(rows))
+    values = tin.displacement(np.column_stack((gx.ravel(), gy.ravel()))).reshape(rows, cols, 2)
+    return GridCorrection(lo, cell_size, values)
+
+
+def parse_correction(lines):
+    """ Correction from the parameter file lines written by Correction.lines().
+        :return: a Correction, None if the lines have no correction section
+
+    """
+    lines = [line.strip() for line in lines]
+    for i, line in enumerate(lines):
+        fields = line.split()
+        if len(fields) < 2 or fields[0] != 'correction':
+            continue
+
+        method = fields[1].upper()
+        if method == TIN:
+            n = int(fields[2])
+            data = np.loadtxt(lines[i + 1:i + 1 + n], ndmin=2)
+            return TinCorrection(data[:, :2], data[:, 2:4])
+        if method == GRID:
+            x0, y0, cell_size = (float(v) for v in fields[2:5])
+            cols, rows = int(fields[5]), int(fields[6])
+            data = np.loadtxt(lines[i + 1:i + 1 + cols * rows], ndmin=2)
+            return GridCorrection((x0, y0), cell_size, data.reshape(rows, cols, 2))
+        raise ValueError('Bad correction method: %s' % fields[1])
+
+    return None
@@ -0,0 +1,263 @@
+import math
+
+import numpy as np
+
+
+#
+# GridProjection - point scale, elevation and combined factors for arrays of grid coordinates
+#
+# Lambert Conformal Conic and Transverse Mercator grids (state plane, UTM) are
+# conformal, so a grid distance is the ellipsoid distance times the point scale
+# factor k, and the ellipsoid distance is the ground distance times the
+# elevation factor R / (R + h). The combined factor k * R / (R + h) converts
+# ground distances to grid distances at a point.
+#
+# Grid coordinates are inverted to latitudes and longitudes with the ellipsoid
+# formulas from Snyder, Map Projections - A Working Manual (USGS PP 1395),
+# sections 8 and 15. Everything works on whole numpy arrays.
+#
+# Ground coordinates are scaled about the transform's project origin O -
+#   grid = O + (ground - O) * CF(grid) / CF(O)
+# where the ground coordinates have already been similarity transformed, so the
+# fitted transform scale carries the combined factor at the origin and only the
+# change in the factor across the project is applied per point.
+#
+
+LCC = 'Lambert_Conformal_Conic'
+TM = 'Transverse_Mercator'
+
+# Coordinate modes for the PNEZD tools
+GRID = 'GRID'
+GROUND = 'GROUND'
+
+# Esri projection names handled as LCC and TM
+PROJECTION_NAMES = {
+    'LAMBERT_CONFORMAL_CONIC': LCC,
+    'LAMBERT_CONFORMAL_CONIC_2SP': LCC,
+    'LAMBERT_CONFORMAL_CONIC_1SP': LCC,
+    'TRANSVERSE_MERCATOR': TM,
+    'GAUSS_KRUGER': TM,
+}
+
+# Iteration limit and tolerance (radians) for the LCC latitude
+LATITUDE_ITERATIONS = 10
+LATITUDE_TOLERANCE = 1e-12
+
+# Iterations of the ground to grid conversion, the combined factor is evaluated at the grid position
+GROUND_ITERATIONS = 3
+
+
+class ScaleFactorError(Exception):
+    pass
+
+
+class GridProjection(object):
+    """ Conformal grid (LCC or TM) on an ellipsoid.
+        :param kind: LCC or TM
+        :param a: ellipsoid semi-major axis (meters)
+        :param f: ellipsoid flattening
+        :param central_meridian: longitude of origin (degrees)
+        :param latitude_of_origin: latitude of origin (degrees)
+        :param scale_factor: scale factor on the central meridian (TM) or standard parallels (LCC)
+        :param false_easting: false easting (grid units)
+        :param false_northing: false northing (grid units)
+        :param parallels: (standard parallel 1, standard parallel 2) in degrees for LCC
+        :param meters_per_unit: grid linear unit
+
+    """
+
+    def __init__(self, kind, a, f, central_meridian, latitude_of_origin, scale_factor=1.0,
+                 false_easting=0.0, false_northing=0.0, parallels=None, meters_per_unit=1.0):
+        if kind not in (LCC, TM):
+            raise ScaleFactorError('Unsupported projection: %s' % kind)
+        self.kind = kind
+        self.a = float(a)
+        self.f = float(f)
+        self.e2 = f * (2.0 - f)
+        self.e = math.sqrt(self.e2)
+        self.lon0 = math.radians(central_meridian)
+        self.lat0 = math.radians(latitude_of_origin)
+        self.k0 = float(scale_factor) or 1.0
+        self.false_easting = float(false_easting)
+        self.false_northing = float(false_northing)
+        self.meters_per_unit = float(meters_per_unit)
+
+        if kind == LCC:
+            lat1, lat2 = (math.radians(p) for p in (parallels or (latitude_of_origin, latitude_of_origin)))
+            m1, m2 = self._m(lat1), self._m(lat2)
+            t1, t2 = self._t(lat1), self._t(lat2)
+            if abs(lat1 - lat2) < 1e-12:
+                self.n = math.sin(lat1)
+            else:
+                self.n = (math.log(m1) - math.log(m2)) / (math.log(t1) - math.log(t2))
+            self.F = m1 / (self.n * t1 ** self.n)
+            self.rho0 = self.a * self.F * self.k0 * self._t(self.lat0) ** self.n
+        else:
+            self.ep2 = self.e2 / (1.0 - self.e2)
+            self.M0 = self._meridian(self.lat0)
+
+    @classmethod
+    def from_spatial_reference(cls, sr):
+        # GridProjection for a projected arcpy spatial reference
+        name = str(getattr(sr, 'projectionName', '') or '').upper()
+        if name not in PROJECTION_NAMES:
+            raise ScaleFactorError('Scale factors need a Lambert Conformal Conic or Transverse Mercator '
+                                   'coordinate system: %s' % (getattr(sr, 'name', None) or name or 'Unknown'))
+        kind = PROJECTION_NAMES[name]
+        gcs = sr.GCS
+        parallels = None
+        if kind == LCC:
+            parallels = (sr.standardParallel1, getattr(sr, 'standardParallel2', None) or sr.standardParallel1)
+        return cls(kind, gcs.semiMajorAxis, gcs.flattening, sr.centralMeridian,
+                   getattr(sr, 'latitudeOfOrigin', 0.0) or 0.0, getattr(sr, 'scaleFactor', 1.0) or 1.0,
+                   sr.falseEasting, sr.falseNorthing, parallels, sr.metersPerUnit)
+
+    def _m(self, lat):
+        return np.cos(lat) / np.sqrt(1.0 - self.e2 * np.sin(lat) ** 2)
+
+    def _t(self, lat):
+        es = self.e * np.sin(lat)
+        return np.tan(np.pi / 4.0 - lat / 2.0) / ((1.0 - es) / (1.0 + es)) ** (self.e / 2.0)
+
+    def _meridian(self, lat):
+        # Meridian arc length from the equator (meters)
+        e2 = self.e2
+        e4, e6 = e2 * e2, e2 * e2 * e2
+        return self.a * ((1 - e2 / 4 - 3 * e4 / 64 - 5 * e6 / 256) * lat -
+                         (3 * e2 / 8 + 3 * e4 / 32 + 45 * e6 / 1024) * np.sin(2 * lat) +
+                         (15 * e4 / 256 + 45 * e6 / 1024) * np.sin(4 * lat) -
+                         (35 * e6 / 3072) * np.sin(6 * lat))
+
+    def _meters(self, x, y):
+        # Grid coordinates to meters from the false origin
+        x = (np.asarray(x, dtype=np.float64) - self.false_easting) * self.meters_per_unit
+        y = (np.asarray(y, dtype=np.float64) - self.false_northing) * self.meters_per_unit
+        return x, y
+
+    def _lcc(self, x, y):
+        # Latitude, longitude (radians) and rho for LCC grid meters
+        n = self.n
+        dy = self.rho0 - y
+        rho = np.copysign(np.hypot(x, dy), n)
+        theta = np.arctan2(x * np.sign(n), dy * np.sign(n))
+        t = (rho / (self.a * self.F * self.k0)) ** (1.0 / n)
+
+        lat = np.pi / 2.0 - 2.0 * np.arctan(t)
+        for _ in range(LATITUDE_ITERATIONS):
+            es = self.e * np.sin(lat)
+            update = np.pi / 2.0 - 2.0 * np.arctan(t * ((1.0 - es) / (1.0 + es)) ** (self.e / 2.0))
+            step = np.abs(update - lat).max() if lat.size else 0.0
+            lat = update
+            if step < LATITUDE_TOLERANCE:
+                break
+        return lat, self.lon0 + theta / n, rho
+
+    def _tm(self, x, y):
+        # Latitude, longitude (radians) for TM grid meters, Snyder 8-18 to 8-25
+        e2, ep2, k0 = self.e2, self.ep2, self.k0
+        mu = (self.M0 + y / k0) / (self.a * (1 - e2 / 4 - 3 * e2 ** 2 / 64 - 5 * e2 ** 3 / 256))
+        e1 = (1 - math.sqrt(1 - e2)) / (1 + math.sqrt(1 - e2))
+        lat1 = (mu + (3 * e1 / 2 - 27 * e1 ** 3 / 32) * np.sin(2 * mu) +
+                (21 * e1 ** 2 / 16 - 55 * e1 ** 4 / 32) * np.sin(4 * mu) +
+                (151 * e1 ** 3 / 96) * np.sin(6 * mu) +
+                (1097 * e1 ** 4 / 512) * np.sin(8 * mu))
+
+        sin1, cos1, tan1 = np.sin(lat1), np.cos(lat1), np.tan(lat1)
+        C1 = ep2 * cos1 ** 2
+        T1 = tan1 ** 2
+        w = 1 - e2 * sin1 ** 2
+        N1 = self.a / np.sqrt(w)
+        R1 = self.a * (1 - e2) / w ** 1.5
+        D = x / (N1 * k0)
+        D2 = D * D
+
+        lat = lat1 - (N1 * tan1 / R1) * D2 * (
+            1 / 2 - (5 + 3 * T1 + 10 * C1 - 4 * C1 ** 2 - 9 * ep2) * D2 / 24 +
+            (61 + 90 * T1 + 298 * C1 + 45 * T1 ** 2 - 252 * ep2 - 3 * C1 ** 2) * D2 * D2 / 720)
+        lon = self.lon0 + D * (
+            1 - (1 + 2 * T1 + C1) * D2 / 6 +
+            (5 - 2 * C1 + 28 * T1 - 3 * C1 ** 2 + 8 * ep2 + 24 * T1 ** 2) * D2 * D2 / 120) / cos1
+        return lat, lon
+
+    def geographic(self, x, y):
+        """ Latitudes and longitudes of arrays of grid coordinates.
+            :return: (lon, lat) in degrees
+        """
+        x, y = self._meters(x, y)
+        lat, lon = (self._lcc(x, y) if self.kind == LCC else self._tm(x, y))[:2]
+        return np.degrees(lon), np.degrees(lat)
+
+    def _scale(self, x, y):
+        # Point scale factor and latitude (radians) for grid meters
+        if self.kind == LCC:
+            lat, _, rho = self._lcc(x, y)
+            return rho * self.n / (self.a * self._m(lat)), lat
+
+        # Snyder 8-11
+        lat, lon = self._tm(x, y)
+        cos = np.cos(lat)
+        C = self.ep2 * cos ** 2
+        T = np.tan(lat) ** 2
+        A2 = ((lon - self.lon0) * cos) ** 2
+        k = self.k0 * (1 + (1 + C) * A2 / 2 +
+                       (5 - 4 * T + 42 * C + 13 * C ** 2 - 28 * self.ep2) * A2 * A2 / 24 +
+                       (61 - 148 * T + 16 * T ** 2) * A2 ** 3 / 720)
+        return k, lat
+
+    def point_scale(self, x, y):
+        """ Point scale factor k at arrays of grid coordinates. """
+        return self._scale(*self._meters(x, y))[0]
+
+    def radius(self, lat):
+        # Gaussian mean radius of curvature sqrt(M * N) at latitudes (radians), meters
+        w = 1.0 - self.e2 * np.sin(lat) ** 2
+        return self.a * np.sqrt(1.0 - self.e2) / w
+
+    def elevation_factor(self, x, y, z, geoid_height=0.0):
+        """ Elevation factor R / (R + h) at arrays of grid coordinates.
+            :param z: orthometric heights (grid units)
+            :param geoid_height: geoid height N (meters), h = H + N
+
+        """
+        lon, lat = self.geographic(x, y)
+        R = self.radius(np.radians(lat))
+        h = np.asarray(z, dtype=np.float64) * self.meters_per_unit + geoid_height
+        return R / (R + h)
+
+    def combined_factor(self, x, y, z, geoid_height=0.0):
+        """ Combined (ground to grid) factor, the point scale times the elevation factor. """
+        k, lat = self._scale(*self._meters(x, y))
+        R = self.radius(lat)
+        h = np.asarray(z, dtype=np.float64) * self.meters_per_unit + geoid_height
+        return k * R / (R + h)
+
+
+def ground_to_grid(xy, z, origin, projection, elevation=0.0, geoid_height=0.0):
+    """ Scale similarity transformed ground coordinates to grid coordinates about the origin.
+        :param xy: array of coordinates (shape: n, 2)
+        :param z: array of elevations (grid units)
+        :param origin: project origin (grid coordinates)
+        :param projection: GridProjection for the grid
+        :param elevation: project elevation the transform scale was fitted at (grid units)
+        :param geoid_height: geoid height (meters)
+        :return: array of grid coordinates (shape: n, 2)
+
+    """
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    origin = np.asarray(origin, dtype=np.float64)
+    cf0 = projection.combined_factor(origin[0], origin[1], elevation, geoid_height)
+    offset = xy - origin
+    grid = xy
+    for _ in range(GROUND_ITERATIONS):
+        cf = projection.combined_factor(grid[:, 0], grid[:, 1], z, geoid_height)
+        grid = origin + offset * (cf / cf0)[:, None]
+    return grid
+
+
+def grid_to_ground(xy, z, origin, projection, elevation=0.0, geoid_height=0.0):
+    """ Scale grid coordinates to (similarity transformed) ground coordinates, see ground_to_grid. """
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    origin = np.asarray(origin, dtype=np.float64)
+    cf0 = projection.combined_factor(origin[0], origin[1], elevation, geoid_height)
+    cf = projection.combined_factor(xy[:, 0], xy[:, 1], z, geoid_height)
+    return origin + (xy - origin) * (cf0 / cf)[:, None]
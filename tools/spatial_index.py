@@ -0,0 +1,118 @@
+import numpy as np
+
+
+#
+# GridIndex - uniform grid spatial index for point sets
+#
+# Points are bucketed into square cells and sorted on the cell key. Queries
+# look up the neighbouring cells and expand the matching runs into candidate
+# pairs, all vectorized over the query points. When the grid has few enough
+# cells the start of every cell's run is tabulated once, and a lookup is a
+# gather from the table, otherwise the runs are found with searchsorted.
+#
+
+# Largest number of grid cells with a table of run starts (8 bytes per cell)
+DENSE_CELLS = 1 << 22
+
+
+class GridIndex(object):
+
+    def __init__(self, xy, cell_size):
+        self.xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        self.cell_size = float(cell_size)
+        if self.cell_size <= 0.0:
+            raise ValueError('Bad cell size: %s' % cell_size)
+
+        if len(self.xy):
+            self.origin = self.xy.min(axis=0)
+            cells = self._cells(self.xy)
+            self.shape = cells.max(axis=0) + 1
+        else:
+            self.origin = np.zeros(2)
+            cells = np.zeros((0, 2), dtype=np.int64)
+            self.shape = np.ones(2, dtype=np.int64)
+
+        keys = cells[:, 0] * self.shape[1] + cells[:, 1]
+        self.order = np.argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+
+        # Start of each cell's run of points, the run of cell k is starts[k]:starts[k + 1]
+        self.starts = None
+        cell_count = int(self.shape[0]) * int(self.shape[1])
+        if cell_count <= DENSE_CELLS:
+            self.starts = np.zeros(cell_count + 1, dtype=np.int64)
+            np.cumsum(np.bincount(keys, minlength=cell_count), out=self.starts[1:])
+
+    def __len__(self):
+        return len(self.xy)
+
+    def _cells(self, xy):
+        return np.floor((xy - self.origin) / self.cell_size).astype(np.int64)
+
+    def candidates(self, xy, radius):
+        # Index pairs (query, point) for all points in cells within radius of the query points
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        reach = int(np.ceil(radius / self.cell_size))
+        nx, ny = self.shape
+
+        # Visit the queries in cell key order, neighbouring cell keys are then
+        # also sorted which keeps the searchsorted lookups cache friendly
+        cells = self._cells(xy)
+        order = np.argsort(cells[:, 0] * ny + cells[:, 1], kind='stable')
+        cells = cells[order]
+
+        query, point = [], []
+        for dx in range(-reach, reach + 1):
+            cx = cells[:, 0] + dx
+            for dy in range(-reach, reach + 1):
+                cy = cells[:, 1] + dy
+                q = np.flatnonzero((cx >= 0) & (cx < nx) & (cy >= 0) & (cy < ny))
+                keys = cx[q] * ny + cy[q]
+                if self.starts is not None:
+                    start = self.starts[keys]
+                    counts = self.starts[keys + 1] - start
+                else:
+                    start = np.searchsorted(self.keys, keys, side='left')
+                    counts = np.searchsorted(self.keys, keys, side='right') - start
+
+                hit = counts > 0
+                q, start, counts = q[hit], start[hit], counts[hit]
+                if len(q) == 0:
+                    continue
+
+                # Expand each run of matching keys into individual pairs
+                offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+                query.append(order[np.repeat(q, counts)])
+                point.append(self.order[np.repeat(start, counts) + offsets])
+
+        if not query:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate(query), np.concatenate(point)
+
+    def within(self, xy, radius):
+        # All (query, point, distance) within radius of the query points
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        query, point = self.candidates(xy, radius)
+        d = np.hypot(*(xy[query] - self.xy[point]).T)
+        keep = d <= radius
+        return query[keep], point[keep], d[keep]
+
+    def nearest(self, xy, radius):
+        # Nearest point within radius of each query point, index -1 where there is none
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        index = np.full(len(xy), -1, dtype=np.int64)
+        dist = np.full(len(xy), np.inf)
+
+        # Smallest distance per query with an unbuffered minimum, no sort of the pairs
+        query, point, d = self.within(xy, radius)
+        np.minimum.at(dist, query, d)
+        closest = d == dist[query]
+        index[query[closest]] = point[closest]
+
+        return index, dist
+
+    def pairs(self, radius):
+        # All pairs of indexed points (i < j) within radius of each other
+        i, j, d = self.within(self.xy, radius)
+        keep = i < j
+        return i[keep], j[keep], d[keep]
@@ -0,0 +1,199 @@
+from tools.backend import BACKEND, arcpy
+import contextvars
+import functools
+import json
+import logging
+import os
+import time
+
+
+#
+# Timing - wall time of the tool stages, reported in the tool messages
+#
+# Set TRANSFORM_TOOLS_TIMING=1 to report where a tool spends its time. Stages are
+# wrapped in spans, either with the span context manager or the timed decorator -
+#
+#   @timing.timed('Import PNEZD')
+#   def import_pnezd(...):
+#       with timing.span('parse') as s:
+#           ...
+#           s.rows = len(points)
+#
+# The outermost span is the tool run. When it ends the wall time of every stage,
+# with its rows and rows/sec, is written with arcpy.AddMessage, or logged outside
+# ArcGIS Pro. Set TRANSFORM_TOOLS_TRACE to a file name to also append each run to
+# it as a line of JSON. With neither variable set a span is a shared object that
+# does nothing, so the instrumented code runs at full speed. The active run is held
+# per thread (context), so tools run side by side by the folder watcher each report
+# their own stages.
+#
+
+TIMING_VARIABLE = 'TRANSFORM_TOOLS_TIMING'
+
+TRACE_VARIABLE = 'TRANSFORM_TOOLS_TRACE'
+
+log = logging.getLogger('transform_tools.timing')
+
+# Run being timed in this context, None when no run is active
+_run = contextvars.ContextVar('transform_tools_timing_run', default=None)
+
+
+def timing_enabled():
+    return (os.environ.get(TIMING_VARIABLE, '').lower() in ('1', 'true', 'yes')
+            or bool(os.environ.get(TRACE_VARIABLE)))
+
+
+class NullSpan(object):
+    """ Span used when timing is disabled. """
+
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span(object):
+    """ A timed stage, set rows to the number of rows the stage handled. """
+
+    def __init__(self, run, stage, rows=None):
+        self.run = run
+        self.stage = stage
+        self.rows = rows
+        self.depth = 0
+        self.start = 0.0
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self.depth = self.run.depth
+        self.run.depth += 1
+        self.run.spans.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        self.run.depth -= 1
+        return False
+
+    def rate(self):
+        # Rows per second, None without rows
+        if self.rows is None or self.elapsed <= 0.0:
+            return None
+        return self.rows / self.elapsed
+
+    def as_dict(self):
+        start = None if self.start is None else self.start - self.run.started
+        return {'stage': self.stage, 'depth': self.depth, 'start': start, 'elapsed': self.elapsed,
+                'rows': self.rows, 'rows_per_sec': self.rate()}
+
+
+class Run(object):
+    """ The spans of one tool run. """
+
+    def __init__(self, tool):
+        self.tool = tool
+        self.spans = []
+        self.depth = 0
+        self.started = time.perf_counter()
+        self.timestamp = time.time()
+
+    def as_dict(self):
+        return {'tool': self.tool, 'timestamp': self.timestamp, 'backend': BACKEND,
+                'spans': [s.as_dict() for s in self.spans]}
+
+    def lines(self):
+        # Report lines, stages indented under the span they ran in
+        lines = []
+        for s in self.spans:
+            line = '%-40s %10.3f s' % ('  ' * s.depth + s.stage, s.elapsed)
+            if s.rows is not None:
+                line += ' %12d rows' % s.rows
+                if s.rate():
+                    line += ' %14.0f rows/s' % s.rate()
+            lines.append(line)
+        return lines
+
+    def report(self):
+        for line in self.lines():
+            if BACKEND == 'memory':
+                log.info(line)
+            else:
+                arcpy.AddMessage(line)
+
+        trace_file = os.environ.get(TRACE_VARIABLE)
+        if trace_file:
+            with open(trace_file, 'a') as f:
+                f.write(json.dumps(self.as_dict()) + '\n')
+
+
+class RunSpan(Span):
+    """ Outermost span, reports the run when it ends. """
+
+    def __init__(self, run, stage, rows=None):
+        Span.__init__(self, run, stage, rows)
+        self.token = None
+
+    def __enter__(self):
+        self.token = _run.set(self.run)
+        return Span.__enter__(self)
+
+    def __exit__(self, *exc):
+        Span.__exit__(self, *exc)
+        _run.reset(self.token)
+        self.run.report()
+        return False
+
+
+def span(stage, rows=None):
+    """ Context manager timing a stage of the active run.
+        Outside a run it starts one if timing is enabled, otherwise it does nothing.
+
+    """
+    run = _run.get()
+    if run is not None:
+        return Span(run, stage, rows)
+    if not timing_enabled():
+        return NULL_SPAN
+    return RunSpan(Run(stage), stage, rows)
+
+
+def add_stages(stages):
+    """ Add stages timed elsewhere, such as in worker processes, to the active run.
+        :param stages: (stage, seconds, rows) tuples, stages with the same name are summed
+            into one span at the current depth with no start time. Stages from parallel
+            workers can add up to more than the wall time of the span they ran in.
+
+    """
+    run = _run.get()
+    if run is None:
+        return
+    totals = {}
+    for stage, seconds, rows in stages:
+        s = totals.get(stage)
+        if s is None:
+            s = totals[stage] = Span(run, stage)
+            s.depth, s.start = run.depth, None
+            run.spans.append(s)
+        s.elapsed += seconds
+        if rows is not None:
+            s.rows = (s.rows or 0) + rows
+
+
+def timed(stage):
+    # Decorator timing every call of a function as a stage
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
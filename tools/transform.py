@@ -1,11 +1,12 @@
-import arcpy
-
 import math
 import numpy as np
 import numpy.linalg as npla
 
 from datetime import datetime
 
+from tools import geodesic
+from tools.rubber_sheet import TIN, build_correction, parse_correction
+
 
 class MirroredTransformError(Exception):
     pass
@@ -38,11 +39,25 @@ class Transform:
         R = numpy.array([[a1, -b1], [b1, a1]])
         t = numpy.array([a0, b0])
 
+        An optional residual correction (tools.rubber_sheet) is added to the similarity
+        transformed coordinates in the forward direction and removed before the inverse
+        similarity transform.
+
+        The project origin is the (weighted) centroid of the link targets, the point the
+        transform scale is fitted about. Ground coordinate conversions (tools.scale_factor)
+        scale about it.
+
+        The parameter covariance is the 4x4 covariance of (a0, b0, a1, b1) from the least
+        squares fit, None when the links have no redundancy.
+
     """
 
-    def __init__(self, R=None, t=None):
+    def __init__(self, R=None, t=None, correction=None, origin=None, covariance=None):
         self.R = R if R is not None else np.identity(2)
         self.t = t if t is not None else np.zeros(2)
+        self.correction = correction
+        self.origin = origin
+        self.covariance = covariance
 
     def translation(self):
         # Get the transform displacement (translation)
@@ -61,36 +76,168 @@ class Transform:
         k = math.sqrt(a1**2 + b1**2)
         return k
 
+    def similarity(self):
+        # The similarity transform without the residual correction
+        return Transform(self.R, self.t)
+
     def forward(self, pt):
         # Forward transform of point coordinates (x, y)
+        if self.correction is not None:
+            x, y = self.forward_points([pt])[0]
+            return x, y
         x, y = (self.t + self.R.dot(pt)).flat
         return x, y
 
     def inverse(self, pt):
         # Inverse transform of point coordinates (x, y)
+        if self.correction is not None:
+            x, y = self.inverse_points([pt])[0]
+            return x, y
         x, y = npla.inv(self.R).dot(np.array(pt) - self.t).flat
         return x, y
 
+    def forward_points(self, pts):
+        # Forward transform of an array of point coordinates (shape: n, 2)
+        pts = self.t + np.asarray(pts, dtype=np.float64).reshape(-1, 2).dot(self.R.T)
+        if self.correction is not None:
+            pts = self.correction.apply(pts)
+        return pts
+
+    def inverse_points(self, pts):
+        # Inverse transform of an array of point coordinates (shape: n, 2)
+        pts = np.asarray(pts, dtype=np.float64).reshape(-1, 2)
+        if self.correction is not None:
+            pts = self.correction.remove(pts)
+        return (pts - self.t).dot(npla.inv(self.R).T)
+
     def save(self, outfile):
         # Save transform parameters to a text file
         # A single line should have the comma-separated values for a0,b0,a1,b1
+        # The residual correction follows as comment lines, so readers that only
+        # know the four parameters still load the similarity transform.
         header = ''
         header += 'Similarity transform paramerters a0, b0, a1, b1\n'
         header += 'Created %s\n' % datetime.now().strftime('%c')
+        lines = []
+        if self.origin is not None:
+            lines.append('origin %.6f %.6f' % tuple(self.origin))
+        if self.covariance is not None:
+            lines.append('covariance ' + ' '.join('%.12e' % v for v in self.covariance.flat))
+        if self.correction is not None:
+            lines += self.correction.lines()
+        footer = '\n'.join(lines)
         params = np.hstack((self.t, self.R[:, 0]))
-        np.savetxt(outfile, params, header=header)
+        np.savetxt(outfile, params, header=header, footer=footer)
 
     def load(self, infile):
         # Load transform parameters from a text file
         a0, b0, a1, b1 = np.loadtxt(infile).flat
         self.R = np.array([[a1, -b1], [b1, a1]])
         self.t = np.array([a0, b0])
+        with open(infile) as f:
+            comments = [line.lstrip('#').strip() for line in f if line.startswith('#')]
+        self.correction = parse_correction(comments)
+        self.origin = None
+        self.covariance = None
+        for line in comments:
+            if line.startswith('origin '):
+                self.origin = np.array([float(v) for v in line.split()[1:3]])
+            elif line.startswith('covariance '):
+                self.covariance = np.array([float(v) for v in line.split()[1:17]]).reshape(4, 4)
+
+    def point_covariance(self, pts, inverse=False):
+        # Covariances (shape: n, 2, 2) of transformed points from the parameter covariance.
+        # Points are source coordinates, the propagation is through the inverse transform
+        # to source coordinates with inverse=True. The residual correction is not included.
+        x, y = np.asarray(pts, dtype=np.float64).reshape(-1, 2).T
+        C = self.covariance
+        # Jacobian of (x1, y1) with respect to (a0, b0, a1, b1) is [[1, 0, x, -y], [0, 1, y, x]]
+        cx = C[0] + np.outer(x, C[2]) - np.outer(y, C[3])
+        cy = C[1] + np.outer(y, C[2]) + np.outer(x, C[3])
+        cov = np.empty((len(x), 2, 2))
+        cov[:, 0, 0] = cx[:, 0] + x * cx[:, 2] - y * cx[:, 3]
+        cov[:, 1, 1] = cy[:, 1] + y * cy[:, 2] + x * cy[:, 3]
+        cov[:, 0, 1] = cov[:, 1, 0] = cx[:, 1] + y * cx[:, 2] + x * cx[:, 3]
+        if inverse:
+            Rinv = npla.inv(self.R)
+            cov = np.einsum('ij,njk,lk->nil', Rinv, cov, Rinv)
+        return cov
+
+
+def error_ellipses(cov):
+    """ Standard error ellipses for an array of 2x2 covariances.
+        :param cov: covariances (shape: n, 2, 2)
+        :return: (semi_major, semi_minor, orientation) arrays, the orientation of the semi-major
+            axis in degrees clockwise from grid north, [0, 180)
+
+    """
+    sxx, syy, sxy = cov[:, 0, 0], cov[:, 1, 1], cov[:, 0, 1]
+    mean = (sxx + syy) / 2
+    radius = np.hypot((sxx - syy) / 2, sxy)
+    semi_major = np.sqrt(mean + radius)
+    semi_minor = np.sqrt(np.maximum(mean - radius, 0.0))
+    orientation = (90.0 - np.degrees(np.arctan2(2 * sxy, sxx - syy) / 2)) % 180.0
+    return semi_major, semi_minor, orientation
+
+
+def parameter_covariance(src, dst, weights, R, t, free):
+    """ Covariance of the transform parameters (a0, b0, a1, b1).
+        :param src, dst: link source and target points (shape: n, 2)
+        :param weights: scalar (shape: n) or 2x2 (shape: n, 2, 2) link weights
+        :param R, t: fitted rotation matrix and translation
+        :param free: the fitted parameters, 'translation', 'rotation' (and translation) or 'all'
+        :return: 4x4 covariance scaled by the a posteriori variance of unit weight, None without redundancy
+
+    """
+    n = len(src)
+    a1, b1 = R[:, 0]
+    # Free parameters to (a0, b0, a1, b1), a rotation moves (a1, b1) along (-b1, a1)
+    P = {'translation': np.eye(4)[:, :2],
+         'rotation': np.column_stack((np.eye(4)[:, :2], [0, 0, -b1, a1])),
+         'all': np.eye(4)}[free]
+    k = P.shape[1]
+    if 2 * n <= k:
+        return None
+    if weights.ndim == 1:
+        weights = weights[:, None, None] * np.eye(2)
+    A = np.zeros((n, 2, 4))
+    A[:, 0, 0] = A[:, 1, 1] = 1.0
+    A[:, 0, 2], A[:, 0, 3] = src[:, 0], -src[:, 1]
+    A[:, 1, 2], A[:, 1, 3] = src[:, 1], src[:, 0]
+    J = A.dot(P)
+    N = np.einsum('nki,nkl,nlj->ij', J, weights, J)
+    r = dst - src.dot(R.T) - t
+    variance = np.einsum('ni,nij,nj->', r, weights, r) / (2 * n - k)
+    return variance * P.dot(npla.inv(N)).dot(P.T)
+
+
+def _refine_rotation(src, dst, weights, R, scale, iterations=5):
+    # Rotation and translation of a fixed scale transform for centered points with 2x2 weight matrices,
+    # by Gauss-Newton from the rotation R
+    theta = math.atan2(R[1, 0], R[0, 0])
+    t = np.zeros(2)
+    J = np.zeros((len(src), 2, 3))
+    J[:, :, 1:] = np.eye(2)
+    for _ in range(iterations):
+        c, s = math.cos(theta) * scale, math.sin(theta) * scale
+        R = np.array([[c, -s], [s, c]])
+        r = dst - src.dot(R.T) - t
+        J[:, :, 0] = src.dot(np.array([[-s, -c], [c, -s]]).T)
+        N = np.einsum('nki,nkl,nlj->ij', J, weights, J)
+        d = npla.solve(N, np.einsum('nki,nkl,nl->i', J, weights, r))
+        theta += d[0]
+        t += d[1:]
+        if abs(d[0]) < 1e-12:
+            break
+    c, s = math.cos(theta) * scale, math.sin(theta) * scale
+    return np.array([[c, -s], [s, c]]), t
 
 
 def calculate_transform(links, weights=None, rotate=None, scale=None):
     """ Initialize a new local-to-grid transform.
         :param links: list of displacement links
-        :param weights: list of weights for corresponding links, defaults to equal weights
+        :param weights: list of weights for corresponding links, defaults to equal weights. A weight
+            is a scalar or a 2x2 weight matrix (the inverse of the link's x/y covariance)
         :param rotate: rotation for the transform in degrees, default 0.0
         :param scale: scale factor for the transform, default 1.0
         :return: a Transform object
@@ -125,6 +272,10 @@ def calculate_transform(links, weights=None, rotate=None, scale=None):
         (4) If neither rotate nor scale are provided then a least squares Conformal transform
         is used to calculate all four transform parameters.
 
+        With 2x2 weight matrices the centroids are the matrix weighted means, case (3) is refined
+        from the SVD rotation by Gauss-Newton and case (4) uses the block diagonal weight matrix.
+        The normal equations are accumulated link by link, the (2*n, 2*n) matrix is never built.
+
         Final rotation matrix and translation vector are returned as -
 
         R = numpy.array([[a1, -b1], [b1, a1]])
@@ -138,7 +289,13 @@ def calculate_transform(links, weights=None, rotate=None, scale=None):
         weights = np.ones(n, dtype=np.float64)
     else:
         assert len(weights) == n
-        weights = np.array([w[1] for w in weights], dtype=np.float64)
+        weights = [w[1] for w in weights]
+        if any(np.ndim(w) == 2 for w in weights):
+            # 2x2 weight matrices (shape: n, 2, 2), scalar weights as w * I
+            weights = np.array([w * np.eye(2) if np.ndim(w) == 0 else w for w in weights], dtype=np.float64)
+        else:
+            weights = np.array(weights, dtype=np.float64)
+    blocks = weights.ndim == 3
 
     transform_type = ''
 
@@ -146,9 +303,17 @@ def calculate_transform(links, weights=None, rotate=None, scale=None):
     src = np.array([p[1] for p in links], dtype=np.float64)
     dst = np.array([p[2] for p in links], dtype=np.float64)
 
+    # The cases below center and reshape src and dst, the links are kept for the parameter covariance
+    points = src, dst
+
     # centroid coordinates (shape: 2,)
-    centroid_src = np.average(src, weights=weights, axis=0)
-    centroid_dst = np.average(dst, weights=weights, axis=0)
+    if blocks:
+        weight_sum = weights.sum(axis=0)
+        centroid_src = npla.solve(weight_sum, np.einsum('nij,nj->i', weights, src))
+        centroid_dst = npla.solve(weight_sum, np.einsum('nij,nj->i', weights, dst))
+    else:
+        centroid_src = np.average(src, weights=weights, axis=0)
+        centroid_dst = np.average(dst, weights=weights, axis=0)
 
     if n == 1 or rotate is not None:
         # Single link and multiple link cases (1) and (2)
@@ -158,21 +323,27 @@ def calculate_transform(links, weights=None, rotate=None, scale=None):
             scale = 1.0
 
         transform_type = 'Rotate/Scale/Translate'
+        free = 'translation'
 
         a1 = math.cos(math.radians(rotate)) * scale
         b1 = math.sin(math.radians(rotate)) * scale
         R = np.array([[a1, -b1], [b1, a1]])
-        t = centroid_dst - R.dot(centroid_src)
+        if blocks:
+            t = npla.solve(weight_sum, np.einsum('nij,nj->i', weights, dst - src.dot(R.T)))
+        else:
+            t = centroid_dst - R.dot(centroid_src)
 
     elif scale is not None:
         # Multiple link case (3)
         transform_type = 'SVD'
+        free = 'rotation'
 
         # Center the points.
         src = (src - np.tile(centroid_src, (n, 1)))
         dst = dst - np.tile(centroid_dst, (n, 1))
 
-        H = src.T.dot(np.diag(weights)).dot(dst)
+        # Weight matrices enter the SVD by their mean diagonal
+        H = (src.T * (np.trace(weights, axis1=1, axis2=2) / 2 if blocks else weights)).dot(dst)
         U, S, Vt = npla.svd(H)
         R = Vt.T.dot(U.T)
 
@@ -180,7 +351,10 @@ def calculate_transform(links, weights=None, rotate=None, scale=None):
             raise MirroredTransformError()
 
         R = R * scale
-        t = centroid_dst - R.dot(centroid_src)
+        t = np.zeros(2)
+        if blocks:
+            R, t = _refine_rotation(src, dst, weights, R, scale)
+        t = t + centroid_dst - R.dot(centroid_src)
 
     else:
         # Case (4)
@@ -197,13 +371,15 @@ def calculate_transform(links, weights=None, rotate=None, scale=None):
         #   x = inv(A'*W*A)*A'*W*b
 
         transform_type = 'Conformal'
+        free = 'all'
 
         # Design matrix A shape (2*n, 4).
         src = src.dot([[1, 0, 0, 1], [0, -1, 1, 0]]).reshape(n * 2, 2)
         A = np.concatenate((np.tile([[1, 0], [0, 1]], (n, 1)), src), axis=1)
 
-        # Weighting matrix W shape (2*n, 2*n).
-        W = np.diag(weights.repeat(2))
+        # Diagonal of the weighting matrix W shape (2*n,), applied by broadcasting
+        # rather than building the dense (2*n, 2*n) matrix.
+        W = None if blocks else weights.repeat(2)
 
         # Observed values b shape (2*n,).
         b = dst.reshape(2 * n)
@@ -215,13 +391,21 @@ def calculate_transform(links, weights=None, rotate=None, scale=None):
 
         # Calculate the transform parameters.
         # x = (A.T * W * A).I * A.T * W * b
-        x = npla.inv(A.T.dot(W).dot(A)).dot(A.T).dot(W).dot(b)
+        if blocks:
+            # Block diagonal W, one 2x2 block per link
+            A = A.reshape(n, 2, 4)
+            N = np.einsum('nki,nkl,nlj->ij', A, weights, A)
+            x = npla.solve(N, np.einsum('nki,nkl,nl->i', A, weights, b.reshape(n, 2)))
+        else:
+            AtW = A.T * W
+            x = npla.inv(AtW.dot(A)).dot(AtW).dot(b)
 
         a0, b0, a1, b1 = x.flat
         R = np.array([[a1, -b1], [b1, a1]])
         t = np.array([a0, b0])
 
-    xfm = Transform(R, t)
+    covariance = parameter_covariance(*points, weights, R, t, free)
+    xfm = Transform(R, t, origin=centroid_dst, covariance=covariance)
     xfm.transform_type = transform_type
 
     if False:
@@ -237,19 +421,96 @@ def calculate_transform(links, weights=None, rotate=None, scale=None):
     return xfm
 
 
+def fit_points(src, dst, rotate=None, scale=None):
+    """ Equal weight transform from arrays of source and destination points (shape: n, 2).
+        :param rotate: rotation for the transform in degrees, default fitted
+        :param scale: scale factor for the transform, default fitted
+        :return: a Transform object without parameter covariance
+
+        The parameters are those of calculate_transform with equal weights, from closed
+        form sums over the centered points rather than the least squares matrices. Used for
+        the repeated refits of link discovery, where the covariance isn't needed.
+
+    """
+    src = np.asarray(src, dtype=np.float64).reshape(-1, 2)
+    dst = np.asarray(dst, dtype=np.float64).reshape(-1, 2)
+    assert len(src) > 0 and len(src) == len(dst)
+
+    centroid_src = src.mean(axis=0)
+    centroid_dst = dst.mean(axis=0)
+
+    if len(src) == 1 or rotate is not None:
+        transform_type = 'Rotate/Scale/Translate'
+        scale = 1.0 if scale is None else scale
+        a1 = math.cos(math.radians(rotate or 0.0)) * scale
+        b1 = math.sin(math.radians(rotate or 0.0)) * scale
+    else:
+        xs, ys = (src - centroid_src).T
+        xd, yd = (dst - centroid_dst).T
+        c = xs.dot(xd) + ys.dot(yd)
+        d = xs.dot(yd) - ys.dot(xd)
+        if scale is not None:
+            # Best rotation at a fixed scale, as the SVD of case (3)
+            transform_type = 'SVD'
+            h = math.hypot(c, d)
+            a1, b1 = scale * c / h, scale * d / h
+        else:
+            transform_type = 'Conformal'
+            ss = xs.dot(xs) + ys.dot(ys)
+            a1, b1 = c / ss, d / ss
+
+    R = np.array([[a1, -b1], [b1, a1]])
+    xfm = Transform(R, centroid_dst - R.dot(centroid_src), origin=centroid_dst)
+    xfm.transform_type = transform_type
+    return xfm
+
+
+def calculate_correction(xfm, links, method=TIN, cell_size=None):
+    """ Residual correction for a similarity transform.
+        :param xfm: similarity Transform calculated from the links
+        :param links: list of displacement links ('name', (x0, y0), (x1, y1))
+        :param method: rubber_sheet.TIN or rubber_sheet.GRID
+        :param cell_size: grid node spacing for GRID, defaults to the mean link spacing
+        :return: a rubber_sheet Correction, None with fewer than three distinct links
+
+        The link residuals, (x1, y1) - forward((x0, y0)), are interpolated over the
+        transformed source points. Set it as xfm.correction to apply it.
+
+    """
+    src = np.array([p[1] for p in links], dtype=np.float64).reshape(-1, 2)
+    dst = np.array([p[2] for p in links], dtype=np.float64).reshape(-1, 2)
+    nodes = xfm.similarity().forward_points(src)
+    return build_correction(nodes, dst - nodes, method=method, cell_size=cell_size)
+
+
 def calculate_errors(xfm, links):
 
     # Transform source points and compare to destination points
     names = [s[0] for s in links]
     src = np.array([p[1] for p in links])
     dst = np.array([p[2] for p in links])
-    errs = [xfm.forward(p) for p in src] - dst
-    errs = np.array([math.sqrt(d[0]**2 + d[1]**2) for d in errs])
+    errs = np.hypot(*(xfm.forward_points(src) - dst).T)
     rms = np.sqrt(np.mean(errs**2))
 
     return zip(names, errs), rms
 
 
+def geodesic_errors(xfm, links, geographic, a=geodesic.WGS84_A, f=geodesic.WGS84_F):
+    """ Link residuals as ellipsoid distances.
+        :param geographic: function (x, y) -> (lon, lat) taking target coordinate arrays, e.g.
+            scale_factor.GridProjection.geographic
+        :param a: ellipsoid semi-major axis (meters)
+        :param f: ellipsoid flattening
+        :return: array of residuals in meters
+
+    """
+    src = np.array([p[1] for p in links], dtype=np.float64)
+    dst = np.array([p[2] for p in links], dtype=np.float64)
+    lon1, lat1 = geographic(*xfm.forward_points(src).T)
+    lon2, lat2 = geographic(*dst.T)
+    return geodesic.distance(lon1, lat1, lon2, lat2, a, f)
+
+
 if __name__ == "__main__":
 
     from tools.pnezd_link import pnezd_link
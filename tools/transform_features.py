@@ -1,14 +1,93 @@
-import arcpy
-import arcpy.management as mgmt
+from tools.backend import arcpy, mgmt
 
-from tools.transform import Transform
+from tools.feature_store import ELLIPSE_FIELDS, open_store
+import tools.registry as registry
+import tools.timing as timing
+from tools.transform import Transform, error_ellipses
 
 
 #
 # TransformFeatures - transform feature classes
 #
 
-def transform_features(input_fc, param_file, direction):
+@timing.timed('residual correction')
+def correct_features(input_fc, correct):
+    # Move every vertex of a feature class with a vectorized function of (n, 2) coordinates.
+    # Shapes are read in one pass, corrected together and written back in a second pass.
+    desc = arcpy.Describe(input_fc)
+    sr = desc.spatialReference
+    has_z, has_m = desc.hasZ, desc.hasM
+
+    if desc.shapeType == 'Point':
+        with arcpy.da.SearchCursor(input_fc, ['SHAPE@XY']) as rows:
+            coords = [row[0] for row in rows]
+        valid = [xy is not None and xy[0] is not None for xy in coords]
+        moved = iter(correct([xy for xy, ok in zip(coords, valid) if ok]).tolist())
+        with arcpy.da.UpdateCursor(input_fc, ['SHAPE@XY']) as rows:
+            for row, ok in zip(rows, valid):
+                if ok:
+                    rows.updateRow([tuple(next(moved))])
+        return
+
+    # Shapes as lists of parts (rings for polygons) of points
+    shapes = []
+    with arcpy.da.SearchCursor(input_fc, ['SHAPE@']) as rows:
+        for shape, in rows:
+            if shape is None:
+                shapes.append(None)
+                continue
+            if desc.shapeType == 'Multipoint':
+                shapes.append([list(shape.getPart())])
+                continue
+            parts = []
+            for part in shape.getPart():
+                # Polygon interior rings follow a None separator
+                ring = []
+                for pt in part:
+                    if pt is None:
+                        parts.append(ring)
+                        ring = []
+                    else:
+                        ring.append(pt)
+                parts.append(ring)
+            shapes.append([ring for ring in parts if ring])
+
+    coords = [(pt.X, pt.Y) for parts in shapes if parts for ring in parts for pt in ring]
+    moved = iter(correct(coords).tolist() if coords else [])
+
+    geometry = getattr(arcpy, desc.shapeType)
+    with arcpy.da.UpdateCursor(input_fc, ['SHAPE@']) as rows:
+        for row, parts in zip(rows, shapes):
+            if parts is None:
+                continue
+            array = arcpy.Array()
+            for ring in parts:
+                points = arcpy.Array()
+                for pt in ring:
+                    x, y = next(moved)
+                    points.add(arcpy.Point(x, y, pt.Z, pt.M))
+                array.add(points)
+            if desc.shapeType == 'Multipoint':
+                array = array[0]
+            rows.updateRow([geometry(array, sr, has_z, has_m)])
+
+
+@timing.timed('error ellipses')
+def write_error_ellipses(points_fc, xfm, direction='Forward'):
+    # Standard error ellipses of transformed points from the transform parameter covariance,
+    # written to the ELLIPSE_FIELDS in one vectorized pass. Returns the number of points.
+    def compute(coords):
+        if direction == 'Forward':
+            cov = xfm.point_covariance(xfm.inverse_points(coords))
+        else:
+            cov = xfm.point_covariance(coords, inverse=True)
+        return error_ellipses(cov)
+
+    return open_store(points_fc).set_point_fields(ELLIPSE_FIELDS, compute)
+
+
+@timing.timed('Transform Features')
+def transform_features(input_fc, param_file, direction, ellipses=False):
 
     # X/Y offset from the center of the fc extent for link source points.
     LINK_OFFSET = 1000.0
@@ -16,7 +95,16 @@ def transform_features(input_fc, param_file, direction):
     xfm = Transform()
     xfm.load(param_file)
 
-    mgmt.RecalculateFeatureClassExtent(input_fc)
+    if direction not in ('Forward', 'Inverse'):
+        arcpy.AddError('Bad direction parameter: "%s"' % direction)
+        raise arcpy.ExecuteError
+
+    # The residual correction is removed before the inverse similarity transform
+    if xfm.correction is not None and direction == 'Inverse':
+        correct_features(input_fc, xfm.correction.remove)
+
+    with timing.span('extent'):
+        mgmt.RecalculateFeatureClassExtent(input_fc)
     desc = arcpy.Describe(input_fc)
     sr = desc.spatialReference
 
@@ -25,29 +113,43 @@ def transform_features(input_fc, param_file, direction):
     src_ul = arcpy.Point(ecx - LINK_OFFSET, ecy + LINK_OFFSET)
     src_lr = arcpy.Point(ecx + LINK_OFFSET, ecy - LINK_OFFSET)
 
+    similarity = xfm.similarity()
     links = []
     for src in (src_ul, src_lr):
 
         if direction == 'Forward':
-            dst = arcpy.Point(*xfm.forward((src.X, src.Y)))
-        elif direction == 'Inverse':
-            dst = arcpy.Point(*xfm.inverse((src.X, src.Y)))
+            dst = arcpy.Point(*similarity.forward((src.X, src.Y)))
         else:
-            arcpy.AddError('Bad direction parameter: "%s"' % direction)
-            raise arcpy.ExecuteError
+            dst = arcpy.Point(*similarity.inverse((src.X, src.Y)))
 
         links.append(arcpy.Polyline(arcpy.Array([src, dst]), sr))
 
-    arcpy.edit.TransformFeatures(input_fc, links, method='SIMILARITY')
-    mgmt.RecalculateFeatureClassExtent(input_fc)
+    with timing.span('similarity transform'):
+        arcpy.edit.TransformFeatures(input_fc, links, method='SIMILARITY')
+
+    # The residual correction is added after the forward similarity transform
+    if xfm.correction is not None and direction == 'Forward':
+        correct_features(input_fc, xfm.correction.apply)
+
+    with timing.span('extent'):
+        mgmt.RecalculateFeatureClassExtent(input_fc)
+
+    if ellipses:
+        if xfm.covariance is None:
+            arcpy.AddWarning('No parameter covariance in %s, recalculate the transform for error ellipses.'
+                             % param_file)
+        elif desc.shapeType != 'Point':
+            arcpy.AddWarning('Error ellipses are only written for point features.')
+        else:
+            count = write_error_ellipses(input_fc, xfm, direction)
+            arcpy.AddMessage('Error ellipses: %d' % count)
 
     return
 
 
 class TransformFeatures(object):
     def __init__(self):
-        self.label = "Transform Features"
-        self.description = "Apply transform to a feature class."
+        registry.describe(self)
         self.category = None
         self.canRunInBackground = False
 
@@ -88,6 +190,17 @@ class TransformFeatures(object):
         param.value = 'Forward'
         params.append(param)
 
+        # Error ellipses (point features)
+        param = arcpy.Parameter(
+            displayName='Error Ellipses',
+            name='ellipses',
+            datatype='GPBoolean',
+            parameterType='Optional',
+            direction='Input'
+        )
+        param.value = False
+        params.append(param)
+
         # Output feature class
         param = arcpy.Parameter(
             displayName='Output Features',
@@ -107,10 +220,11 @@ class TransformFeatures(object):
         input_fc = params[0].valueAsText
         param_file = params[1].valueAsText
         direction = params[2].valueAsText
+        ellipses = params[3].value
 
-        transform_features(input_fc, param_file, direction)
+        transform_features(input_fc, param_file, direction, ellipses)
 
-        params[3].value = input_fc
+        params[4].value = input_fc
 
         return
 
@@ -120,7 +234,8 @@ if __name__ == '__main__':
     input_fc = arcpy.GetParameterAsText(0)
     param_file = arcpy.GetParameterAsText(1)
     direction = arcpy.GetParameterAsText(2)
+    ellipses = arcpy.GetParameterAsText(3).lower() == 'true'
 
-    transform_features(input_fc, param_file, direction)
+    transform_features(input_fc, param_file, direction, ellipses)
 
-    arcpy.SetParameterAsText(3, input_fc)
+    arcpy.SetParameterAsText(4, input_fc)
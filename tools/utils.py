@@ -1,8 +1,10 @@
-import arcpy
-import arcpy.management as mgmt
+from tools.backend import arcpy
 
-import os.path
 import math
+import numpy as np
+
+from tools.feature_store import open_store
+import tools.registry as registry
 
 
 def create_points_feature_class(fc, sr=None):
@@ -14,28 +16,12 @@ def create_points_feature_class(fc, sr=None):
         arcpy.AddError('No spatial reference system.')
         return None
 
-    scratch_fc = os.path.join(arcpy.env.scratchWorkspace, os.path.basename(fc))
-
-    mgmt.CreateFeatureclass(*os.path.split(scratch_fc), 'POINT', spatial_reference=sr)
-    mgmt.AddField(scratch_fc, 'ELEVATION', 'DOUBLE')
-    mgmt.AddField(scratch_fc, 'TIME', 'TEXT', field_length=64)
-    mgmt.AddField(scratch_fc, 'NAME', 'TEXT', field_length=64)
-    mgmt.AddField(scratch_fc, 'DESCRIPTION', 'TEXT', field_length=64)
-    mgmt.AddField(scratch_fc, 'SYMBOL', 'TEXT', field_length=64)
-    mgmt.AddField(scratch_fc, 'TYPE', 'TEXT', field_length=64)
-    mgmt.AddField(scratch_fc, 'SAMPLES', 'LONG')
-
-    if fc != scratch_fc:
-        mgmt.Copy(scratch_fc, fc)
-        mgmt.Delete(scratch_fc)
-
-    return fc
+    return open_store(fc).create_points(sr)
 
 
 class CreatePointsFC(object):
     def __init__(self):
-        self.label = "Create Points Feature Class"
-        self.description = "Create an empty points feature class.."
+        registry.describe(self)
         self.category = None
         self.canRunInBackground = False
 
@@ -114,6 +100,51 @@ def dms_degrees(dms):
     return decimal
 
 
+def dms_degrees_array(deg, min, sec=None):
+    # Convert arrays of degrees, minutes and seconds to decimal degrees, with the
+    # same checks as dms_degrees. A single array is split as DDD.MMSSssss values,
+    # without seconds the minutes may be fractional.
+
+    deg = np.asarray(deg, dtype=np.float64)
+    if min is None:
+        dms = np.abs(deg)
+        whole = np.trunc(dms)
+        dms = np.round((dms - whole) * 100.0, 8)
+        min = np.trunc(dms)
+        sec = (dms - min) * 100.0
+        deg = np.copysign(whole, deg)
+    else:
+        min = np.asarray(min, dtype=np.float64)
+        if sec is None:
+            sec = (min - np.trunc(min)) * 60.0
+            min = np.trunc(min)
+        else:
+            sec = np.asarray(sec, dtype=np.float64)
+
+    bad = (min < 0.0) | (sec < 0.0) | (min >= 60.0) | (sec >= 60.0) | (deg != np.trunc(deg)) | (min != np.trunc(min))
+    if bad.any():
+        i = np.flatnonzero(bad)[0]
+        raise ValueError('Bad DMS value: deg=%s min=%s sec=%s' % (deg.flat[i], min.flat[i], sec.flat[i]))
+
+    decimal = min / 60.0 + sec / 3600.0
+    return np.where(deg < 0, deg - decimal, deg + decimal)
+
+
+def parse_rotation(text):
+    # Rotation expressed as signed decimal degrees or signed DMS ("deg min sec" or "deg min")
+    dms = text.split()
+    if len(dms) == 3:
+        deg, min, sec = dms
+        return dms_degrees([int(deg), int(min), float(sec)])
+    elif len(dms) == 2:
+        deg, min = dms
+        return dms_degrees([int(deg), float(min)])
+    elif len(dms) == 1:
+        return float(dms[0])
+    else:
+        raise ValueError('Bad rotation value: %s' % text)
+
+
 if __name__ == '__main__':
 
     values = (123.45, (123, 45), (123, 45, 00.0), -123.45, (-123, 45))
@@ -0,0 +1,253 @@
+import argparse
+import asyncio
+import logging
+import os
+import os.path
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tools.backend import arcpy
+from tools.import_gpx import import_gpx
+from tools.import_pnezd import import_pnezd
+
+
+#
+# WatchFolder - import GPX and PNEZD files as they are dropped into a folder
+#
+# The folder is polled with os.scandir, which works the same on local disks and
+# network shares. A file is queued once its size and mtime have stopped changing
+# for the settle time, so partially copied downloads are not read. The scans run
+# on the event loop's default executor so a slow share doesn't stall the loop.
+# Imports run incrementally one at a time on a single import thread: the tools
+# set process wide arcpy.env settings and geodatabase writes are not thread
+# safe. The queue is bounded: when it is full the scanner waits, which holds back
+# new work until the imports catch up.
+#
+#   python -m tools.watch_folder D:\Field\Incoming --points D:\Project\Project.gdb\Points\Field
+#       --waypoints D:\Project\Project.gdb\Points\Waypoints --params D:\Project\transform\Params.txt
+#
+
+log = logging.getLogger('transform_tools.watch_folder')
+
+# Seconds between folder scans
+POLL_INTERVAL = 2.0
+
+# Seconds a file must be unchanged before it is imported
+SETTLE_SECS = 5.0
+
+# Maximum number of files waiting for import
+QUEUE_SIZE = 100
+
+# Seconds between queue status messages
+STATUS_INTERVAL = 60.0
+
+GPX_SUFFIXES = ('.gpx',)
+PNEZD_SUFFIXES = ('.txt', '.csv')
+
+
+class FolderWatcher(object):
+    """ Poll a folder and import new or changed GPX and PNEZD files.
+        :param folder: folder to watch
+        :param points_fc: output points feature class for PNEZD files
+        :param waypoints_fc: output waypoint feature class for GPX files
+        :param param_file: transform parameters applied to PNEZD points, re-read for each import
+
+    """
+
+    def __init__(self, folder, points_fc=None, waypoints_fc=None, param_file=None, interval=POLL_INTERVAL,
+                 settle=SETTLE_SECS, queue_size=QUEUE_SIZE):
+        self.folder = folder
+        self.points_fc = points_fc
+        self.waypoints_fc = waypoints_fc
+        self.param_file = param_file
+        self.interval = interval
+        self.settle = settle
+        self.queue_size = queue_size
+
+        # path -> (signature, first seen) while a file is settling
+        self.pending = {}
+        # path -> signature of the last import, queued or running
+        self.imported = {}
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+
+        self.queue = None
+        self.stopping = None
+        self.executor = None
+        self.params_signature = None
+
+    def _signature(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime
+
+    def _is_param_file(self, path):
+        return bool(self.param_file) and os.path.abspath(path) == os.path.abspath(self.param_file)
+
+    def _output(self, path):
+        # Output feature class for a source file, None for files that are not imported
+        suffix = os.path.splitext(path)[1].lower()
+        if suffix in GPX_SUFFIXES:
+            return self.waypoints_fc
+        if suffix in PNEZD_SUFFIXES:
+            return self.points_fc
+        return None
+
+    def metrics(self):
+        return {
+            'queue_depth': self.queue.qsize() if self.queue else 0,
+            'queue_size': self.queue_size,
+            'active': self.active,
+            'pending': len(self.pending),
+            'completed': self.completed,
+            'failed': self.failed,
+        }
+
+    def scan(self):
+        # Files that have settled since the last scan
+        now = time.monotonic()
+        ready = []
+
+        # A new transform re-imports the PNEZD files
+        if self.param_file:
+            signature = self._signature(self.param_file)
+            if self.params_signature is not None and signature != self.params_signature:
+                log.info('Transform parameters changed: %s', self.param_file)
+                for path in list(self.imported):
+                    if os.path.splitext(path)[1].lower() in PNEZD_SUFFIXES:
+                        del self.imported[path]
+            self.params_signature = signature
+
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if not entry.is_file() or self._output(entry.path) is None or self._is_param_file(entry.path):
+                    continue
+                signature = self._signature(entry.path)
+                if signature is None or self.imported.get(entry.path) == signature:
+                    continue
+                seen = self.pending.get(entry.path)
+                if seen is None or seen[0] != signature:
+                    self.pending[entry.path] = (signature, now)
+                elif now - seen[1] >= self.settle:
+                    del self.pending[entry.path]
+                    ready.append((entry.path, signature))
+
+        return sorted(ready)
+
+    def import_file(self, path):
+        # Runs on the import thread
+        if os.path.splitext(path)[1].lower() in GPX_SUFFIXES:
+            import_gpx(path, self.waypoints_fc, None, None, workers=1, incremental=True)
+        else:
+            import_pnezd(path, self.param_file, self.points_fc, incremental=True)
+
+    async def scanner(self):
+        loop = asyncio.get_running_loop()
+        while not self.stopping.is_set():
+            for path, signature in await loop.run_in_executor(None, self.scan):
+                # Mark before waiting on a full queue so the file is not queued twice
+                self.imported[path] = signature
+                await self.queue.put(path)
+                log.debug('Queued %s (queue depth %d)', path, self.queue.qsize())
+                if self.stopping.is_set():
+                    break
+            try:
+                await asyncio.wait_for(self.stopping.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            path = await self.queue.get()
+            self.active += 1
+            started = time.perf_counter()
+            try:
+                await loop.run_in_executor(self.executor, self.import_file, path)
+                self.completed += 1
+                log.info('Imported %s (%.2f s, queue depth %d)', path, time.perf_counter() - started, self.queue.qsize())
+            except Exception:
+                # Retried once the file changes again
+                self.failed += 1
+                log.exception('Import failed: %s', path)
+            finally:
+                self.active -= 1
+                self.queue.task_done()
+
+    async def status(self):
+        while not self.stopping.is_set():
+            try:
+                await asyncio.wait_for(self.stopping.wait(), STATUS_INTERVAL)
+            except asyncio.TimeoutError:
+                log.info('Status: %s', ' '.join('%s=%d' % item for item in self.metrics().items()))
+
+    def stop(self):
+        log.info('Stopping, %d files queued', self.queue.qsize() if self.queue else 0)
+        self.stopping.set()
+
+    async def run(self):
+        self.queue = asyncio.Queue(self.queue_size)
+        self.stopping = asyncio.Event()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='import')
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                # Windows event loops have no signal handlers, Ctrl+C raises KeyboardInterrupt
+                pass
+
+        log.info('Watching %s', self.folder)
+        worker = asyncio.ensure_future(self.worker())
+        status = asyncio.ensure_future(self.status())
+        try:
+            await self.scanner()
+
+            # Finish the queued files before exiting
+            await self.queue.join()
+        finally:
+            self.stopping.set()
+            for task in (worker, status):
+                task.cancel()
+            await asyncio.gather(worker, status, return_exceptions=True)
+            self.executor.shutdown(wait=True)
+            log.info('Stopped: %s', ' '.join('%s=%d' % item for item in self.metrics().items()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import GPX and PNEZD files dropped into a folder.')
+    parser.add_argument('folder', help='folder to watch')
+    parser.add_argument('--points', help='output points feature class for PNEZD files')
+    parser.add_argument('--waypoints', help='output waypoint feature class for GPX files')
+    parser.add_argument('--params', help='transform parameter file applied to PNEZD points')
+    parser.add_argument('--sr', help='output coordinate system (factory code) for GPX files')
+    parser.add_argument('--interval', type=float, default=POLL_INTERVAL, help='seconds between scans')
+    parser.add_argument('--settle', type=float, default=SETTLE_SECS, help='seconds a file must be unchanged')
+    parser.add_argument('--queue', type=int, default=QUEUE_SIZE, help='maximum number of queued files')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+
+    if not (args.points or args.waypoints):
+        parser.error('at least one of --points or --waypoints is required')
+
+    if args.sr:
+        arcpy.env.outputCoordinateSystem = arcpy.SpatialReference(int(args.sr) if args.sr.isdigit() else args.sr)
+
+    watcher = FolderWatcher(args.folder, args.points, args.waypoints, args.params, interval=args.interval,
+                            settle=args.settle, queue_size=args.queue)
+    try:
+        asyncio.run(watcher.run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
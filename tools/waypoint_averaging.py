@@ -0,0 +1,290 @@
+from tools.backend import arcpy
+import math
+import numpy as np
+
+from tools.feature_store import open_store
+from tools.import_gpx import gpx_files, read_waypoints
+from tools.points import PointSet
+import tools.registry as registry
+from tools.spatial_index import GridIndex
+from tools.utils import create_points_feature_class
+
+
+#
+# AverageWaypoints - Average waypoints collected over several sessions and GPX files
+#
+# Waypoints are grouped by canonical name, or by proximity clusters for unnamed or
+# inconsistently named samples, and averaged using the device SAMPLES count as the
+# weight. Dispersion is the weighted RMS horizontal distance from the mean position.
+#
+
+# Mean earth radius (m) for the local horizontal distances
+EARTH_RADIUS = 6371008.8
+
+# Default proximity cluster radius (m)
+CLUSTER_RADIUS = 5.0
+
+# Number of averaged points listed in the tool messages
+MAX_LISTED_POINTS = 100
+
+GROUP_BY_NAME = 'NAME'
+GROUP_BY_PROXIMITY = 'PROXIMITY'
+
+
+class Observations(object):
+    """ Waypoint observations from one or more GPX files held as column arrays.
+        lon, lat and elevation are in degrees and meters, weights are the SAMPLES
+        counts (1 where the device did not record any).
+
+    """
+
+    def __init__(self, points):
+        self.lon = points.xy[:, 0].copy()
+        self.lat = points.xy[:, 1].copy()
+        self.elevation = points.column('ELEVATION').copy()
+        self.weights = points.column('SAMPLES').filled(1).astype(np.float64)
+        self.weights[self.weights == 0] = 1.0
+        self.time = points.column('TIME').tolist()
+        self.name = points.column('NAME').tolist()
+        self.description = points.column('DESCRIPTION').tolist()
+        self.symbol = points.column('SYMBOL').tolist()
+        self.type = points.column('TYPE').tolist()
+
+    def __len__(self):
+        return len(self.lon)
+
+    def local_xy(self):
+        # Approximate local east/north coordinates in meters, good for distances over a few km
+        k = math.radians(1.0) * EARTH_RADIUS
+        return np.column_stack((self.lon * k * np.cos(np.radians(self.lat)), self.lat * k))
+
+
+def group_by_name(obs):
+    # Group index for each observation by canonical name, -1 for unnamed waypoints
+    groups = {}
+    labels = np.full(len(obs), -1, dtype=np.int64)
+    for i, name in enumerate(obs.name):
+        if name:
+            labels[i] = groups.setdefault(name, len(groups))
+    return labels
+
+
+def group_by_proximity(obs, radius):
+    # Group index for each observation from clusters of observations linked within radius (m)
+    n = len(obs)
+    i, j, _ = GridIndex(obs.local_xy(), radius).pairs(radius)
+
+    # Connected components by min-label propagation with pointer jumping
+    labels = np.arange(n)
+    while True:
+        low = np.minimum(labels[i], labels[j])
+        update = labels.copy()
+        np.minimum.at(update, i, low)
+        np.minimum.at(update, j, low)
+        update = update[update]
+        if np.array_equal(update, labels):
+            break
+        labels = update
+
+    return np.unique(labels, return_inverse=True)[1]
+
+
+def average_groups(obs, labels):
+    """ Sample weighted mean positions for each group.
+        :param obs: Observations
+        :param labels: group index for each observation, -1 to skip
+        :return: dict of column arrays for the groups - lon, lat, elevation, dispersion,
+            observations, samples and the index of the representative observation
+
+    """
+    keep = labels >= 0
+    labels, index = labels[keep], np.flatnonzero(keep)
+    count = labels.max() + 1 if len(labels) else 0
+
+    w = obs.weights[index]
+    lon, lat = obs.lon[index], obs.lat[index]
+    wsum = np.bincount(labels, weights=w, minlength=count)
+
+    mean_lon = np.bincount(labels, weights=w * lon, minlength=count) / wsum
+    mean_lat = np.bincount(labels, weights=w * lat, minlength=count) / wsum
+
+    # Elevation averaged over the observations that have one
+    ele = obs.elevation[index]
+    has_ele = ~np.isnan(ele)
+    ele_w = np.bincount(labels[has_ele], weights=w[has_ele], minlength=count)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_ele = np.bincount(labels[has_ele], weights=(w * ele)[has_ele], minlength=count) / ele_w
+
+    # Weighted RMS distance (m) from the mean position
+    k = math.radians(1.0) * EARTH_RADIUS
+    dx = (lon - mean_lon[labels]) * k * np.cos(np.radians(mean_lat[labels]))
+    dy = (lat - mean_lat[labels]) * k
+    dispersion = np.sqrt(np.bincount(labels, weights=w * (dx * dx + dy * dy), minlength=count) / wsum)
+
+    # The observation with the most samples names the group
+    order = np.lexsort((-w, labels))
+    _, first = np.unique(labels[order], return_index=True)
+
+    return {
+        'lon': mean_lon,
+        'lat': mean_lat,
+        'elevation': mean_ele,
+        'dispersion': dispersion,
+        'observations': np.bincount(labels, minlength=count),
+        'samples': wsum.astype(np.int64),
+        'representative': index[order[first]],
+        'last_time': _last_time(obs, labels, index, count),
+    }
+
+
+def _last_time(obs, labels, index, count):
+    # Latest TIME for each group, GPX times are ISO 8601 UTC and compare as strings
+    last = [None] * count
+    for group, i in zip(labels.tolist(), index.tolist()):
+        t = obs.time[i]
+        if t and (last[group] is None or t > last[group]):
+            last[group] = t
+    return last
+
+
+def average_waypoints(gpx_paths, group_by, radius, points_fc):
+
+    GCS_WGS_84 = arcpy.SpatialReference(4326)
+    GCS_TRANSFORMS = 'WGS_1984_(ITRF08)_To_NAD_1983_2011; NAD_1927_To_NAD_1983_NADCON'
+
+    arcpy.env.geographicTransformations = arcpy.env.geographicTransformations or GCS_TRANSFORMS
+    arcpy.env.addOutputsToMap = False
+
+    sr = arcpy.env.outputCoordinateSystem
+    if sr is None:
+        arcpy.AddError('Geoprocessing environment not set: outputCoordinateSystem')
+        raise arcpy.ExecuteError
+
+    files = gpx_files(gpx_paths.split(';') if isinstance(gpx_paths, str) else gpx_paths)
+    obs = Observations(PointSet.concatenate(read_waypoints(gpx_file) for gpx_file in files))
+
+    arcpy.AddMessage('GPX files: %d  Waypoint observations: %d' % (len(files), len(obs)))
+    if not len(obs):
+        return None
+
+    group_by = (group_by or GROUP_BY_NAME).upper()
+    radius = float(radius or CLUSTER_RADIUS)
+    if group_by == GROUP_BY_PROXIMITY:
+        labels = group_by_proximity(obs, radius)
+    else:
+        labels = group_by_name(obs)
+        skipped = np.count_nonzero(labels < 0)
+        if skipped:
+            arcpy.AddWarning('Skipping %d unnamed waypoints' % skipped)
+
+    groups = average_groups(obs, labels)
+
+    # Output units for elevation and dispersion
+    units = sr.metersPerUnit or 1.0
+
+    xy = []
+    for lon, lat in zip(groups['lon'].tolist(), groups['lat'].tolist()):
+        pt = arcpy.PointGeometry(arcpy.Point(lon, lat), GCS_WGS_84).projectAs(sr).firstPoint
+        xy.append((pt.X, pt.Y))
+
+    representative = groups['representative'].tolist()
+    points = PointSet.from_columns(xy, {
+        'TIME': groups['last_time'],
+        'NAME': [obs.name[i] or 'AVG-%04d' % (g + 1) for g, i in enumerate(representative)],
+        'DESCRIPTION': ['AVG %d obs %.3f RMS' % (count, dispersion / units) for count, dispersion in
+                        zip(groups['observations'].tolist(), groups['dispersion'].tolist())],
+        'SYMBOL': [obs.symbol[i] for i in representative],
+        'TYPE': [obs.type[i] for i in representative],
+        'SAMPLES': groups['samples'].astype(np.int64).tolist(),
+    })
+    points.data['ELEVATION'] = np.round(groups['elevation'] / units, 4)
+
+    for _, _, _, name, description, _, _, _ in points[:MAX_LISTED_POINTS]:
+        arcpy.AddMessage('%s: %s' % (name, description))
+    if len(points) > MAX_LISTED_POINTS:
+        arcpy.AddMessage('... %d more points' % (len(points) - MAX_LISTED_POINTS))
+
+    create_points_feature_class(points_fc, sr)
+    open_store(points_fc).insert_points(points)
+
+    arcpy.AddMessage('Averaged points: %d' % len(points))
+
+    return points_fc
+
+
+class AverageWaypoints(object):
+    def __init__(self):
+        registry.describe(self)
+        self.category = None
+        self.canRunInBackground = False
+
+    def getParameterInfo(self):
+        params = []
+
+        # Input GPX files or folders
+        param = arcpy.Parameter(
+            displayName='Input GPX Files',
+            name='gpx_files',
+            datatype='DEFile',
+            parameterType='Required',
+            direction='Input',
+            multiValue=True
+        )
+        param.filter.list = ['gpx']
+        params.append(param)
+
+        # Grouping method
+        param = arcpy.Parameter(
+            displayName='Group By',
+            name='group_by',
+            datatype='GPString',
+            parameterType='Required',
+            direction='Input'
+        )
+        param.filter.type = 'ValueList'
+        param.filter.list = [GROUP_BY_NAME, GROUP_BY_PROXIMITY]
+        param.value = GROUP_BY_NAME
+        params.append(param)
+
+        # Proximity cluster radius
+        param = arcpy.Parameter(
+            displayName='Cluster Radius (meters)',
+            name='radius',
+            datatype='GPDouble',
+            parameterType='Optional',
+            direction='Input'
+        )
+        param.value = CLUSTER_RADIUS
+        params.append(param)
+
+        # Output points feature class
+        param = arcpy.Parameter(
+            displayName='Output Points Feature Class',
+            name='points_fc',
+            datatype='DEFeatureClass',
+            parameterType='Required',
+            direction='Output'
+        )
+        params.append(param)
+
+        return params
+
+    def execute(self, params, messages):
+        gpx_paths = params[0].valueAsText
+        group_by = params[1].valueAsText
+        radius = params[2].valueAsText
+        points_fc = params[3].valueAsText
+
+        average_waypoints(gpx_paths, group_by, radius, points_fc)
+
+        return
+
+
+if __name__ == '__main__':
+
+    gpx_paths = arcpy.GetParameterAsText(0)
+    group_by = arcpy.GetParameterAsText(1)
+    radius = arcpy.GetParameterAsText(2)
+    points_fc = arcpy.GetParameterAsText(3)
+
+    average_waypoints(gpx_paths, group_by, radius, points_fc)